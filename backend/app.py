@@ -1,23 +1,37 @@
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 import requests
 from twilio_controller.affirmation_generation import generate_affirmation
 from twilio_controller.advice_generation import parse_output
 from twilio_controller.reminder_generation import generate_reminders
-import psycopg
+from twilio_controller.db_pool import connection, pool_stats
+from twilio_controller.digest_cache import cached_digest, week_fingerprint
+from twilio_controller.digest_stream import digest_events, STREAM_HEADERS
+from twilio_controller.llm_cache import stats as llm_cache_stats
+from twilio_controller.llm_gateway import stats as llm_gateway_stats
+from twilio_controller.single_flight import Overloaded
+from twilio_controller.weekly_context import weekly_snapshot
+from twilio_controller.stim_rollup import top_of_week
+from backend import queries
+from backend.queries import result_to_dict
+from concurrent.futures import ThreadPoolExecutor, wait
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
+# Bounded pool the /home sections run on, shared across requests
+dashboard_executor = ThreadPoolExecutor(max_workers=int(os.getenv('DASHBOARD_WORKERS', 8)))
+DASHBOARD_TIMEOUT = float(os.getenv('DASHBOARD_TIMEOUT', 20))
 
-def result_to_dict(cursor, result):
-    columns = [desc[0] for desc in cursor.description]
-    return [dict(zip(columns, row)) for row in result]
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
 
 #USER CREATE
 @app.route('/user', methods = ['POST'])
@@ -27,13 +41,11 @@ def create_user():
     username = data.get('username')
     if not username: 
         return jsonify({'error': 'username is required'}), 400
-    
-    sql = 'INSERT INTO "User" (username) VALUES (%s) RETURNING *'
 
     try: 
-        with psycopg.connect(SUPABASE_URL) as conn: 
+        with connection() as conn: 
             with conn.cursor() as cur: 
-                cur.execute(sql, (username,))
+                cur.execute(queries.CREATE_USER, (username,))
                 new_user = cur.fetchall()
                 conn.commit()
                 return jsonify(result_to_dict(cur, new_user))
@@ -43,11 +55,10 @@ def create_user():
 #USER READ
 @app.route('/user/<int:user_id>',methods = ['GET'])
 def get_user(user_id): 
-    sql = 'SELECT * FROM "User" WHERE id = %s'
     try: 
-        with psycopg.connect(SUPABASE_URL) as conn: 
+        with connection() as conn: 
             with conn.cursor() as cur: 
-                cur.execute(sql, (user_id,))
+                cur.execute(queries.GET_USER, (user_id,))
                 user = cur.fetchall()
                 if not user: 
                     return jsonify({"message": "User not found"}), 404
@@ -65,11 +76,10 @@ def update_user():
     if not user_id or not username:
         return jsonify({"error": "user_id and username are required"}), 400
 
-    sql = 'UPDATE "User" SET username = %s WHERE id = %s RETURNING *'
     try:
-        with psycopg.connect(SUPABASE_URL) as conn:
+        with connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (username, user_id))
+                cur.execute(queries.UPDATE_USER, (username, user_id))
                 updated_user = cur.fetchall()
                 conn.commit()
                 if not updated_user:
@@ -87,11 +97,10 @@ def delete_user():
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
 
-    sql = 'DELETE FROM "User" WHERE id = %s'
     try:
-        with psycopg.connect(SUPABASE_URL) as conn:
+        with connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (user_id,))
+                cur.execute(queries.DELETE_USER, (user_id,))
                 # cur.rowcount will be 1 if a row was deleted, 0 otherwise
                 if cur.rowcount == 0:
                     return jsonify({"message": "User not found"}), 404
@@ -107,86 +116,106 @@ def get_call_by_date():
     if not date:
         return jsonify({"error": "Missing 'date' query parameter"}), 400
 
-    query = '''
-        SELECT uc.id, uc.raw_text, ci.insight, uc.created_at
-        FROM "User_Call" uc
-        JOIN "Call_Insights" ci ON uc.id = ci.call_id
-        WHERE DATE(uc.created_at) = %s
-    '''
-
     try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        cur.execute(query, (date,))
-        rows = cur.fetchall()
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(queries.CALLS_BY_DATE, (date, date))
+                rows = cur.fetchall()
 
         # Format as JSON-friendly structure - now including id
-        entries = [{"id": row[0], "raw_text": row[1], "insight": row[2], "created_at": row[3]} for row in rows]
+        return jsonify({"entries": queries.call_entries(rows)})
+
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+@app.route('/call_logs/range', methods=['GET'])
+def get_calls_by_range():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    user_id = request.args.get('user_id', type=int)
+    mode = request.args.get('mode', 'entries')
+
+    start, end, mode, error = queries.parse_range(start, end, mode)
+    if error:
+        return jsonify({"error": error}), 400
+
+    query = queries.CALLS_BY_RANGE_SUMMARY if mode == 'summary' else queries.CALLS_BY_RANGE
+
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, (start, end, user_id, user_id))
+                rows = cur.fetchall()
+
+        if mode == 'summary':
+            return jsonify({"days": queries.day_summaries(rows)})
 
-        return jsonify({"entries": entries})
+        return jsonify({"days": queries.calls_by_day(rows)})
 
     except Exception as e:
         print(f"Error connecting or querying Supabase: {e}")
         return jsonify({"error": "Database query failed"}), 500
 
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+def _stream_emotion_mappings():
+    with connection() as conn:
+        with conn.cursor(name='emotion_mapping') as cur:
+            cur.execute(queries.EMOTION_MAPPING_ALL)
+
+            # One chunk per fetched batch rather than one write per fragment
+            writer = queries.EmotionMappingWriter()
+            while True:
+                rows = cur.fetchmany(queries.EMOTION_MAPPING_FETCH_SIZE)
+                if not rows:
+                    break
+                yield writer.feed(rows)
+
+            yield writer.close()
 
 @app.route('/stimulus/emotion-mapping', methods=['GET'])
 def get_emotion_mappings():
-    query = '''
-        SELECT name, created_at, anger, fear, joy, love, sadness, surprise, id
-        FROM "Stimuli"
-        ORDER BY name, created_at
-    '''
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+
+    if limit is None:
+        chunks = _stream_emotion_mappings()
+        try:
+            first = next(chunks)  # runs the query so db errors still get a 500
+        except Exception as e:
+            print(f"Error connecting or querying Supabase: {e}")
+            return jsonify({"error": "Database query failed"}), 500
+
+        def body():
+            # Closing chunks returns the connection and its server-side cursor
+            # as soon as the client goes away
+            try:
+                yield first
+                yield from chunks
+            finally:
+                chunks.close()
+
+        return Response(body(), mimetype='application/json')
+
+    # Keyset pagination on (name, created_at, id)
+    limit = max(1, min(limit, queries.EMOTION_MAPPING_PAGE_MAX))
+
+    try:
+        after = queries.decode_cursor(cursor) if cursor else [None, None, None]
+    except ValueError:
+        return jsonify({"error": "Invalid 'cursor' query parameter"}), 400
 
     try:
-        conn = psycopg.connect(
-            os.getenv('SUPABASE_URL'),
-            options="-c prepare_threshold=0"
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        rows = cur.fetchall()
-
-        # Group by stimulus name
-        result = {}
-        for row in rows:
-            name, created_at, anger, fear, joy, love, sadness, surprise, id = row
-
-            entry = {
-                "created_at": created_at.isoformat() if created_at else None,
-                "emotions": {
-                    "anger": anger,
-                    "fear": fear,
-                    "joy": joy,
-                    "love": love,
-                    "sadness": sadness,
-                    "surprise": surprise,
-                },
-                "stim_id": id
-            }
-
-            if name not in result:
-                result[name] = []
-            result[name].append(entry)
-
-        return jsonify(result)
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(queries.EMOTION_MAPPING_PAGE, queries.emotion_mapping_page_params(after, limit))
+                rows = cur.fetchall()
+
+        return jsonify(queries.emotion_mapping_page(rows, limit))
 
     except Exception as e:
         print(f"Error connecting or querying Supabase: {e}")
         return jsonify({"error": "Database query failed"}), 500
 
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
-
 
 @app.route('/insight/get-by-stim-id', methods=['GET'])
 def get_insight_by_stim_id():
@@ -195,41 +224,51 @@ def get_insight_by_stim_id():
     if not stim_id:
         return jsonify({"error": "Missing 'id' query parameter"}), 400
 
-    query = '''
-        SELECT ci.created_at, ci.insight
-        FROM "Call_Insights" ci
-        JOIN "Stim_Insight" si ON ci.id = si.insight_id
-        WHERE si.stim_id = %s
-        ORDER BY ci.created_at
-    '''
-
     try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        cur.execute(query, (stim_id,))
-        rows = cur.fetchall()
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(queries.INSIGHTS_BY_STIM_ID, (stim_id,))
+                rows = cur.fetchall()
 
         # Format as JSON-friendly structure
-        entries = [
-            {
-                "created_at": row[0].isoformat() if row[0] else None,
-                "insight": row[1]
-            }
-            for row in rows
-        ]
-
-        return jsonify({"entries": entries})
+        return jsonify({"entries": queries.insight_entries(rows)})
 
     except Exception as e:
         print(f"Error connecting or querying Supabase: {e}")
         return jsonify({"error": "Database query failed"}), 500
 
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+@app.route('/insight/get-by-stim-ids', methods=['GET', 'POST'])
+def get_insights_by_stim_ids():
+    # ids come in as ?ids=1,2,3 or, for long lists, a JSON body {"ids": [...]}
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        ids = data.get('ids') or []
+        limit = data.get('limit')
+        since = data.get('since')
+    else:
+        ids = [i for i in request.args.get('ids', '').split(',') if i]
+        limit = request.args.get('limit')
+        since = request.args.get('since')
+
+    stim_ids, error = queries.parse_stim_ids(ids)
+    if error:
+        return jsonify({"error": error}), 400
+
+    limit, since, error = queries.parse_insight_filters(limit, since)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(queries.INSIGHTS_BY_STIM_IDS, (stim_ids, since, since, limit, limit))
+                rows = cur.fetchall()
+
+        return jsonify({"insights": queries.insights_by_stim(stim_ids, rows)})
+
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
 
 @app.route('/stimulus/get-by-call-id', methods=['GET'])
 def get_insight_by_id():
@@ -238,133 +277,116 @@ def get_insight_by_id():
     if not call_id:
         return jsonify({"error": "Missing 'id' query parameter"}), 400
 
-    query = '''
-        SELECT name, anger, fear, joy, love, sadness, surprise
-        FROM "Stimuli"
-        WHERE user_call_id = %s
-    '''
-
     try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        cur.execute(query, (call_id,))
-        rows = cur.fetchall()
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(queries.STIMS_BY_CALL_ID, (call_id,))
+                rows = cur.fetchall()
 
         # Format as JSON-friendly structure
-        entries = [
-            {
-                "name":row[0],
-                "emotions": {
-                    "anger": row[1],
-                    "fear": row[2],
-                    "joyr": row[3],
-                    "love": row[4],
-                    "sadness": row[5],
-                    "surprise": row[6]
-                }
-            }
-            for row in rows
-        ]
-
-        return jsonify({"stims": entries})
+        return jsonify({"stims": queries.stim_entries(rows)})
 
     except Exception as e:
         print(f"Error connecting or querying Supabase: {e}")
         return jsonify({"error": "Database query failed"}), 500
 
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
-
 
 
 @app.route('/get-todays-affirmation', methods=['GET'])
 def get_affirmation():
-    affirmation = generate_affirmation()
+    user_id = request.args.get('user_id', type=int)
+    affirmation = cached_digest('affirmation', lambda: generate_affirmation(user_id), user_id)
 
     return jsonify({"affirmation": affirmation})
 
+@app.route('/get-todays-affirmation/stream', methods=['GET'])
+def stream_affirmation():
+    user_id = request.args.get('user_id', type=int)
+    # Overloaded raised here becomes a 503 before the stream starts
+    return Response(digest_events('affirmation', user_id), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
 @app.route('/get-todays-reminders', methods=['GET'])
 def get_reminders():
-    reminders = generate_reminders()
+    user_id = request.args.get('user_id', type=int)
+    reminders = cached_digest('reminders', lambda: generate_reminders(user_id), user_id)
     return jsonify({"reminders": reminders})
 
 @app.route('/get-todays-advice', methods=['GET'])
 def get_advice():
-    advice = parse_output()
+    user_id = request.args.get('user_id', type=int)
+    advice = cached_digest('advice', lambda: parse_output(user_id), user_id)
     return jsonify({"advice": advice})
 
+@app.route('/get-todays-advice/stream', methods=['GET'])
+def stream_advice():
+    user_id = request.args.get('user_id', type=int)
+    return Response(digest_events('advice', user_id), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+def top_emotions_of_week(user_id=None):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            rows = top_of_week(cur, user_id)
+
+    return queries.top_emotion_entries(rows)
+
 @app.route('/stimulus/week-top-emotions', methods=['GET'])
 def get_top_emotions_of_week():
-    query = '''
-    SELECT
-        s.name,
-        COUNT(*) AS mentions,
-        AVG(s.anger)   AS avg_anger,
-        AVG(s.fear)    AS avg_fear,
-        AVG(s.joy)     AS avg_joy,
-        AVG(s.love)    AS avg_love,
-        AVG(s.sadness) AS avg_sadness,
-        AVG(s.surprise) AS avg_surprise
-    FROM "Stimuli" s
-    WHERE s.created_at >= NOW() - INTERVAL '7 days'
-    GROUP BY s.name
-    ORDER BY mentions DESC
-    LIMIT 3;
-    '''
     try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-        cur.execute(query)
-        rows = cur.fetchall()
-
-        # Format as JSON-friendly structure with normalized emotions
-        entries = []
-        for row in rows:
-            # Extract raw emotion values (handling None values)
-            emotions = {
-                "anger": float(row[2]) if row[2] is not None else 0.0,
-                "fear": float(row[3]) if row[3] is not None else 0.0,
-                "joy": float(row[4]) if row[4] is not None else 0.0,
-                "love": float(row[5]) if row[5] is not None else 0.0,
-                "sadness": float(row[6]) if row[6] is not None else 0.0,
-                "surprise": float(row[7]) if row[7] is not None else 0.0,
-            }
-
-            # Calculate the sum for normalization
-            emotion_sum = sum(emotions.values())
-
-            # Normalize emotions (handle case where sum is 0)
-            if emotion_sum > 0:
-                normalized_emotions = {
-                    emotion: value / emotion_sum
-                    for emotion, value in emotions.items()
-                }
-            else:
-                # If all emotions are 0, distribute equally
-                normalized_emotions = {
-                    emotion: 1.0 / 6
-                    for emotion in emotions.keys()
-                }
-
-            entries.append({
-                "name": row[0] if row[0] else None,
-                "mentions": row[1],
-                "emotions": normalized_emotions
-            })
-
-        return jsonify({"top_stims": entries})
+        user_id = request.args.get('user_id', type=int)
+        return jsonify({"top_stims": top_emotions_of_week(user_id)})
     except Exception as e:
         print(f"Error connecting or querying Supabase: {e}")
         return jsonify({"error": "Database query failed"}), 500
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+
+@app.route('/home', methods=['GET'])
+def get_home():
+    user_id = request.args.get('user_id', type=int)
+
+    # Fingerprint and load the week once up front so every section reads the same snapshot
+    fingerprint = None
+    try:
+        fingerprint = week_fingerprint(user_id)
+        weekly_snapshot(user_id, fingerprint)
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+
+    sections = {
+        "affirmation": lambda: cached_digest('affirmation', lambda: generate_affirmation(user_id), user_id, fingerprint),
+        "reminders": lambda: cached_digest('reminders', lambda: generate_reminders(user_id), user_id, fingerprint),
+        "advice": lambda: cached_digest('advice', lambda: parse_output(user_id), user_id, fingerprint),
+        "top_stims": lambda: top_emotions_of_week(user_id),
+    }
+    futures = {name: dashboard_executor.submit(fn) for name, fn in sections.items()}
+    wait(futures.values(), timeout=DASHBOARD_TIMEOUT)
+
+    payload = {}
+    errors = {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            payload[name] = None
+            errors[name] = "Timed out"
+        elif future.exception() is not None:
+            print(f"Error generating {name}: {future.exception()}")
+            payload[name] = None
+            errors[name] = str(future.exception())
+        else:
+            payload[name] = future.result()
+
+    payload["errors"] = errors
+    return jsonify(payload)
+
+@app.route('/internal/db-pool-stats', methods=['GET'])
+def get_db_pool_stats():
+    return jsonify(pool_stats())
+
+@app.route('/internal/llm-cache-stats', methods=['GET'])
+def get_llm_cache_stats():
+    return jsonify(llm_cache_stats())
+
+@app.route('/internal/llm-stats', methods=['GET'])
+def get_llm_stats():
+    return jsonify(llm_gateway_stats())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,443 @@
+import os
+import asyncio
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+from dotenv import load_dotenv
+from twilio_controller import affirmation_generation, advice_generation, reminder_generation
+from twilio_controller.async_db_pool import async_connection, async_pool_stats, close_async_pool
+from twilio_controller.digest_cache import FINGERPRINT_QUERY, fingerprint_row, lookup, store
+from twilio_controller.llm_cache import stats as llm_cache_stats
+from twilio_controller.llm_gateway import chat_async, chat_stream_async, stats as llm_gateway_stats
+from twilio_controller.digest_stream import STREAMED_DIGESTS, STREAM_HEADERS, AsyncEventStream, DigestEvents, cached_events, error_events, sse
+from twilio_controller.single_flight import AsyncSingleFlight, Overloaded
+from twilio_controller.weekly_context import weekly_snapshot_async
+from twilio_controller.weekly_prompt import messages_for
+from twilio_controller.stim_rollup import TOP_OF_WEEK
+from backend import queries
+from backend.queries import result_to_dict
+
+# Async serving mode for the same routes and payloads as app.py. Requests waiting
+# on Postgres or OpenAI don't hold a thread, so slow LLM calls can't starve the
+# cheap CRUD routes. Run with an ASGI server, e.g.
+#   hypercorn backend.asgi_app:app --bind 0.0.0.0:8080
+
+load_dotenv()
+
+app = cors(Quart(__name__))
+
+llm_flight = AsyncSingleFlight()
+
+DASHBOARD_TIMEOUT = float(os.getenv('DASHBOARD_TIMEOUT', 20))
+
+# The prompt for each digest comes from the same module the sync app uses
+DIGESTS = {
+    'affirmation': (affirmation_generation.SYSTEM_PROMPT, affirmation_generation.text_for_llm, None),
+    'reminders': (reminder_generation.SYSTEM_PROMPT, reminder_generation.text_for_llm, None),
+    'advice': (advice_generation.SYSTEM_PROMPT, advice_generation.text_for_llm, advice_generation.parse_advice),
+}
+
+
+@app.after_serving
+async def shutdown():
+    await close_async_pool()
+
+@app.errorhandler(Overloaded)
+async def handle_overloaded(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+async def fetch_all(query, params=()):
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+async def _complete(kind, system_prompt, prompt):
+    # Same site names as the sync generators, so both apps share cached completions
+    return await chat_async(kind, messages_for(system_prompt, prompt))
+
+async def week_fingerprint(user_id=None):
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(FINGERPRINT_QUERY, (user_id, user_id))
+            return fingerprint_row(await cur.fetchone())
+
+async def digest(kind, user_id=None, fingerprint=None):
+    """Async counterpart of cached_digest(kind, generate_x) in app.py, sharing its cache."""
+    system_prompt, text_for_llm, parse = DIGESTS[kind]
+
+    if fingerprint is None:
+        fingerprint = await week_fingerprint(user_id)
+    hit, value = await asyncio.to_thread(lookup, kind, user_id, fingerprint)
+    if hit:
+        return value
+
+    snapshot = await weekly_snapshot_async(user_id, fingerprint)
+    prompt = text_for_llm(user_id, snapshot)
+
+    # Identical concurrent prompts share one completion
+    value = await llm_flight.do((kind, prompt), _complete, kind, system_prompt, prompt)
+    if parse:
+        value = parse(value)
+
+    await asyncio.to_thread(store, kind, user_id, fingerprint, value)
+    return value
+
+async def generated_events(kind, user_id, fingerprint, pieces):
+    events = DigestEvents(kind)
+    try:
+        async for text in pieces:
+            for event in events.feed(text):
+                yield event
+        for event in events.close():
+            yield event
+    except Exception as e:
+        for event in error_events(kind, e):
+            yield event
+        return
+
+    await asyncio.to_thread(store, kind, user_id, fingerprint, events.value)
+    yield sse('done', {kind: events.value})
+
+async def as_async(events):
+    for event in events:
+        yield event
+
+async def digest_events(kind, user_id=None):
+    """Async counterpart of digest_stream.digest_events, same events, cache and admission control."""
+    try:
+        fingerprint = await week_fingerprint(user_id)
+        hit, value = await asyncio.to_thread(lookup, kind, user_id, fingerprint)
+        if hit:
+            return AsyncEventStream(as_async(cached_events(kind, value)))
+
+        module = STREAMED_DIGESTS[kind]
+        prompt = module.text_for_llm(user_id, await weekly_snapshot_async(user_id, fingerprint))
+    except Exception as e:
+        return AsyncEventStream(as_async(error_events(kind, e)))
+
+    pieces = await llm_flight.stream((kind, prompt), chat_stream_async, kind, messages_for(module.SYSTEM_PROMPT, prompt))
+    return AsyncEventStream(generated_events(kind, user_id, fingerprint, pieces), pieces)
+
+#USER CREATE
+@app.route('/user', methods = ['POST'])
+async def create_user():
+    data = await request.get_json()
+
+    username = data.get('username')
+    if not username:
+        return jsonify({'error': 'username is required'}), 400
+
+    try:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.CREATE_USER, (username,))
+                new_user = await cur.fetchall()
+                await conn.commit()
+                return jsonify(result_to_dict(cur, new_user))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+#USER READ
+@app.route('/user/<int:user_id>',methods = ['GET'])
+async def get_user(user_id):
+    try:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.GET_USER, (user_id,))
+                user = await cur.fetchall()
+                if not user:
+                    return jsonify({"message": "User not found"}), 404
+                return jsonify(result_to_dict(cur, user)[0])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+#USER UPDATE
+@app.route('/user/update_user',methods = ['POST'])
+async def update_user():
+    data = await request.get_json()
+    user_id = data.get('user_id')
+    username = data.get('username')
+    if not user_id or not username:
+        return jsonify({"error": "user_id and username are required"}), 400
+
+    try:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.UPDATE_USER, (username, user_id))
+                updated_user = await cur.fetchall()
+                await conn.commit()
+                if not updated_user:
+                    return jsonify({"message": "User not found"}), 404
+                return jsonify(result_to_dict(cur, updated_user)[0]), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# USER DELETE
+@app.route('/user/delete_user', methods = ['POST'])
+async def delete_user():
+    data = await request.get_json()
+    user_id = data.get('user_id')
+
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+
+    try:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.DELETE_USER, (user_id,))
+                # cur.rowcount will be 1 if a row was deleted, 0 otherwise
+                if cur.rowcount == 0:
+                    return jsonify({"message": "User not found"}), 404
+                await conn.commit()
+                return jsonify({"message": f"User with id {user_id} deleted successfully"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/call_logs/by_date', methods=['GET'])
+async def get_call_by_date():
+    date = request.args.get('date')
+
+    if not date:
+        return jsonify({"error": "Missing 'date' query parameter"}), 400
+
+    try:
+        rows = await fetch_all(queries.CALLS_BY_DATE, (date, date))
+        return jsonify({"entries": queries.call_entries(rows)})
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+@app.route('/call_logs/range', methods=['GET'])
+async def get_calls_by_range():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    user_id = request.args.get('user_id', type=int)
+    mode = request.args.get('mode', 'entries')
+
+    start, end, mode, error = queries.parse_range(start, end, mode)
+    if error:
+        return jsonify({"error": error}), 400
+
+    query = queries.CALLS_BY_RANGE_SUMMARY if mode == 'summary' else queries.CALLS_BY_RANGE
+
+    try:
+        rows = await fetch_all(query, (start, end, user_id, user_id))
+
+        if mode == 'summary':
+            return jsonify({"days": queries.day_summaries(rows)})
+
+        return jsonify({"days": queries.calls_by_day(rows)})
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+async def _stream_emotion_mappings():
+    async with async_connection() as conn:
+        async with conn.cursor(name='emotion_mapping') as cur:
+            await cur.execute(queries.EMOTION_MAPPING_ALL)
+
+            # One chunk per fetched batch rather than one write per fragment
+            writer = queries.EmotionMappingWriter()
+            while True:
+                rows = await cur.fetchmany(queries.EMOTION_MAPPING_FETCH_SIZE)
+                if not rows:
+                    break
+                yield writer.feed(rows)
+
+            yield writer.close()
+
+@app.route('/stimulus/emotion-mapping', methods=['GET'])
+async def get_emotion_mappings():
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+
+    if limit is None:
+        chunks = _stream_emotion_mappings()
+        try:
+            first = await chunks.__anext__()  # runs the query so db errors still get a 500
+        except Exception as e:
+            print(f"Error connecting or querying Supabase: {e}")
+            return jsonify({"error": "Database query failed"}), 500
+
+        async def body():
+            # Closing chunks returns the connection and its server-side cursor
+            # as soon as the client goes away
+            try:
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await chunks.aclose()
+
+        return Response(body(), mimetype='application/json')
+
+    # Keyset pagination on (name, created_at, id)
+    limit = max(1, min(limit, queries.EMOTION_MAPPING_PAGE_MAX))
+
+    try:
+        after = queries.decode_cursor(cursor) if cursor else [None, None, None]
+    except ValueError:
+        return jsonify({"error": "Invalid 'cursor' query parameter"}), 400
+
+    try:
+        rows = await fetch_all(queries.EMOTION_MAPPING_PAGE, queries.emotion_mapping_page_params(after, limit))
+        return jsonify(queries.emotion_mapping_page(rows, limit))
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+@app.route('/insight/get-by-stim-id', methods=['GET'])
+async def get_insight_by_stim_id():
+    stim_id = request.args.get('id')
+
+    if not stim_id:
+        return jsonify({"error": "Missing 'id' query parameter"}), 400
+
+    try:
+        rows = await fetch_all(queries.INSIGHTS_BY_STIM_ID, (stim_id,))
+        return jsonify({"entries": queries.insight_entries(rows)})
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+@app.route('/insight/get-by-stim-ids', methods=['GET', 'POST'])
+async def get_insights_by_stim_ids():
+    # ids come in as ?ids=1,2,3 or, for long lists, a JSON body {"ids": [...]}
+    if request.method == 'POST':
+        data = await request.get_json() or {}
+        ids = data.get('ids') or []
+        limit = data.get('limit')
+        since = data.get('since')
+    else:
+        ids = [i for i in request.args.get('ids', '').split(',') if i]
+        limit = request.args.get('limit')
+        since = request.args.get('since')
+
+    stim_ids, error = queries.parse_stim_ids(ids)
+    if error:
+        return jsonify({"error": error}), 400
+
+    limit, since, error = queries.parse_insight_filters(limit, since)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        rows = await fetch_all(queries.INSIGHTS_BY_STIM_IDS, (stim_ids, since, since, limit, limit))
+        return jsonify({"insights": queries.insights_by_stim(stim_ids, rows)})
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+@app.route('/stimulus/get-by-call-id', methods=['GET'])
+async def get_insight_by_id():
+    call_id = request.args.get('call_id')
+
+    if not call_id:
+        return jsonify({"error": "Missing 'id' query parameter"}), 400
+
+    try:
+        rows = await fetch_all(queries.STIMS_BY_CALL_ID, (call_id,))
+        return jsonify({"stims": queries.stim_entries(rows)})
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+@app.route('/get-todays-affirmation', methods=['GET'])
+async def get_affirmation():
+    user_id = request.args.get('user_id', type=int)
+    return jsonify({"affirmation": await digest('affirmation', user_id)})
+
+@app.route('/get-todays-affirmation/stream', methods=['GET'])
+async def stream_affirmation():
+    user_id = request.args.get('user_id', type=int)
+    # Overloaded raised here becomes a 503 before the stream starts
+    response = Response(await digest_events('affirmation', user_id), mimetype='text/event-stream', headers=STREAM_HEADERS)
+    response.timeout = None
+    return response
+
+@app.route('/get-todays-reminders', methods=['GET'])
+async def get_reminders():
+    user_id = request.args.get('user_id', type=int)
+    return jsonify({"reminders": await digest('reminders', user_id)})
+
+@app.route('/get-todays-advice', methods=['GET'])
+async def get_advice():
+    user_id = request.args.get('user_id', type=int)
+    return jsonify({"advice": await digest('advice', user_id)})
+
+@app.route('/get-todays-advice/stream', methods=['GET'])
+async def stream_advice():
+    user_id = request.args.get('user_id', type=int)
+    response = Response(await digest_events('advice', user_id), mimetype='text/event-stream', headers=STREAM_HEADERS)
+    response.timeout = None
+    return response
+
+async def top_emotions_of_week(user_id=None):
+    rows = await fetch_all(TOP_OF_WEEK, (user_id, user_id, 3))
+    return queries.top_emotion_entries(rows)
+
+@app.route('/stimulus/week-top-emotions', methods=['GET'])
+async def get_top_emotions_of_week():
+    try:
+        user_id = request.args.get('user_id', type=int)
+        return jsonify({"top_stims": await top_emotions_of_week(user_id)})
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+
+@app.route('/home', methods=['GET'])
+async def get_home():
+    user_id = request.args.get('user_id', type=int)
+
+    # Fingerprint and load the week once up front so every section reads the same snapshot
+    fingerprint = None
+    try:
+        fingerprint = await week_fingerprint(user_id)
+        await weekly_snapshot_async(user_id, fingerprint)
+    except Exception as e:
+        print(f"Error connecting or querying Supabase: {e}")
+
+    sections = {
+        "affirmation": digest('affirmation', user_id, fingerprint),
+        "reminders": digest('reminders', user_id, fingerprint),
+        "advice": digest('advice', user_id, fingerprint),
+        "top_stims": top_emotions_of_week(user_id),
+    }
+    results = await asyncio.gather(
+        *(asyncio.wait_for(section, DASHBOARD_TIMEOUT) for section in sections.values()),
+        return_exceptions=True
+    )
+
+    payload = {}
+    errors = {}
+    for name, result in zip(sections, results):
+        if isinstance(result, asyncio.TimeoutError):
+            payload[name] = None
+            errors[name] = "Timed out"
+        elif isinstance(result, Exception):
+            print(f"Error generating {name}: {result}")
+            payload[name] = None
+            errors[name] = str(result)
+        else:
+            payload[name] = result
+
+    payload["errors"] = errors
+    return jsonify(payload)
+
+@app.route('/internal/db-pool-stats', methods=['GET'])
+async def get_db_pool_stats():
+    return jsonify(async_pool_stats())
+
+@app.route('/internal/llm-cache-stats', methods=['GET'])
+async def get_llm_cache_stats():
+    return jsonify(await asyncio.to_thread(llm_cache_stats))
+
+@app.route('/internal/llm-stats', methods=['GET'])
+async def get_llm_stats():
+    return jsonify(llm_gateway_stats())
+
+
+if __name__ == '__main__':
+    app.run(debug=True, port=8080)
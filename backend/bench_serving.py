@@ -0,0 +1,57 @@
+import argparse
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Fires concurrent GETs at a running server and reports throughput and latency,
+# to compare the Flask app (app.py) with the async app (asgi_app.py), e.g.
+#   python -m backend.bench_serving http://localhost:8080/user/1 --concurrency 200 --requests 2000
+# Run a slow LLM route alongside a cheap one to see whether the cheap one starves.
+
+
+def _get(url, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, time.perf_counter() - start
+
+
+def run(urls, concurrency, requests, timeout):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: (urls[i % len(urls)], *_get(urls[i % len(urls)], timeout)), range(requests)))
+    elapsed = time.perf_counter() - started
+
+    for url in urls:
+        latencies = sorted(r[2] for r in results if r[0] == url)
+        statuses = {}
+        for r in results:
+            if r[0] == url:
+                statuses[r[1]] = statuses.get(r[1], 0) + 1
+
+        print(url)
+        print(f"  requests: {len(latencies)}  statuses: {statuses}")
+        print(f"  p50: {statistics.median(latencies) * 1000:.1f}ms  "
+              f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms  "
+              f"max: {latencies[-1] * 1000:.1f}ms")
+
+    print(f"total: {requests} requests in {elapsed:.2f}s ({requests / elapsed:.1f} req/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent GET benchmark for the MindLine backend")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    run(args.urls, args.concurrency, args.requests, args.timeout)
@@ -0,0 +1,373 @@
+import json
+import base64
+from datetime import date, datetime
+
+# SQL and row formatting shared by the Flask app (app.py) and the async app
+# (asgi_app.py) so both serve identical payloads
+
+EMOTIONS = ["anger", "fear", "joy", "love", "sadness", "surprise"]
+
+CREATE_USER = 'INSERT INTO "User" (username) VALUES (%s) RETURNING *'
+GET_USER = 'SELECT * FROM "User" WHERE id = %s'
+UPDATE_USER = 'UPDATE "User" SET username = %s WHERE id = %s RETURNING *'
+DELETE_USER = 'DELETE FROM "User" WHERE id = %s'
+
+CALLS_BY_DATE = '''
+    SELECT uc.id, uc.raw_text, ci.insight, uc.created_at
+    FROM "User_Call" uc
+    JOIN "Call_Insights" ci ON uc.id = ci.call_id
+    WHERE uc.created_at >= %s::date
+    AND uc.created_at < %s::date + INTERVAL '1 day'
+'''
+
+# end is inclusive, the range is half open on the day after it
+CALLS_BY_RANGE = '''
+    SELECT uc.created_at::date AS day, uc.id, uc.raw_text, ci.insight, uc.created_at
+    FROM "User_Call" uc
+    JOIN "Call_Insights" ci ON uc.id = ci.call_id
+    WHERE uc.created_at >= %s::date
+    AND uc.created_at < %s::date + INTERVAL '1 day'
+    AND (%s::bigint IS NULL OR uc.user_id = %s)
+    ORDER BY uc.created_at
+'''
+
+# The same calls as CALLS_BY_RANGE (those with an insight), filtered with EXISTS
+# rather than joined so a call with several insights doesn't multiply its stimuli
+CALLS_BY_RANGE_SUMMARY = '''
+    SELECT uc.created_at::date AS day,
+        COUNT(DISTINCT uc.id) AS calls,
+        SUM(s.anger), SUM(s.fear), SUM(s.joy), SUM(s.love), SUM(s.sadness), SUM(s.surprise)
+    FROM "User_Call" uc
+    LEFT JOIN "Stimuli" s ON s.user_call_id = uc.id
+    WHERE uc.created_at >= %s::date
+    AND uc.created_at < %s::date + INTERVAL '1 day'
+    AND (%s::bigint IS NULL OR uc.user_id = %s)
+    AND EXISTS (SELECT 1 FROM "Call_Insights" ci WHERE ci.call_id = uc.id)
+    GROUP BY 1
+    ORDER BY 1
+'''
+
+CALLS_BY_RANGE_MODES = ('entries', 'summary')
+
+EMOTION_MAPPING_PAGE_MAX = 1000
+EMOTION_MAPPING_FETCH_SIZE = 500
+
+EMOTION_MAPPING_ALL = '''
+    SELECT name, created_at, anger, fear, joy, love, sadness, surprise, id
+    FROM "Stimuli"
+    ORDER BY name, created_at, id
+'''
+
+# Keyset pagination on (name, created_at, id). created_at can be NULL, which sorts
+# last and never compares, so NULL rows (and a cursor on one) are handled apart.
+EMOTION_MAPPING_PAGE = '''
+    SELECT name, created_at, anger, fear, joy, love, sadness, surprise, id
+    FROM "Stimuli"
+    WHERE %(name)s::text IS NULL
+    OR name > %(name)s::text
+    OR (name = %(name)s::text AND %(created_at)s::timestamptz IS NOT NULL
+        AND (created_at, id) > (%(created_at)s::timestamptz, %(id)s::bigint))
+    OR (name = %(name)s::text AND created_at IS NULL
+        AND (%(created_at)s::timestamptz IS NOT NULL OR id > %(id)s::bigint))
+    ORDER BY name, created_at, id
+    LIMIT %(limit)s
+'''
+
+INSIGHTS_BY_STIM_ID = '''
+    SELECT ci.created_at, ci.insight
+    FROM "Call_Insights" ci
+    JOIN "Stim_Insight" si ON ci.id = si.insight_id
+    WHERE si.stim_id = %s
+    ORDER BY ci.created_at
+'''
+
+INSIGHT_BATCH_MAX_IDS = 1000
+
+# Optional per stimulus cap keeps the most recent insights for each one
+INSIGHTS_BY_STIM_IDS = '''
+    SELECT stim_id, created_at, insight
+    FROM (
+        SELECT si.stim_id, ci.created_at, ci.insight,
+            ROW_NUMBER() OVER (PARTITION BY si.stim_id ORDER BY ci.created_at DESC) AS rn
+        FROM "Stim_Insight" si
+        JOIN "Call_Insights" ci ON ci.id = si.insight_id
+        WHERE si.stim_id = ANY(%s)
+        AND (%s::timestamptz IS NULL OR ci.created_at >= %s::timestamptz)
+    ) ranked
+    WHERE %s::int IS NULL OR rn <= %s::int
+    ORDER BY stim_id, created_at
+'''
+
+STIMS_BY_CALL_ID = '''
+    SELECT name, anger, fear, joy, love, sadness, surprise
+    FROM "Stimuli"
+    WHERE user_call_id = %s
+'''
+
+
+def result_to_dict(cursor, result):
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in result]
+
+
+def call_entries(rows):
+    return [{"id": row[0], "raw_text": row[1], "insight": row[2], "created_at": row[3]} for row in rows]
+
+
+def calls_by_day(rows):
+    days = {}
+    for row in rows:
+        days.setdefault(row[0].isoformat(), []).append(
+            {"id": row[1], "raw_text": row[2], "insight": row[3], "created_at": row[4]}
+        )
+    return days
+
+
+def day_summaries(rows):
+    # Per day call counts and the emotion with the highest total across that day's stimuli
+    days = {}
+    for row in rows:
+        totals = {emotion: float(value) for emotion, value in zip(EMOTIONS, row[2:]) if value is not None}
+        days[row[0].isoformat()] = {
+            "count": row[1],
+            "dominant_emotion": max(totals, key=totals.get) if totals else None
+        }
+    return days
+
+
+def emotion_mapping_entry(row):
+    name, created_at, anger, fear, joy, love, sadness, surprise, id = row
+
+    return {
+        "created_at": created_at.isoformat() if created_at else None,
+        "emotions": {
+            "anger": anger,
+            "fear": fear,
+            "joy": joy,
+            "love": love,
+            "sadness": sadness,
+            "surprise": surprise,
+        },
+        "stim_id": id
+    }
+
+
+class EmotionMappingWriter:
+    """
+    Writes the {name: [entries]} object one batch of rows at a time, each batch
+    as a single chunk. Rows come back ordered by name, so each stimulus' entries
+    are contiguous.
+    """
+
+    def __init__(self):
+        self.current = None
+        self.started = False
+
+    def feed(self, rows):
+        parts = []
+        if not self.started:
+            self.started = True
+            parts.append('{')
+
+        for row in rows:
+            name = row[0]
+            if name != self.current:
+                if self.current is not None:
+                    parts.append('],')
+                parts.append(f'{json.dumps(name)}:[')
+                self.current = name
+            else:
+                parts.append(',')
+            # Numeric columns come back as Decimal, written as strings like jsonify does
+            parts.append(json.dumps(emotion_mapping_entry(row), default=str))
+
+        return ''.join(parts)
+
+    def close(self):
+        parts = []
+        if not self.started:
+            parts.append('{')
+        if self.current is not None:
+            parts.append(']')
+        parts.append('}')
+        return ''.join(parts)
+
+
+def emotion_mapping_page(rows, limit):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Group by stimulus name
+    result = {}
+    for row in rows:
+        result.setdefault(row[0], []).append(emotion_mapping_entry(row))
+
+    return {
+        "stimuli": result,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None
+    }
+
+
+def emotion_mapping_page_params(after, limit):
+    """EMOTION_MAPPING_PAGE parameters for the rows after a decoded cursor ([None] * 3 for the first page)."""
+    name, created_at, id = after
+    return {'name': name, 'created_at': created_at, 'id': id, 'limit': limit + 1}
+
+
+def encode_cursor(row):
+    name, created_at, id = row[0], row[1], row[8]
+    after = [name, created_at.isoformat() if created_at else None, id]
+    return base64.urlsafe_b64encode(json.dumps(after, default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """[name, created_at, id] from a next_cursor, ValueError if it isn't one."""
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Undecodable cursor: {e}")
+
+    if not isinstance(after, list) or len(after) != 3:
+        raise ValueError("Cursor must hold [name, created_at, id]")
+
+    name, created_at, id = after
+    if not isinstance(name, str) or not isinstance(created_at, (str, type(None))) or not isinstance(id, int) or isinstance(id, bool):
+        raise ValueError("Cursor must hold [name, created_at, id]")
+    if created_at is not None:
+        datetime.fromisoformat(created_at)
+
+    return after
+
+
+def insight_entries(rows):
+    return [
+        {
+            "created_at": row[0].isoformat() if row[0] else None,
+            "insight": row[1]
+        }
+        for row in rows
+    ]
+
+
+def insights_by_stim(stim_ids, rows):
+    insights = {str(stim_id): [] for stim_id in stim_ids}
+    for row in rows:
+        insights[str(row[0])].append({
+            "created_at": row[1].isoformat() if row[1] else None,
+            "insight": row[2]
+        })
+    return insights
+
+
+def stim_entries(rows):
+    return [
+        {
+            "name":row[0],
+            "emotions": {
+                "anger": row[1],
+                "fear": row[2],
+                "joyr": row[3],
+                "love": row[4],
+                "sadness": row[5],
+                "surprise": row[6]
+            }
+        }
+        for row in rows
+    ]
+
+
+def top_emotion_entries(rows):
+    # Format as JSON-friendly structure with normalized emotions
+    entries = []
+    for row in rows:
+        # Extract raw emotion values (handling None values)
+        emotions = {
+            "anger": float(row[2]) if row[2] is not None else 0.0,
+            "fear": float(row[3]) if row[3] is not None else 0.0,
+            "joy": float(row[4]) if row[4] is not None else 0.0,
+            "love": float(row[5]) if row[5] is not None else 0.0,
+            "sadness": float(row[6]) if row[6] is not None else 0.0,
+            "surprise": float(row[7]) if row[7] is not None else 0.0,
+        }
+
+        # Calculate the sum for normalization
+        emotion_sum = sum(emotions.values())
+
+        # Normalize emotions (handle case where sum is 0)
+        if emotion_sum > 0:
+            normalized_emotions = {
+                emotion: value / emotion_sum
+                for emotion, value in emotions.items()
+            }
+        else:
+            # If all emotions are 0, distribute equally
+            normalized_emotions = {
+                emotion: 1.0 / 6
+                for emotion in emotions.keys()
+            }
+
+        entries.append({
+            "name": row[0] if row[0] else None,
+            "mentions": row[1],
+            "emotions": normalized_emotions
+        })
+
+    return entries
+
+
+def parse_stim_ids(ids):
+    """Returns (stim_ids, error) for the ids of a batch insight request."""
+    try:
+        stim_ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return None, "'ids' must be a list of integers"
+
+    if not stim_ids:
+        return None, "Missing 'ids' query parameter"
+    if len(stim_ids) > INSIGHT_BATCH_MAX_IDS:
+        return None, f"At most {INSIGHT_BATCH_MAX_IDS} ids per request"
+
+    return stim_ids, None
+
+
+def parse_insight_filters(limit, since):
+    """Returns (limit, since, error) for the optional filters of a batch insight request."""
+    if limit is not None and limit != '':
+        if isinstance(limit, (bool, float)):
+            return None, None, "'limit' must be an integer"
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return None, None, "'limit' must be an integer"
+        if limit < 1:
+            return None, None, "'limit' must be a positive integer"
+    else:
+        limit = None
+
+    if since is not None and since != '':
+        try:
+            since = datetime.fromisoformat(since)
+        except (TypeError, ValueError):
+            return None, None, "'since' must be an ISO 8601 date or timestamp"
+    else:
+        since = None
+
+    return limit, since, None
+
+
+def parse_range(start, end, mode):
+    """Returns (start, end, mode, error) for a call log range request."""
+    if not start or not end:
+        return None, None, None, "Missing 'start' or 'end' query parameter"
+
+    try:
+        start, end = date.fromisoformat(start), date.fromisoformat(end)
+    except ValueError:
+        return None, None, None, "'start' and 'end' must be ISO 8601 dates (YYYY-MM-DD)"
+    if start > end:
+        return None, None, None, "'start' must not be after 'end'"
+
+    if mode not in CALLS_BY_RANGE_MODES:
+        return None, None, None, f"'mode' must be one of: {', '.join(CALLS_BY_RANGE_MODES)}"
+
+    return start, end, mode, None
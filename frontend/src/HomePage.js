@@ -38,22 +38,18 @@ export default function HomePage({ apiBaseUrl }) {
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const [affirmRes, remindersRes, adviceRes, topStimsRes] = await Promise.all([
-          fetch(`${apiBaseUrl}/get-todays-affirmation`),
-          fetch(`${apiBaseUrl}/get-todays-reminders`),
-          fetch(`${apiBaseUrl}/get-todays-advice`),
-          fetch(`${apiBaseUrl}/stimulus/week-top-emotions`),
-        ]);
+        // One request for the whole dashboard, sections that failed come back null
+        const homeRes = await fetch(`${apiBaseUrl}/home`);
+        const homeJson = await homeRes.json();
 
-        const affirmJson = await affirmRes.json();
-        const remindersJson = await remindersRes.json();
-        const adviceJson = await adviceRes.json();
-        const topStimsJson = await topStimsRes.json();
+        if (homeJson.errors && Object.keys(homeJson.errors).length > 0) {
+          console.error("Some homepage sections failed:", homeJson.errors);
+        }
 
-        setAffirmation(affirmJson.affirmation || "");
-        setReminders(remindersJson.reminders || "");
-        setAdvice(Object.entries(adviceJson.advice || {}));
-        setTopStims(topStimsJson.top_stims || []);
+        setAffirmation(homeJson.affirmation || "");
+        setReminders(homeJson.reminders || "");
+        setAdvice(Object.entries(homeJson.advice || {}));
+        setTopStims(homeJson.top_stims || []);
       } catch (err) {
         console.error("Failed to fetch homepage data:", err);
       } finally {
@@ -48,6 +48,7 @@ export default function JournalCalendar({ apiBaseUrl }) {
   const [selectedDate, setSelectedDate] = useState(dayjs());
   
   const [entries, setEntries] = useState([]);
+  const [weekEntries, setWeekEntries] = useState({});
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [expanded, setExpanded] = useState(null);
@@ -124,25 +125,33 @@ export default function JournalCalendar({ apiBaseUrl }) {
   };
 
 
+  const weekStartDate = weekStart.format("YYYY-MM-DD");
+  const weekEndDate = weekStart.add(6, 'day').format("YYYY-MM-DD");
+
+  // Fetch the whole visible week in one request, switching days doesn't refetch
   useEffect(() => {
     const fetchEntries = async () => {
       setLoading(true);
       setError(null);
       try {
-        const res = await fetch(`${apiBaseUrl}/call_logs/by_date?date=${formattedDate}`);
+        const res = await fetch(`${apiBaseUrl}/call_logs/range?start=${weekStartDate}&end=${weekEndDate}`);
         if (!res.ok) throw new Error("Failed to fetch journal entries");
         const data = await res.json();
-        setEntries(data.entries || []);
+        setWeekEntries(data.days || {});
       } catch (err) {
         setError(err.message);
-        setEntries([]);
+        setWeekEntries({});
       } finally {
         setLoading(false);
       }
     };
 
     fetchEntries();
-  }, [formattedDate, apiBaseUrl]);
+  }, [weekStartDate, weekEndDate, apiBaseUrl]);
+
+  useEffect(() => {
+    setEntries(weekEntries[formattedDate] || []);
+  }, [weekEntries, formattedDate]);
 
   const handleToggleExpand = (index) => {
     setExpanded(expanded === index ? null : index);
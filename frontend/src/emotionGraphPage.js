@@ -23,6 +23,9 @@ import {
 } from "recharts";
 import dayjs from "dayjs";
 
+// Matches the backend's INSIGHT_BATCH_MAX_IDS
+const INSIGHT_BATCH_SIZE = 1000;
+
 export default function StimulusEmotionPage({ apiBaseUrl }) {
   const [searchParams] = useSearchParams();
   const location = useLocation();
@@ -30,6 +33,7 @@ export default function StimulusEmotionPage({ apiBaseUrl }) {
   const [stimulus, setStimulus] = useState("");
   const [index, setIndex] = useState(0);
   const [allInsights, setAllInsights] = useState([]); // Store all insights for current stimulus
+  const [insightsByStim, setInsightsByStim] = useState({}); // Insights keyed by stim id, from one batch request
   const [loadingInsights, setLoadingInsights] = useState(false);
 
   useEffect(() => {
@@ -70,30 +74,54 @@ export default function StimulusEmotionPage({ apiBaseUrl }) {
     fetchData();
   }, [apiBaseUrl, searchParams, location.state]);
 
-  // Fetch all insights when stimulus changes
+  // Fetch insights for every stimulus in batch requests once the mapping loads
   useEffect(() => {
-    if (!stimulus || !data[stimulus]) return;
+    const stimIds = Object.values(data)
+      .filter((stimEntries) => stimEntries.length > 0)
+      .map((stimEntries) => stimEntries[0].stim_id);
+    if (stimIds.length === 0) return;
 
     const fetchAllInsights = async () => {
       setLoadingInsights(true);
       try {
-        const res = await fetch(`${apiBaseUrl}/insight/get-by-stim-id?id=${data[stimulus][0].stim_id}`);
-        const json = await res.json();
+        const chunks = [];
+        for (let i = 0; i < stimIds.length; i += INSIGHT_BATCH_SIZE) {
+          chunks.push(stimIds.slice(i, i + INSIGHT_BATCH_SIZE));
+        }
 
-        const sorted = [...json.entries].sort(
-          (a, b) => new Date(a.created_at) - new Date(b.created_at)
+        const results = await Promise.all(
+          chunks.map(async (ids) => {
+            const res = await fetch(`${apiBaseUrl}/insight/get-by-stim-ids`, {
+              method: "POST",
+              headers: { "Content-Type": "application/json" },
+              body: JSON.stringify({ ids }),
+            });
+            if (!res.ok) throw new Error(`Insight request failed: ${res.status}`);
+            const json = await res.json();
+            return json.insights || {};
+          })
         );
-        setAllInsights(sorted);
+        setInsightsByStim(Object.assign({}, ...results));
       } catch (err) {
         console.error("Failed to fetch insights:", err);
-        setAllInsights([]);
+        setInsightsByStim({});
       } finally {
         setLoadingInsights(false);
       }
     };
 
     fetchAllInsights();
-  }, [stimulus, apiBaseUrl, data]);
+  }, [apiBaseUrl, data]);
+
+  useEffect(() => {
+    if (!stimulus || !data[stimulus]) return;
+
+    const stimInsights = insightsByStim[data[stimulus][0].stim_id] || [];
+    const sorted = [...stimInsights].sort(
+      (a, b) => new Date(a.created_at) - new Date(b.created_at)
+    );
+    setAllInsights(sorted);
+  }, [stimulus, data, insightsByStim]);
 
   const handleStimulusChange = (e) => {
     setStimulus(e.target.value);
@@ -0,0 +1,5 @@
+-- Range scans on call dates (calendar, weekly digests) and the per-call stimulus lookup
+CREATE INDEX IF NOT EXISTS user_call_created_at_idx ON "User_Call" (created_at);
+CREATE INDEX IF NOT EXISTS user_call_user_id_created_at_idx ON "User_Call" (user_id, created_at);
+CREATE INDEX IF NOT EXISTS call_insights_call_id_idx ON "Call_Insights" (call_id);
+CREATE INDEX IF NOT EXISTS stimuli_user_call_id_idx ON "Stimuli" (user_call_id);
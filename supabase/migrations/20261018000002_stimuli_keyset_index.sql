@@ -0,0 +1,2 @@
+-- Keyset pagination / ordered streaming for /stimulus/emotion-mapping
+CREATE INDEX IF NOT EXISTS stimuli_name_created_at_id_idx ON "Stimuli" (name, created_at, id);
@@ -0,0 +1,2 @@
+-- Batch insight lookup by stimulus (/insight/get-by-stim-ids)
+CREATE INDEX IF NOT EXISTS stim_insight_stim_id_insight_id_idx ON "Stim_Insight" (stim_id, insight_id);
@@ -0,0 +1,18 @@
+-- Per (user, stimulus name, day) counts and emotion sums, maintained on every
+-- Stimuli insert by twilio_controller/stim_rollup.py. Rebuild or check it with
+-- python -m twilio_controller.stim_rollup rebuild|check
+CREATE TABLE IF NOT EXISTS "Stim_Daily_Rollup" (
+    user_id bigint NOT NULL,
+    name text NOT NULL,
+    day date NOT NULL,
+    mentions bigint NOT NULL DEFAULT 0,
+    anger_sum double precision NOT NULL DEFAULT 0,
+    fear_sum double precision NOT NULL DEFAULT 0,
+    joy_sum double precision NOT NULL DEFAULT 0,
+    love_sum double precision NOT NULL DEFAULT 0,
+    sadness_sum double precision NOT NULL DEFAULT 0,
+    surprise_sum double precision NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, name, day)
+);
+
+CREATE INDEX IF NOT EXISTS stim_daily_rollup_day_idx ON "Stim_Daily_Rollup" (day);
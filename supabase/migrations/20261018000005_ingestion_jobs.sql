@@ -0,0 +1,22 @@
+-- Durable queue for the post-call ingestion pipeline, see twilio_controller/job_queue.py.
+-- status: queued -> running -> done, or back to queued with backoff on failure,
+-- and dead once max_attempts is used up.
+CREATE TABLE IF NOT EXISTS "Ingestion_Job" (
+    id bigserial PRIMARY KEY,
+    kind text NOT NULL,
+    payload jsonb NOT NULL DEFAULT '{}'::jsonb,
+    status text NOT NULL DEFAULT 'queued',
+    attempts int NOT NULL DEFAULT 0,
+    max_attempts int NOT NULL DEFAULT 5,
+    run_after timestamptz NOT NULL DEFAULT NOW(),
+    locked_until timestamptz,
+    locked_by text,
+    last_error text,
+    result jsonb,
+    created_at timestamptz NOT NULL DEFAULT NOW(),
+    updated_at timestamptz NOT NULL DEFAULT NOW()
+);
+
+-- Workers only ever scan claimable rows
+CREATE INDEX IF NOT EXISTS ingestion_job_claim_idx ON "Ingestion_Job" (run_after, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS ingestion_job_running_idx ON "Ingestion_Job" (locked_until) WHERE status = 'running';
@@ -0,0 +1,4 @@
+-- Trigram index so the % similarity operator in find_similar_stims_ranked is an
+-- index lookup instead of a scan of every stimulus
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS stimuli_name_trgm_idx ON "Stimuli" USING gin (name gin_trgm_ops);
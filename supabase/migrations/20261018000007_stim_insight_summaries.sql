@@ -0,0 +1,12 @@
+-- Compacted insight history per stimulus: one row per week for insights older
+-- than the verbatim window, folded into one row per month once they age further.
+-- Maintained off the hot path by twilio_controller/insight_summaries.py
+CREATE TABLE IF NOT EXISTS "Stim_Insight_Summary" (
+    stim_id bigint NOT NULL,
+    level text NOT NULL CHECK (level IN ('week', 'month')),
+    period_start date NOT NULL,
+    summary text NOT NULL,
+    insight_count integer NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (stim_id, level, period_start)
+);
@@ -0,0 +1,3 @@
+-- Compact summary of each call, written at ingestion and used in place of the
+-- full transcript when the weekly prompts run out of token budget
+ALTER TABLE "User_Call" ADD COLUMN IF NOT EXISTS summary text;
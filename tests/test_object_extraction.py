@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+pytest.importorskip("load_dotenv")
+pytest.importorskip("psycopg_pool")
+
+from twilio_controller import object_extraction
+from twilio_controller.object_extraction import EVIDENCE, Extraction, HybridExtractor, LocalExtractor
+
+
+@pytest.fixture
+def local(monkeypatch):
+    # The regex tagger, whether or not spaCy is installed here
+    monkeypatch.setattr(object_extraction, '_spacy', lambda: None)
+    return LocalExtractor(vocabulary=[])
+
+
+def test_capitalized_names_mid_sentence(local):
+    assert local.extract("Went to the park with Sarah Jones.").objects == ["Sarah Jones"]
+
+
+def test_sentence_initial_capital_is_not_a_name(local):
+    assert local.extract("Yesterday was long. Coffee helped.").objects == []
+
+
+def test_contractions_are_not_names(local):
+    assert local.extract("Honestly I've been tired and I'll rest.").objects == []
+    assert local.extract("Honestly I’ve been tired.").objects == []
+
+
+def test_possessive_phrase_stops_at_verbs_and_prepositions(local):
+    result = local.extract("My manager yelled at me. I called my sister about it.")
+    assert sorted(result.objects) == ["manager", "sister"]
+
+
+def test_possessive_phrase_keeps_a_two_word_noun(local):
+    assert local.extract("I met my best friend.").objects == ["best friend"]
+
+
+def test_vocabulary_spelling_wins(monkeypatch):
+    monkeypatch.setattr(object_extraction, '_spacy', lambda: None)
+    local = LocalExtractor(vocabulary=["Best Friend"])
+    assert local.extract("I met my best friend.").objects == ["Best Friend"]
+
+
+def test_confidence_is_evidence_times_coverage(monkeypatch):
+    monkeypatch.setattr(object_extraction, '_spacy', lambda: None)
+    local = LocalExtractor(vocabulary=["gym"])
+
+    assert local.extract("Went to the gym.").confidence == EVIDENCE['vocabulary']
+    # One known name in a call the tagger got nothing else out of isn't a confident answer
+    assert local.extract("Went to the gym. Slept. Ate. Watched a movie.").confidence == pytest.approx(EVIDENCE['vocabulary'] / 4)
+
+
+def test_nothing_found(local):
+    assert local.extract("") == Extraction([], 0.0, 'local')
+    assert local.extract("it was fine.") == Extraction([], 0.0, 'local')
+
+
+class Fixed:
+    def __init__(self, name, confidence):
+        self.name = name
+        self.confidence = confidence
+        self.calls = 0
+
+    def extract(self, text, user_id=None):
+        self.calls += 1
+        return Extraction([self.name], self.confidence, self.name)
+
+
+def test_hybrid_keeps_a_confident_local_answer():
+    llm = Fixed('llm', 1.0)
+    hybrid = HybridExtractor(local=Fixed('local', 0.9), llm=llm, min_confidence=0.6)
+
+    assert hybrid.extract("text").engine == 'local'
+    assert llm.calls == 0
+
+
+def test_hybrid_falls_back_to_the_llm():
+    hybrid = HybridExtractor(local=Fixed('local', 0.3), llm=Fixed('llm', 1.0), min_confidence=0.6)
+    assert hybrid.extract("text").engine == 'llm'
+
+
+def test_hybrid_counts_across_threads():
+    hybrid = HybridExtractor(local=Fixed('local', 0.9), llm=Fixed('llm', 1.0), min_confidence=0.6)
+    threads = [threading.Thread(target=lambda: [hybrid.extract("text") for _ in range(500)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert hybrid.counts == {'local': 4000, 'llm': 0}
@@ -0,0 +1,42 @@
+from twilio_controller.object_matcher import ObjectMatcher, find_mentions, normalize
+
+
+def test_normalize_folds_case_accents_and_punctuation():
+    assert normalize("Café, NOW!") == ["cafe", "now"]
+
+
+def test_normalize_folds_regular_plurals_only():
+    assert normalize("friends stories boxes glasses") == normalize("friend story box glass")
+    assert normalize("news bus tennis class") == ["news", "bus", "tennis", "class"]
+
+
+def test_matches_whole_tokens():
+    assert find_mentions(["Ann"], ["Annual review with Ann."]) == {"Ann": {0: 1}}
+
+
+def test_plural_in_text_mentions_singular_object():
+    assert find_mentions(["Friend"], ["I saw my friends"]) == {"Friend": {0: 1}}
+
+
+def test_word_ending_in_s_is_not_a_plural():
+    assert find_mentions(["New"], ["I read the news"]) == {}
+    assert find_mentions(["News"], ["something new"]) == {}
+
+
+def test_multi_token_objects_and_overlaps():
+    matcher = ObjectMatcher(["New York", "York", "New York City"])
+    assert matcher.mentions(["New York City and York, then New York."]) == {
+        "New York": {0: 2},
+        "York": {0: 3},
+        "New York City": {0: 1},
+    }
+
+
+def test_counts_per_sentence():
+    mentions = find_mentions(["gym"], ["Gym then gym.", "No workout.", "Back to the gym."])
+    assert mentions == {"gym": {0: 2, 2: 1}}
+
+
+def test_empty_objects_are_ignored():
+    matcher = ObjectMatcher(["", "!!", "dog"])
+    assert matcher.mentions(["the dog"]) == {"dog": {0: 1}}
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("load_dotenv")
+
+from twilio_controller.object_recognition import parse_objects
+
+
+def test_json_list():
+    assert parse_objects('["Sarah", "the gym"]') == ["Sarah", "the gym"]
+
+
+def test_python_literal_keeps_commas_and_quotes():
+    assert parse_objects("['Washington, D.C.', \"Sarah's party\"]") == ["Washington, D.C.", "Sarah's party"]
+
+
+def test_list_inside_surrounding_text():
+    assert parse_objects('Output: ["work", "mom"]\nHope that helps!') == ["work", "mom"]
+
+
+def test_drops_blank_entries():
+    assert parse_objects('["dog", "", "  "]') == ["dog"]
+
+
+def test_empty_list():
+    assert parse_objects("[]") == []
+
+
+def test_malformed_list_falls_back_to_splitting():
+    assert parse_objects("[dog, 'cat', \"bird\"]") == ["dog", "cat", "bird"]
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+pytest.importorskip("load_dotenv")
+
+from twilio_controller.pipeline import Pipeline, StageError
+
+
+def test_stages_get_their_deps_as_kwargs():
+    pipeline = (Pipeline()
+                .add('double', lambda x: x * 2, deps=['x'])
+                .add('sum', lambda x, double: x + double, deps=['x', 'double']))
+
+    results, timings = pipeline.run(x=3)
+
+    assert results == {'x': 3, 'double': 6, 'sum': 9}
+    assert set(timings) == {'double', 'sum', 'total'}
+    assert timings['sum']['start'] >= timings['double']['end']
+
+
+def test_independent_stages_overlap():
+    both_started = threading.Barrier(2, timeout=5)
+
+    def stage():
+        # Only returns if the other stage is running at the same time
+        both_started.wait()
+        return True
+
+    results, _ = Pipeline().add('a', stage).add('b', stage).run()
+
+    assert results['a'] and results['b']
+
+
+def test_dependents_wait_for_their_deps():
+    order = []
+    pipeline = (Pipeline()
+                .add('first', lambda: order.append('first'))
+                .add('second', lambda first: order.append('second'), deps=['first']))
+
+    pipeline.run()
+
+    assert order == ['first', 'second']
+
+
+def test_failing_stage_raises_stage_error_and_skips_dependents():
+    ran = []
+
+    def boom():
+        raise KeyError('missing')
+
+    pipeline = (Pipeline()
+                .add('boom', boom)
+                .add('after', lambda boom: ran.append('after'), deps=['boom']))
+
+    with pytest.raises(StageError) as info:
+        pipeline.run()
+
+    assert info.value.stage == 'boom'
+    assert isinstance(info.value.__cause__, KeyError)
+    assert 'boom' in info.value.timings
+    assert ran == []
+
+
+def test_rejects_duplicate_stage():
+    with pytest.raises(ValueError):
+        Pipeline().add('a', lambda: 1).add('a', lambda: 2)
+
+
+def test_rejects_unknown_dependency():
+    with pytest.raises(ValueError, match="unknown"):
+        Pipeline().add('a', lambda b: b, deps=['b']).run()
+
+
+def test_rejects_cycle():
+    pipeline = Pipeline().add('a', lambda b: b, deps=['b']).add('b', lambda a: a, deps=['a'])
+    with pytest.raises(ValueError, match="cycle"):
+        pipeline.run()
@@ -0,0 +1,77 @@
+from datetime import date, datetime
+from decimal import Decimal
+import json
+
+import pytest
+
+from backend import queries
+
+
+def test_parse_stim_ids():
+    assert queries.parse_stim_ids(["1", "2"]) == ([1, 2], None)
+    assert queries.parse_stim_ids([])[1] == "Missing 'ids' query parameter"
+    assert queries.parse_stim_ids(["1", "x"])[1] == "'ids' must be a list of integers"
+    assert queries.parse_stim_ids(None)[1] == "'ids' must be a list of integers"
+
+
+def test_parse_stim_ids_caps_batch_size():
+    ids = [str(i) for i in range(queries.INSIGHT_BATCH_MAX_IDS + 1)]
+    assert queries.parse_stim_ids(ids)[0] is None
+
+
+def test_parse_insight_filters():
+    assert queries.parse_insight_filters(None, None) == (None, None, None)
+    assert queries.parse_insight_filters("", "") == (None, None, None)
+    assert queries.parse_insight_filters("5", "2024-01-02") == (5, datetime(2024, 1, 2), None)
+    assert queries.parse_insight_filters(3, None) == (3, None, None)
+
+
+@pytest.mark.parametrize("limit", ["0", "-1", "abc", True, 2.5])
+def test_parse_insight_filters_rejects_bad_limit(limit):
+    assert queries.parse_insight_filters(limit, None)[2] is not None
+
+
+def test_parse_insight_filters_rejects_bad_since():
+    assert queries.parse_insight_filters(None, "yesterday")[2] is not None
+
+
+def test_parse_range():
+    assert queries.parse_range("2024-01-01", "2024-01-31", "summary") == (date(2024, 1, 1), date(2024, 1, 31), "summary", None)
+    assert queries.parse_range(None, "2024-01-31", "entries")[3] is not None
+    assert queries.parse_range("01/01/2024", "2024-01-31", "entries")[3] is not None
+    assert queries.parse_range("2024-02-01", "2024-01-31", "entries")[3] is not None
+    assert queries.parse_range("2024-01-01", "2024-01-31", "daily")[3] is not None
+
+
+def test_cursor_round_trip():
+    row = ("dog", datetime(2024, 1, 1, 12), 0, 0, 0, 0, 0, 0, 7)
+    assert queries.decode_cursor(queries.encode_cursor(row)) == ["dog", "2024-01-01T12:00:00", 7]
+
+
+def test_cursor_without_created_at():
+    row = ("dog", None, 0, 0, 0, 0, 0, 0, 7)
+    assert queries.decode_cursor(queries.encode_cursor(row)) == ["dog", None, 7]
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "W10=", "WyJkb2ciLCAiMjAyNCIsIHRydWVd"])
+def test_decode_cursor_rejects_garbage(cursor):
+    with pytest.raises(ValueError):
+        queries.decode_cursor(cursor)
+
+
+def test_emotion_mapping_writer_groups_by_name():
+    writer = queries.EmotionMappingWriter()
+    rows = [
+        ("cat", None, Decimal("0.5"), 0, 0, 0, 0, 0, 1),
+        ("dog", datetime(2024, 1, 1), 0, 0, 0, 0, 0, 0, 2),
+    ]
+    body = writer.feed(rows[:1]) + writer.feed(rows[1:]) + writer.close()
+    mapping = json.loads(body)
+    assert list(mapping) == ["cat", "dog"]
+    assert mapping["cat"][0]["emotions"]["anger"] == "0.5"
+    assert mapping["dog"][0]["stim_id"] == 2
+
+
+def test_emotion_mapping_writer_empty():
+    writer = queries.EmotionMappingWriter()
+    assert writer.close() == "{}"
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("load_dotenv")
+
+from twilio_controller.single_flight import AsyncSingleFlight, Overloaded, SingleFlight
+
+
+def test_do_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # The leader can't finish before release, so every thread joins its call
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {'in_flight': 0, 'streams': 0, 'waiting': 0}
+
+
+def test_do_raises_the_leaders_error_and_forgets_the_key():
+    flight = SingleFlight()
+
+    def boom():
+        raise RuntimeError('no model')
+
+    with pytest.raises(RuntimeError):
+        flight.do('key', boom)
+    assert flight.do('key', lambda: 'retried') == 'retried'
+
+
+def test_do_overloaded_when_queue_is_full():
+    flight = SingleFlight(max_concurrent=1, max_queue=0)
+    flight._slots.acquire()
+
+    with pytest.raises(Overloaded):
+        flight.do('key', lambda: 'never')
+
+    flight._slots.release()
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_do_overloaded_after_queue_timeout():
+    flight = SingleFlight(max_concurrent=1, max_queue=1, queue_timeout=0.01)
+    flight._slots.acquire()
+
+    with pytest.raises(Overloaded):
+        flight.do('key', lambda: 'never')
+    assert flight.stats()['waiting'] == 0
+
+
+def test_stream_followers_replay_from_the_start():
+    flight = SingleFlight()
+    leader = flight.stream('key', lambda: iter(['a', 'b', 'c']))
+    first = next(leader)
+
+    # Joins after the leader has already sent a piece
+    follower = flight.stream('key', lambda: iter(['never']))
+
+    assert [first] + list(leader) == ['a', 'b', 'c']
+    assert list(follower) == ['a', 'b', 'c']
+    assert flight.stats()['streams'] == 0
+
+
+def test_stream_followers_get_the_leaders_error():
+    flight = SingleFlight()
+
+    def pieces():
+        yield 'a'
+        raise RuntimeError('cut off')
+
+    leader = flight.stream('key', pieces)
+    follower = flight.stream('key', pieces)
+
+    assert next(leader) == 'a'
+    with pytest.raises(RuntimeError):
+        next(leader)
+    with pytest.raises(RuntimeError):
+        list(follower)
+
+
+def test_stream_overloaded_before_any_piece():
+    flight = SingleFlight(max_concurrent=1, max_queue=0)
+    leader = flight.stream('first', lambda: iter(['a']))
+
+    with pytest.raises(Overloaded):
+        flight.stream('second', lambda: iter(['b']))
+
+    # Closing an unstarted leader frees its slot
+    leader.close()
+    assert list(flight.stream('second', lambda: iter(['b']))) == ['b']
+
+
+def test_async_do_coalesces_concurrent_calls():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['result'] * 5
+    assert len(calls) == 1
+
+
+def test_async_do_overloaded_when_queue_is_full():
+    flight = AsyncSingleFlight(max_concurrent=1, max_queue=0)
+    release = None
+
+    async def hold():
+        await release.wait()
+        return 'held'
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(flight.do('first', hold))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await flight.do('second', hold)
+        release.set()
+        return await holder
+
+    assert asyncio.run(main()) == 'held'
+
+
+def test_async_stream_followers_replay_from_the_start():
+    flight = AsyncSingleFlight()
+
+    async def pieces():
+        for piece in ['a', 'b', 'c']:
+            await asyncio.sleep(0)
+            yield piece
+
+    async def collect(stream):
+        return [piece async for piece in stream]
+
+    async def main():
+        leader = await flight.stream('key', pieces)
+        first = await leader.__anext__()
+        follower = await flight.stream('key', pieces)
+        rest, followed = await asyncio.gather(collect(leader), collect(follower))
+        return [first] + rest, followed
+
+    led, followed = asyncio.run(main())
+    assert led == ['a', 'b', 'c']
+    assert followed == ['a', 'b', 'c']
+    assert flight.stats()['streams'] == 0
+
+
+def test_async_stream_overloaded_before_any_piece():
+    flight = AsyncSingleFlight(max_concurrent=1, max_queue=0)
+
+    async def pieces():
+        yield 'a'
+
+    async def main():
+        leader = await flight.stream('first', pieces)
+        with pytest.raises(Overloaded):
+            await flight.stream('second', pieces)
+        await leader.aclose()
+        return [piece async for piece in await flight.stream('second', pieces)]
+
+    assert asyncio.run(main()) == ['a']
@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("load_dotenv")
+pytest.importorskip("psycopg_pool")
+
+from twilio_controller.insight_generation import estimate_tokens
+from twilio_controller.weekly_context import WeeklyCall
+from twilio_controller.weekly_prompt import build_prompt, render_with_date, render_with_insight
+
+
+def call(call_id, words, summary=None):
+    transcript = " ".join(f"w{call_id}" for _ in range(words))
+    return WeeklyCall(call_id, None, transcript, call_id, f"insight {call_id}", summary)
+
+
+def render(number, call, text):
+    return f"Call {number}: {text}\n"
+
+
+def blocks(prompt):
+    return [f"{line}\n" for line in prompt.splitlines()]
+
+
+# Newest first, as the snapshot hands them over
+CALLS = [call(1, 100, "newest summary"), call(2, 100, "older summary"), call(3, 100)]
+
+
+def test_everything_fits_in_full():
+    prompt = build_prompt(CALLS, render, token_budget=10000)
+    assert blocks(prompt) == [render(i, c, c.transcript) for i, c in enumerate(CALLS, start=1)]
+
+
+@pytest.mark.parametrize("budget", [200, 120, 60, 20, 5])
+def test_stays_within_budget(budget):
+    prompt = build_prompt(CALLS, render, token_budget=budget)
+    assert sum(estimate_tokens(block) for block in blocks(prompt)) <= budget
+
+
+def test_newest_calls_are_upgraded_to_full_transcripts_first():
+    prompt = build_prompt(CALLS, render, token_budget=200)
+    assert blocks(prompt)[0] == render(1, CALLS[0], CALLS[0].transcript)
+    assert blocks(prompt)[1] == render(2, CALLS[1], "older summary")
+
+
+def test_oldest_calls_are_left_out_when_compact_forms_dont_fit():
+    prompt = build_prompt(CALLS, render, token_budget=60)
+    assert blocks(prompt) == [render(1, CALLS[0], "newest summary"), render(2, CALLS[1], "older summary")]
+
+
+def test_a_lone_call_is_truncated_rather_than_dropped():
+    prompt = build_prompt(CALLS, render, token_budget=5)
+    assert prompt.startswith("Call 1: newest")
+    assert prompt.endswith("...\n")
+
+
+def test_no_calls():
+    assert build_prompt([], render) == ""
+
+
+def test_renderers():
+    assert "Call Insight: insight 1" in render_with_insight(1, CALLS[0], "text")
+    assert "Date Recorded: None" in render_with_date(1, CALLS[0], "text")
@@ -1,13 +1,12 @@
 from load_dotenv import load_dotenv
-from openai import OpenAI
-import psycopg
+from twilio_controller.weekly_context import weekly_snapshot
+from twilio_controller.weekly_prompt import build_prompt, render_with_insight, messages_for
+from twilio_controller.single_flight import llm_flight
+from twilio_controller.llm_gateway import chat
 from datetime import date
-import os
-import psycopg
 
 load_dotenv()
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 today = date.today().isoformat()
 
 SYSTEM_PROMPT = f"""
@@ -31,82 +30,65 @@ Example output:
 - Journal: Get a pen and pencil, and write your feelings down!
 """
 
-def get_this_week_insights():
-    query = """
-    SELECT uc.cleaned_text, ci.insight
-    FROM "User_Call" uc
-    JOIN "Call_Insights" ci ON uc.id = ci.call_id
-    WHERE uc.created_at >= NOW() - INTERVAL '7 days'
-    ORDER BY uc.created_at DESC
-    """
-
-    calls = {}
-
-    try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        values = []
-
-        cur.execute(query)
-        result = cur.fetchall()
-
-        for i in result:
-            values.append((i[0], i[1]))
-
-    except Exception as e:
-        print(f"Error connecting or querying db: {e}")
-        return e
+def text_for_llm(user_id=None, snapshot=None):
+    # Summaries or truncated transcripts where the week's calls don't all fit in full
+    snapshot = snapshot or weekly_snapshot(user_id)
+    return build_prompt(snapshot.with_insights(), render_with_insight)
 
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn'in locals() and conn:
-            conn.close()
+def _complete(prompt):
+    return chat('advice', messages_for(SYSTEM_PROMPT, prompt))
 
+def generate_advice(user_id=None):
+    # Identical concurrent prompts share one completion
+    prompt = text_for_llm(user_id)
+    return llm_flight.do(('advice', prompt), _complete, prompt)
 
-    if not values:
-        return []
 
-    for i in range(len(values)):
-        calls[i + 1] = {'call_transcript': values[i][0], 'insight': values[i][1]}
+def parse_output(user_id=None):
+    return parse_advice(generate_advice(user_id))
 
-    return calls
 
-def text_for_llm():
-    calls = get_this_week_insights()
+def parse_advice_line(line):
+    """Returns (title, explanation) for one '- Title: explanation' line, None if it isn't one."""
+    splitsies = line.replace('- ', '').split(':')
+    if len(splitsies) < 2:
+        return None
+    return splitsies[0], splitsies[1].strip()
 
-    final_string = ""
 
-    for index, call in enumerate(calls.items()):
-        final_string += f"Call {index + 1}: \n"
-        final_string += f"Transcript: {call[1].get('call_transcript')} \n"
-        final_string += f"Call Insight: {call[1].get('insight')} \n"
-        final_string += "\n"
-
-    return final_string
-
-def generate_advice():
-    output = openai_client.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=[
-        {"role": "developer", "content": SYSTEM_PROMPT},
-        {"role": "user" , "content": text_for_llm()}
-    ]
-    )
+def parse_advice(output):
+    final = {}
 
-    return output.choices[0].message.content
+    for line in output.split('\n'):
+        item = parse_advice_line(line)
+        if item:
+            final[item[0]] = item[1]
 
+    return final
 
-def parse_output():
-    output = generate_advice()
 
-    final = {}
-
-    output = output.split('\n')
-    for i in range(len(output)):
-        output[i] = output[i].replace('- ', '')
-        splitsies = output[i].split(':')
-        final[splitsies[0]] = splitsies[1].strip()
+class AdviceStreamParser:
+    """
+    parse_advice for streamed output: feed() it text as it arrives and it yields
+    each (title, explanation) as soon as its line is complete.
+    """
 
-    return final
\ No newline at end of file
+    def __init__(self):
+        self.buffer = ""
+        self.advice = {}
+
+    def feed(self, text):
+        self.buffer += text
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            yield from self._parse(line)
+
+    def close(self):
+        line, self.buffer = self.buffer, ""
+        yield from self._parse(line)
+
+    def _parse(self, line):
+        item = parse_advice_line(line)
+        if item:
+            self.advice[item[0]] = item[1]
+            yield item
\ No newline at end of file
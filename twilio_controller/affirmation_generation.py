@@ -1,13 +1,12 @@
 from load_dotenv import load_dotenv
-from openai import OpenAI
-import psycopg
+from twilio_controller.weekly_context import weekly_snapshot
+from twilio_controller.weekly_prompt import build_prompt, render_with_insight, messages_for
+from twilio_controller.single_flight import llm_flight
+from twilio_controller.llm_gateway import chat
 from datetime import date
-import os
-import psycopg
 
 load_dotenv()
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 today = date.today().isoformat()
 
 SYSTEM_PROMPT = f"""
@@ -22,68 +21,15 @@ Speak in a warm tone and make sure it is in third person, referring to the user
 Keep it concise an short, 2-3 very short sentences at max.
 """
 
-def get_this_week_insights():
-    query = """
-    SELECT uc.cleaned_text, ci.insight
-    FROM "User_Call" uc
-    JOIN "Call_Insights" ci ON uc.id = ci.call_id
-    WHERE uc.created_at >= NOW() - INTERVAL '7 days'
-    ORDER BY uc.created_at DESC
-    """
+def text_for_llm(user_id=None, snapshot=None):
+    # Summaries or truncated transcripts where the week's calls don't all fit in full
+    snapshot = snapshot or weekly_snapshot(user_id)
+    return build_prompt(snapshot.with_insights(), render_with_insight)
 
-    calls = {}
+def _complete(prompt):
+    return chat('affirmation', messages_for(SYSTEM_PROMPT, prompt))
 
-    try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        values = []
-
-        cur.execute(query)
-        result = cur.fetchall()
-
-        for i in result:
-            values.append((i[0], i[1]))
-
-    except Exception as e:
-        print(f"Error connecting or querying db: {e}")
-        return e
-
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn'in locals() and conn:
-            conn.close()
-
-
-    if not values:
-        return []
-
-    for i in range(len(values)):
-        calls[i + 1] = {'call_transcript': values[i][0], 'insight': values[i][1]}
-
-    return calls
-
-def text_for_llm():
-    calls = get_this_week_insights()
-
-    final_string = ""
-
-    for index, call in enumerate(calls.items()):
-        final_string += f"Call {index + 1}: \n"
-        final_string += f"Transcript: {call[1].get('call_transcript')} \n"
-        final_string += f"Call Insight: {call[1].get('insight')} \n"
-        final_string += "\n"
-
-    return final_string
-
-def generate_affirmation():
-    output = openai_client.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=[
-        {"role": "developer", "content": SYSTEM_PROMPT},
-        {"role": "user" , "content": text_for_llm()}
-    ]
-    )
-
-    return output.choices[0].message.content
+def generate_affirmation(user_id=None):
+    # Identical concurrent prompts share one completion
+    prompt = text_for_llm(user_id)
+    return llm_flight.do(('affirmation', prompt), _complete, prompt)
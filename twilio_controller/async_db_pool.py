@@ -0,0 +1,77 @@
+from psycopg_pool import AsyncConnectionPool
+from twilio_controller.db_pool import (
+    SUPABASE_URL, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT,
+    POOL_MAX_LIFETIME, POOL_MAX_IDLE, PGBOUNCER_MODE, _connection_kwargs
+)
+import asyncio
+
+# Same settings as db_pool, but for the async app. The pool has to be opened
+# from inside the running event loop, so it's created on first use.
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_async_pool():
+    global _pool
+
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                pool = AsyncConnectionPool(
+                    SUPABASE_URL,
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    timeout=POOL_TIMEOUT,
+                    max_lifetime=POOL_MAX_LIFETIME,
+                    max_idle=POOL_MAX_IDLE,
+                    kwargs=_connection_kwargs(),
+                    check=AsyncConnectionPool.check_connection,
+                    name='mindline-async',
+                    open=False,
+                )
+                await pool.open()
+                _pool = pool
+
+    return _pool
+
+
+class _Checkout:
+    """async with async_connection() as conn: ... mirrors db_pool.connection()."""
+
+    def __init__(self):
+        self._cm = None
+
+    async def __aenter__(self):
+        pool = await get_async_pool()
+        self._cm = pool.connection()
+        return await self._cm.__aenter__()
+
+    async def __aexit__(self, *exc):
+        return await self._cm.__aexit__(*exc)
+
+
+def async_connection():
+    return _Checkout()
+
+
+def async_pool_stats():
+    if _pool is None:
+        return {}
+
+    stats = _pool.get_stats()
+    requests = stats.get('requests_num', 0)
+
+    stats['avg_wait_ms'] = stats.get('requests_wait_ms', 0) / requests if requests else 0.0
+    stats['min_size'] = _pool.min_size
+    stats['max_size'] = _pool.max_size
+    stats['pgbouncer_mode'] = PGBOUNCER_MODE
+
+    return stats
+
+
+async def close_async_pool():
+    global _pool
+
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -0,0 +1,88 @@
+from load_dotenv import load_dotenv
+from psycopg_pool import ConnectionPool
+import threading
+import atexit
+import os
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+
+# Pool sizing, all overridable from the environment so it can be tuned under load
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))              # seconds a checkout may wait
+POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800))  # recycle connections after this
+POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))           # close idle extras after this
+
+# Supabase's pooler (pgbouncer, transaction mode) can't keep server side prepared
+# statements between transactions, so they have to be switched off in that mode.
+PGBOUNCER_MODE = os.getenv('DB_PGBOUNCER_MODE', 'true').lower() in ('1', 'true', 'yes')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _connection_kwargs():
+    if PGBOUNCER_MODE:
+        return {'prepare_threshold': None}
+    return {}
+
+
+def get_pool():
+    """Returns the process wide pool, creating it on first use (so forked workers each get their own)."""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    SUPABASE_URL,
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    timeout=POOL_TIMEOUT,
+                    max_lifetime=POOL_MAX_LIFETIME,
+                    max_idle=POOL_MAX_IDLE,
+                    kwargs=_connection_kwargs(),
+                    check=ConnectionPool.check_connection,  # health check before handing out
+                    name='mindline',
+                    open=True,
+                )
+
+    return _pool
+
+
+def connection():
+    """
+    Checks a connection out of the pool. Use as a context manager, the transaction
+    is committed on a clean exit and rolled back if an exception escapes.
+    """
+    return get_pool().connection()
+
+
+def pool_stats():
+    """Checkout counts, wait times and connection counts, used for sizing the pool."""
+    if _pool is None:
+        return {}
+
+    stats = _pool.get_stats()
+    requests = stats.get('requests_num', 0)
+
+    stats['avg_wait_ms'] = stats.get('requests_wait_ms', 0) / requests if requests else 0.0
+    stats['min_size'] = _pool.min_size
+    stats['max_size'] = _pool.max_size
+    stats['pgbouncer_mode'] = PGBOUNCER_MODE
+
+    return stats
+
+
+def close_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(close_pool)
@@ -0,0 +1,158 @@
+from load_dotenv import load_dotenv
+from twilio_controller.db_pool import connection
+from twilio_controller.weekly_context import weekly_snapshot
+from datetime import date
+import threading
+import sqlite3
+import hashlib
+import json
+import time
+import os
+
+load_dotenv()
+
+DIGEST_CACHE_PATH = os.getenv('DIGEST_CACHE_PATH', os.path.join(os.getcwd(), 'twilio_controller', 'digest_cache.sqlite3'))
+DIGEST_CACHE_TTL = float(os.getenv('DIGEST_CACHE_TTL', 24 * 60 * 60))
+DIGEST_CACHE_MAX_ENTRIES = int(os.getenv('DIGEST_CACHE_MAX_ENTRIES', 500))
+
+# Cheap summary of the 7 day window, changes whenever a call or insight is added
+# or an old call falls out of the window
+FINGERPRINT_QUERY = """
+SELECT COUNT(*), MIN(uc.id), MAX(uc.id), MAX(ci.id)
+FROM "User_Call" uc
+LEFT JOIN "Call_Insights" ci ON uc.id = ci.call_id
+WHERE uc.created_at >= NOW() - INTERVAL '7 days'
+AND (%s::bigint IS NULL OR uc.user_id = %s)
+"""
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _user_key(user_id):
+    return 'all' if user_id is None else str(user_id)
+
+
+def _open():
+    global _schema_ready
+
+    conn = sqlite3.connect(DIGEST_CACHE_PATH, timeout=5)
+
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS digest_cache (
+                        kind TEXT NOT NULL,
+                        user_key TEXT NOT NULL,
+                        day TEXT NOT NULL,
+                        fingerprint TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_access REAL NOT NULL,
+                        PRIMARY KEY (kind, user_key, day)
+                    )
+                """)
+                conn.execute('CREATE INDEX IF NOT EXISTS digest_cache_last_access ON digest_cache (last_access)')
+                conn.commit()
+                _schema_ready = True
+
+    return conn
+
+
+def fingerprint_row(row):
+    return hashlib.sha256(repr(tuple(row)).encode()).hexdigest()
+
+
+def week_fingerprint(user_id=None):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(FINGERPRINT_QUERY, (user_id, user_id))
+            row = cur.fetchone()
+
+    return fingerprint_row(row)
+
+
+def _evict(conn, now):
+    conn.execute('DELETE FROM digest_cache WHERE created_at < ?', (now - DIGEST_CACHE_TTL,))
+    conn.execute("""
+        DELETE FROM digest_cache WHERE rowid IN (
+            SELECT rowid FROM digest_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+        )
+    """, (DIGEST_CACHE_MAX_ENTRIES,))
+
+
+def lookup(kind, user_id, fingerprint):
+    """Returns (True, value) for a fresh entry matching the fingerprint, else (False, None)."""
+    day = date.today().isoformat()
+    user_key = _user_key(user_id)
+    now = time.time()
+
+    conn = _open()
+    try:
+        row = conn.execute(
+            'SELECT fingerprint, value, created_at FROM digest_cache WHERE kind = ? AND user_key = ? AND day = ?',
+            (kind, user_key, day)
+        ).fetchone()
+
+        if row and row[0] == fingerprint and row[2] >= now - DIGEST_CACHE_TTL:
+            conn.execute(
+                'UPDATE digest_cache SET last_access = ? WHERE kind = ? AND user_key = ? AND day = ?',
+                (now, kind, user_key, day)
+            )
+            conn.commit()
+            return True, json.loads(row[1])
+    finally:
+        conn.close()
+
+    return False, None
+
+
+def store(kind, user_id, fingerprint, value):
+    day = date.today().isoformat()
+    now = time.time()
+
+    conn = _open()
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO digest_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (kind, _user_key(user_id), day, fingerprint, json.dumps(value), now, now)
+        )
+        _evict(conn, now)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def cached_digest(kind, compute, user_id=None, fingerprint=None):
+    """
+    Returns today's digest of the given kind ('affirmation', 'reminders', 'advice'),
+    calling compute() only if there is no fresh entry for this user, day and week fingerprint.
+    Pass the fingerprint when the caller already has it, as /home does for all its sections.
+    """
+    if fingerprint is None:
+        fingerprint = week_fingerprint(user_id)
+
+    hit, value = lookup(kind, user_id, fingerprint)
+    if hit:
+        return value
+
+    # compute() reads the shared weekly snapshot; bring it up to this fingerprint
+    # first so a stale snapshot isn't cached under the new one
+    weekly_snapshot(user_id, fingerprint)
+
+    value = compute()
+    store(kind, user_id, fingerprint, value)
+
+    return value
+
+
+def invalidate_user(user_id=None):
+    """Drops every cached digest that could include this user's calls."""
+    conn = _open()
+    try:
+        conn.execute('DELETE FROM digest_cache WHERE user_key IN (?, ?)', (_user_key(user_id), 'all'))
+        conn.commit()
+    finally:
+        conn.close()
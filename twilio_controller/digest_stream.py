@@ -0,0 +1,144 @@
+from twilio_controller import affirmation_generation, advice_generation
+from twilio_controller.digest_cache import week_fingerprint, lookup, store
+from twilio_controller.weekly_context import weekly_snapshot
+from twilio_controller.weekly_prompt import messages_for
+from twilio_controller.llm_gateway import chat_stream
+from twilio_controller.single_flight import llm_flight
+import json
+
+# Server-Sent Events for the affirmation and advice digests, so the page can
+# show text while the model is still writing it:
+#   event: token  data: {"text": ...}                           (affirmation)
+#   event: item   data: {"title": ..., "explanation": ...}      (advice, one per bullet)
+#   event: done   data: {"affirmation": ...} / {"advice": {...}}
+#   event: error  data: {"error": ...}
+# A digest already in the digest cache is sent straight away in the same shape.
+# When the model's wait queue is full the request gets a 503 instead of a stream.
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+STREAMED_DIGESTS = {
+    'affirmation': affirmation_generation,
+    'advice': advice_generation,
+}
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def cached_events(kind, value):
+    if kind == 'advice':
+        for title, explanation in value.items():
+            yield sse('item', {'title': title, 'explanation': explanation})
+    else:
+        yield sse('token', {'text': value})
+    yield sse('done', {kind: value})
+
+
+class DigestEvents:
+    """Turns streamed completion text into the events for one digest."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.parts = []
+        self.parser = advice_generation.AdviceStreamParser() if kind == 'advice' else None
+
+    def feed(self, text):
+        self.parts.append(text)
+        if self.parser is None:
+            yield sse('token', {'text': text})
+            return
+        for title, explanation in self.parser.feed(text):
+            yield sse('item', {'title': title, 'explanation': explanation})
+
+    def close(self):
+        if self.parser is not None:
+            for title, explanation in self.parser.close():
+                yield sse('item', {'title': title, 'explanation': explanation})
+
+    @property
+    def value(self):
+        return self.parser.advice if self.parser is not None else "".join(self.parts)
+
+
+class EventStream:
+    """
+    Response body over a digest's events that also closes the completion stream
+    under them, so its llm_flight slot is freed even if the client leaves before
+    the first event.
+    """
+
+    def __init__(self, events, pieces=None):
+        self.events = events
+        self.pieces = pieces
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.events)
+
+    def close(self):
+        self.events.close()
+        if self.pieces is not None and hasattr(self.pieces, 'close'):
+            self.pieces.close()
+
+
+class AsyncEventStream:
+    """EventStream for the async app."""
+
+    def __init__(self, events, pieces=None):
+        self.events = events
+        self.pieces = pieces
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.events.__anext__()
+
+    async def aclose(self):
+        await self.events.aclose()
+        if self.pieces is not None and hasattr(self.pieces, 'aclose'):
+            await self.pieces.aclose()
+
+
+def error_events(kind, e):
+    print(f"Error streaming {kind}: {e}")
+    yield sse('error', {'error': f"Couldn't generate {kind}"})
+
+
+def generated_events(kind, user_id, fingerprint, pieces):
+    events = DigestEvents(kind)
+    try:
+        for text in pieces:
+            yield from events.feed(text)
+        yield from events.close()
+    except Exception as e:
+        yield from error_events(kind, e)
+        return
+
+    store(kind, user_id, fingerprint, events.value)
+    yield sse('done', {kind: events.value})
+
+
+def digest_events(kind, user_id=None):
+    """
+    Today's digest of kind ('affirmation' or 'advice') as an EventStream of SSE,
+    stored in the digest cache when done. Generation goes through llm_flight like
+    the non-streamed digests: identical prompts share one completion, and Overloaded
+    is raised, before any event, when too many are already waiting on the model.
+    """
+    try:
+        fingerprint = week_fingerprint(user_id)
+        hit, value = lookup(kind, user_id, fingerprint)
+        if hit:
+            return EventStream(cached_events(kind, value))
+
+        module = STREAMED_DIGESTS[kind]
+        prompt = module.text_for_llm(user_id, weekly_snapshot(user_id, fingerprint))
+    except Exception as e:
+        return EventStream(error_events(kind, e))
+
+    pieces = llm_flight.stream((kind, prompt), chat_stream, kind, messages_for(module.SYSTEM_PROMPT, prompt))
+    return EventStream(generated_events(kind, user_id, fingerprint, pieces), pieces)
@@ -0,0 +1,215 @@
+from load_dotenv import load_dotenv
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from collections import deque
+import threading
+import queue
+import time
+import os
+
+load_dotenv()
+
+# Sentences from concurrently running pipelines are collected into micro-batches
+# (up to EMOTION_BATCH_MAX sentences, or whatever arrived within
+# EMOTION_BATCH_DELAY_MS of the first one) and each batch is classified with a
+# single predict_proba on a pool of worker processes. With
+# EMOTION_BATCH_PROCESSES=0 batches run on the dispatcher thread instead.
+# The workers are started with EMOTION_BATCH_START_METHOD ('spawn' by default)
+# rather than forked, since the parent is already running the dispatcher and
+# job threads by then.
+EMOTION_BATCHING = os.getenv('EMOTION_BATCHING', 'true').lower() in ('1', 'true', 'yes')
+EMOTION_BATCH_MAX = int(os.getenv('EMOTION_BATCH_MAX', 256))
+EMOTION_BATCH_DELAY_MS = float(os.getenv('EMOTION_BATCH_DELAY_MS', 10))
+EMOTION_BATCH_PROCESSES = int(os.getenv('EMOTION_BATCH_PROCESSES', 2))
+EMOTION_BATCH_START_METHOD = os.getenv('EMOTION_BATCH_START_METHOD', 'spawn')
+EMOTION_BATCH_TIMEOUT = float(os.getenv('EMOTION_BATCH_TIMEOUT', 60))  # seconds classify() waits for its batch
+EMOTION_BATCH_LOG_INTERVAL = float(os.getenv('EMOTION_BATCH_LOG_INTERVAL', 60))  # seconds, 0 to disable
+
+LATENCY_SAMPLES = 1000
+
+
+def _init_worker():
+    from twilio_controller.stim_emotion_connector import get_model
+    get_model()
+
+
+def _predict(sentences):
+    from twilio_controller.stim_emotion_connector import get_model
+    return get_model().predict_proba(sentences)
+
+
+class _Request:
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+def _percentile_ms(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return round(ordered[max(int(len(ordered) * q) - 1, 0)] * 1000, 2)
+
+
+class EmotionBatcher:
+    """Classifies sentence lists submitted from many threads in shared batches."""
+
+    def __init__(self, max_batch=EMOTION_BATCH_MAX, max_delay_ms=EMOTION_BATCH_DELAY_MS, processes=EMOTION_BATCH_PROCESSES):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.processes = processes
+
+        self._queue = queue.Queue()
+        self._pool_lock = threading.Lock()
+        self._pool = self._new_pool() if processes else None
+        # Batches handed to the pool but not finished, so a backlog waits here and keeps batching
+        self._in_flight = threading.BoundedSemaphore(max(processes, 1) * 2)
+
+        self._lock = threading.Lock()
+        self._sentences = 0
+        self._batches = 0
+        self._started = time.perf_counter()
+        self._queue_waits = deque(maxlen=LATENCY_SAMPLES)
+        self._inference = deque(maxlen=LATENCY_SAMPLES)
+        self._last_log = time.monotonic()
+
+        threading.Thread(target=self._dispatch, name='emotion-batcher', daemon=True).start()
+
+    def submit(self, sentences):
+        """Returns a Future of one probability row per sentence."""
+        request = _Request(list(sentences))
+        if not request.sentences:
+            request.future.set_result([])
+        else:
+            self._queue.put(request)
+        return request.future
+
+    def classify(self, sentences, timeout=EMOTION_BATCH_TIMEOUT):
+        # Bounded, so a lost batch fails the job instead of hanging it while its claim is renewed
+        return self.submit(sentences).result(timeout=timeout)
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context(EMOTION_BATCH_START_METHOD),
+            initializer=_init_worker,
+        )
+
+    def _replace_pool(self, broken):
+        # A worker died (e.g. OOM killed), the executor won't take work again
+        with self._pool_lock:
+            if self._pool is not broken:
+                return
+            print("Emotion batcher: worker pool broke, starting a new one")
+            self._pool = self._new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0].sentences)
+        deadline = time.perf_counter() + self.max_delay
+
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.sentences)
+
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            self._in_flight.acquire()
+
+            started = time.perf_counter()
+            with self._lock:
+                for request in batch:
+                    self._queue_waits.append(started - request.enqueued_at)
+
+            sentences = [sentence for request in batch for sentence in request.sentences]
+
+            # The pool this batch went to, so only that one is replaced if it broke
+            pool = self._pool
+            future = Future()
+            if pool is None:
+                try:
+                    future.set_result(_predict(sentences))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                try:
+                    future = pool.submit(_predict, sentences)
+                except Exception as e:
+                    # Fail this batch rather than the dispatcher thread
+                    future.set_exception(e)
+                    if isinstance(e, BrokenProcessPool):
+                        self._replace_pool(pool)
+
+            future.add_done_callback(lambda f, batch=batch, started=started, pool=pool: self._finish(batch, f, started, pool))
+
+    def _finish(self, batch, future, started, pool):
+        self._in_flight.release()
+
+        try:
+            probabilities = future.result()
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            if isinstance(e, BrokenProcessPool) and pool is not None:
+                self._replace_pool(pool)
+            return
+
+        start = 0
+        for request in batch:
+            request.future.set_result(list(probabilities[start:start + len(request.sentences)]))
+            start += len(request.sentences)
+
+        with self._lock:
+            self._sentences += start
+            self._batches += 1
+            self._inference.append(time.perf_counter() - started)
+
+        if EMOTION_BATCH_LOG_INTERVAL and time.monotonic() - self._last_log >= EMOTION_BATCH_LOG_INTERVAL:
+            self._last_log = time.monotonic()
+            print(f"Emotion batcher: {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self._started
+            return {
+                'sentences': self._sentences,
+                'batches': self._batches,
+                'mean_batch_size': round(self._sentences / self._batches, 1) if self._batches else None,
+                'sentences_per_sec': round(self._sentences / elapsed, 1) if elapsed > 0 else None,
+                'queue_wait_p50_ms': _percentile_ms(self._queue_waits, 0.5),
+                'queue_wait_p95_ms': _percentile_ms(self._queue_waits, 0.95),
+                'inference_p50_ms': _percentile_ms(self._inference, 0.5),
+                'inference_p95_ms': _percentile_ms(self._inference, 0.95),
+                'queued': self._queue.qsize(),
+            }
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    global _batcher
+
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = EmotionBatcher()
+    return _batcher
+
+
+def stats():
+    return _batcher.stats() if _batcher is not None else None
@@ -0,0 +1,377 @@
+from collections import namedtuple
+import subprocess
+import datetime
+import hashlib
+import pickle
+import shutil
+import json
+import sys
+import os
+import re
+
+# The emotion classifier (vectorizer + random forest) as a directory of .npy
+# arrays that load with mmap instead of being unpickled. Every process maps the
+# same file pages, so starting a worker is near instant and N workers don't hold
+# N copies of the forest. Build it whenever rf_model.pkl changes:
+#   python -m twilio_controller.emotion_model export
+#   python -m twilio_controller.emotion_model verify
+#   python -m twilio_controller.emotion_model bench
+# The manifest records the sha256 of the pickle it was exported from, and the
+# loader falls back to the pickle if they no longer match.
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+EMOTION_MODEL_PATH = os.getenv('EMOTION_MODEL_PATH', os.path.join(MODEL_DIR, 'rf_model.pkl'))
+EMOTION_ARTIFACT_PATH = os.getenv('EMOTION_ARTIFACT_PATH', os.path.join(MODEL_DIR, 'rf_model.artifact'))
+EMOTION_ARTIFACT_VERIFY = os.getenv('EMOTION_ARTIFACT_VERIFY', 'true').lower() in ('1', 'true', 'yes')
+
+ARTIFACT_FORMAT = 1
+MAX_PROBA_DIFF = 1e-5
+
+ARRAYS = ('terms', 'term_index', 'idf', 'roots', 'left', 'right', 'feature', 'threshold', 'value')
+
+# Sentences the export checks the artifact against the pickle on
+SAMPLE_SENTENCES = [
+    "I'm really sad that my best friend is so far away.",
+    "I am looking forward to going out with my friends tonight!",
+    "Work was stressful and my manager yelled at me.",
+    "I love spending time with my family on weekends.",
+    "I was scared when the car almost hit me.",
+    "Wow, I did not expect to get the job offer.",
+    "Today was fine.",
+    "",
+]
+
+
+class StaleArtifact(Exception):
+    """The artifact wasn't exported from the current pickle, or is from another format version."""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_pickle(path=EMOTION_MODEL_PATH):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _split_model(model):
+    """Returns (vectorizer, tfidf_transformer or None, forest) from the pickled pipeline."""
+    steps = [step for _, step in model.steps] if hasattr(model, 'steps') else None
+    if not steps or len(steps) not in (2, 3):
+        raise ValueError("Expected a vectorizer (+ tf-idf transformer) + forest pipeline")
+
+    return steps[0], (steps[1] if len(steps) == 3 else None), steps[-1]
+
+
+def _vectorizer_config(vectorizer, transformer):
+    params = vectorizer.get_params()
+
+    if params.get('analyzer') != 'word' or params.get('tokenizer') or params.get('preprocessor') or params.get('strip_accents'):
+        raise ValueError("Only word analyzers with the default tokenizer and preprocessor can be exported")
+
+    # TfidfVectorizer carries its tf-idf settings itself, a Pipeline may have a separate TfidfTransformer
+    weighting = transformer if transformer is not None else vectorizer
+    tfidf = hasattr(weighting, 'use_idf')
+
+    stop_words = vectorizer.get_stop_words()
+
+    return {
+        'lowercase': params.get('lowercase', True),
+        'token_pattern': params.get('token_pattern'),
+        'ngram_range': list(params.get('ngram_range', (1, 1))),
+        'stop_words': sorted(stop_words) if stop_words else [],
+        'binary': params.get('binary', False),
+        'tfidf': tfidf,
+        'use_idf': tfidf and weighting.use_idf,
+        'sublinear_tf': tfidf and weighting.sublinear_tf,
+        'norm': weighting.norm if tfidf else None,
+        'n_features': len(vectorizer.vocabulary_),
+    }, (weighting.idf_ if tfidf and weighting.use_idf else None)
+
+
+def export(pickle_path=EMOTION_MODEL_PATH, artifact_path=EMOTION_ARTIFACT_PATH, samples=SAMPLE_SENTENCES):
+    """Writes the artifact for pickle_path, checking its predictions against the pickle's first."""
+    import numpy as np
+
+    model = load_pickle(pickle_path)
+    vectorizer, transformer, forest = _split_model(model)
+    config, idf = _vectorizer_config(vectorizer, transformer)
+
+    terms = sorted(vectorizer.vocabulary_)
+    arrays = {
+        'terms': np.array(terms, dtype=str),
+        'term_index': np.array([vectorizer.vocabulary_[term] for term in terms], dtype=np.int32),
+        'idf': np.asarray(idf if idf is not None else [], dtype=np.float64),
+    }
+
+    # All trees in one set of node arrays, children as global node indices
+    roots, left, right, feature, threshold, value = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        roots.append(offset)
+        left.append(np.where(tree.children_left == -1, -1, tree.children_left + offset))
+        right.append(np.where(tree.children_right == -1, -1, tree.children_right + offset))
+        feature.append(tree.feature)
+        threshold.append(tree.threshold)
+
+        # Leaf class proportions, as DecisionTreeClassifier.predict_proba normalizes them
+        leaf = tree.value[:, 0, :].astype(np.float64)
+        totals = leaf.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1
+        value.append(leaf / totals)
+
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    arrays.update({
+        'roots': np.array(roots, dtype=np.int64),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'value': np.concatenate(value).astype(np.float32),
+    })
+
+    # Build next to the destination and swap it in, so a reader never sees half an artifact
+    staging = f"{artifact_path}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    checksums = {}
+    for name in ARRAYS:
+        path = os.path.join(staging, f"{name}.npy")
+        np.save(path, arrays[name])
+        checksums[name] = file_sha256(path)
+
+    manifest = {
+        'format_version': ARTIFACT_FORMAT,
+        'exported_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'source_sha256': file_sha256(pickle_path),
+        'classes': [c.item() if hasattr(c, 'item') else c for c in forest.classes_],
+        'n_trees': len(roots),
+        'max_depth': int(max_depth),
+        'vectorizer': config,
+        'arrays': checksums,
+    }
+    with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    diff = _max_diff(model, EmotionModel(staging, verify_source=None), samples)
+    if diff > MAX_PROBA_DIFF:
+        shutil.rmtree(staging)
+        raise ValueError(f"Artifact predictions differ from the pickle by {diff}")
+
+    if os.path.exists(artifact_path):
+        shutil.rmtree(artifact_path)
+    os.rename(staging, artifact_path)
+
+    return manifest
+
+
+def _max_diff(model, artifact, samples):
+    import numpy as np
+
+    expected = model.predict_proba(samples)
+    actual = artifact.predict_proba(samples)
+    return float(np.abs(expected - actual).max()) if len(samples) else 0.0
+
+
+Vectorized = namedtuple('Vectorized', ['keys', 'data'])
+
+
+class EmotionModel:
+    """
+    predict_proba and classes_ like the pickled pipeline, computed from the
+    mmapped arrays. Trees are walked for every sentence at once with numpy.
+    """
+
+    def __init__(self, path=EMOTION_ARTIFACT_PATH, verify_source=EMOTION_MODEL_PATH):
+        import numpy as np
+
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+
+        if self.manifest.get('format_version') != ARTIFACT_FORMAT:
+            raise StaleArtifact(f"Artifact format {self.manifest.get('format_version')}, expected {ARTIFACT_FORMAT}")
+        if verify_source and os.path.exists(verify_source) and file_sha256(verify_source) != self.manifest['source_sha256']:
+            raise StaleArtifact(f"{path} wasn't exported from the current {verify_source}")
+
+        self.path = path
+        self.arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in ARRAYS}
+        self.classes_ = np.array(self.manifest['classes'])
+
+        config = self.manifest['vectorizer']
+        self.config = config
+        self.n_features = config['n_features']
+        self.token_pattern = re.compile(config['token_pattern'])
+        self.stop_words = frozenset(config['stop_words'])
+
+    def _ngrams(self, text):
+        if self.config['lowercase']:
+            text = text.lower()
+
+        tokens = [token for token in self.token_pattern.findall(text) if token not in self.stop_words]
+        min_n, max_n = self.config['ngram_range']
+
+        for n in range(min_n, max_n + 1):
+            for i in range(len(tokens) - n + 1):
+                yield " ".join(tokens[i:i + n])
+
+    def transform(self, sentences):
+        """Sparse rows as sorted keys (row * n_features + column) and their weights."""
+        import numpy as np
+
+        rows, grams = [], []
+        for row, sentence in enumerate(sentences):
+            for gram in self._ngrams(sentence):
+                rows.append(row)
+                grams.append(gram)
+
+        terms = self.arrays['terms']
+        if not grams or len(terms) == 0:
+            return Vectorized(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+        grams = np.array(grams, dtype=str)
+        positions = np.minimum(np.searchsorted(terms, grams), len(terms) - 1)
+        known = terms[positions] == grams
+
+        columns = self.arrays['term_index'][positions[known]].astype(np.int64)
+        keys = np.array(rows, dtype=np.int64)[known] * self.n_features + columns
+        keys, counts = np.unique(keys, return_counts=True)
+
+        data = np.ones(len(keys)) if self.config['binary'] else counts.astype(np.float64)
+
+        if self.config['tfidf']:
+            if self.config['sublinear_tf']:
+                data = np.log(data) + 1
+            if self.config['use_idf']:
+                data = data * self.arrays['idf'][keys % self.n_features]
+
+            norm = self.config['norm']
+            if norm:
+                row_of = keys // self.n_features
+                totals = np.zeros(len(sentences))
+                np.add.at(totals, row_of, data ** 2 if norm == 'l2' else np.abs(data))
+                if norm == 'l2':
+                    totals = np.sqrt(totals)
+                totals[totals == 0] = 1
+                data = data / totals[row_of]
+
+        return Vectorized(keys, data)
+
+    def predict_proba(self, sentences):
+        import numpy as np
+
+        sentences = list(sentences)
+        n = len(sentences)
+        if n == 0:
+            return np.empty((0, len(self.classes_)))
+
+        x = self.transform(sentences)
+        left, right = self.arrays['left'], self.arrays['right']
+        feature, threshold = self.arrays['feature'], self.arrays['threshold']
+
+        nodes = np.repeat(np.asarray(self.arrays['roots'])[None, :], n, axis=0)
+        row_base = (np.arange(n, dtype=np.int64) * self.n_features)[:, None]
+
+        for _ in range(self.manifest['max_depth'] + 1):
+            children = left[nodes]
+            active = children != -1
+            if not active.any():
+                break
+
+            wanted = row_base + np.maximum(feature[nodes], 0)
+            if len(x.keys):
+                positions = np.minimum(np.searchsorted(x.keys, wanted), len(x.keys) - 1)
+                values = np.where(x.keys[positions] == wanted, x.data[positions], 0.0)
+            else:
+                values = np.zeros(nodes.shape)
+
+            # Trees compare float32 features against their thresholds
+            go_left = values.astype(np.float32) <= threshold[nodes]
+            nodes = np.where(active, np.where(go_left, children, right[nodes]), nodes)
+
+        return np.asarray(self.arrays['value'][nodes], dtype=np.float64).mean(axis=1)
+
+    def warm(self):
+        """Reads the array files through once, so every process mapping them finds the pages in memory."""
+        for name in ARRAYS:
+            with open(os.path.join(self.path, f"{name}.npy"), 'rb') as f:
+                while f.read(1 << 20):
+                    pass
+
+
+def load_model(pickle_path=EMOTION_MODEL_PATH, artifact_path=EMOTION_ARTIFACT_PATH):
+    """The mmapped artifact when there is a current one, else the pickle."""
+    if os.path.exists(os.path.join(artifact_path, 'manifest.json')):
+        try:
+            return EmotionModel(artifact_path, pickle_path if EMOTION_ARTIFACT_VERIFY else None)
+        except StaleArtifact as e:
+            print(f"Ignoring emotion model artifact: {e}")
+
+    return load_pickle(pickle_path)
+
+
+def verify(pickle_path=EMOTION_MODEL_PATH, artifact_path=EMOTION_ARTIFACT_PATH, samples=SAMPLE_SENTENCES):
+    """Checks the artifact's files and source checksum, and its predictions against the pickle."""
+    artifact = EmotionModel(artifact_path, pickle_path)
+
+    for name, expected in artifact.manifest['arrays'].items():
+        if file_sha256(os.path.join(artifact_path, f"{name}.npy")) != expected:
+            raise StaleArtifact(f"{name}.npy doesn't match its checksum")
+
+    return _max_diff(load_pickle(pickle_path), artifact, samples)
+
+
+_BENCH = '''
+import time, sys
+try:
+    import resource
+except ImportError:
+    # No resource module on Windows, fall back to Python's own allocations
+    resource = None
+    import tracemalloc
+    tracemalloc.start()
+start = time.perf_counter()
+from twilio_controller import emotion_model
+model = emotion_model.{loader}
+model.predict_proba(["warm up sentence"])
+elapsed = time.perf_counter() - start
+if resource:
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024), 'max RSS')
+else:
+    print(elapsed, tracemalloc.get_traced_memory()[1], 'peak traced allocations')
+'''
+
+
+def bench():
+    """Cold start time and peak memory of a fresh process loading each form of the model."""
+    for name, loader in (('pickle', 'load_pickle()'), ('artifact', 'EmotionModel()')):
+        elapsed, peak, measure = subprocess.run(
+            [sys.executable, '-c', _BENCH.format(loader=loader)],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(MODEL_DIR)
+        ).stdout.split(None, 2)
+        print(f"{name}: load + first prediction {float(elapsed) * 1000:.0f}ms, {measure.strip()} {int(peak) // (1024 * 1024)}MB")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == 'export':
+        manifest = export()
+        print(f"Exported {manifest['n_trees']} trees to {EMOTION_ARTIFACT_PATH}")
+    elif command == 'verify':
+        print(f"Artifact OK, max probability difference {verify()}")
+    elif command == 'bench':
+        bench()
+    else:
+        print("Usage: python -m twilio_controller.emotion_model export|verify|bench")
+        sys.exit(1)
@@ -0,0 +1,207 @@
+from load_dotenv import load_dotenv
+from multiprocessing import Process
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from twilio_controller import job_queue
+import threading
+import json
+import argparse
+import socket
+import time
+import os
+
+load_dotenv()
+
+# Runs queued post-call jobs. Scale ingestion by running more processes here or
+# on more machines, they coordinate through the Ingestion_Job table:
+#   python -m twilio_controller.ingestion_worker --processes 4 --concurrency 8
+# With --stats-port each process serves its emotion batcher, LLM and pool stats
+# on the same /internal/* paths as the backend (process i on stats-port + i).
+
+POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 2))
+
+
+def _handlers():
+    # Imported here so each worker process sets up its own clients and pool
+    from twilio_controller.twilio_handler import run_call_pipeline
+    from twilio_controller.insight_summaries import refresh as refresh_insight_summaries, refresh_all
+
+    return {
+        'post_call': lambda payload: run_call_pipeline(
+            recording_sid=payload.get('recording_sid'),
+            call_sid=payload.get('call_sid'),
+        ),
+        'refresh_insight_summaries': lambda payload: refresh_insight_summaries(payload.get('stim_ids', [])),
+        'refresh_all_insight_summaries': lambda payload: refresh_all(),
+    }
+
+
+def _schedule_periodic(interval):
+    # Every worker machine queues the periodic jobs; only one copy waits at a time
+    while True:
+        try:
+            job_queue.enqueue_unless_pending('refresh_all_insight_summaries', {})
+        except Exception as e:
+            print(f"Couldn't queue periodic insight summary refresh: {e}")
+        time.sleep(interval)
+
+
+def _start_scheduler():
+    from twilio_controller.insight_summaries import SUMMARY_REFRESH_INTERVAL
+    threading.Thread(target=_schedule_periodic, args=(SUMMARY_REFRESH_INTERVAL,), name='scheduler', daemon=True).start()
+
+
+def _heartbeat(job_id, worker_id, stop):
+    # Keep extending the claim while the job runs so a slow call isn't picked up twice
+    while not stop.wait(job_queue.JOB_VISIBILITY_TIMEOUT / 3):
+        try:
+            job_queue.extend(job_id, worker_id)
+        except Exception as e:
+            print(f"[{worker_id}] Couldn't extend job {job_id}: {e}")
+
+
+def work(host, once=False, slot=None):
+    worker_id = f"{host}:{os.getpid()}" if slot is None else f"{host}:{os.getpid()}:{slot}"
+    handlers = _handlers()
+
+    while True:
+        # A database blip (pool timeout, failover) mustn't end the worker, nothing restarts it
+        try:
+            job = job_queue.claim(worker_id)
+        except Exception as e:
+            print(f"[{worker_id}] Couldn't claim a job: {e}")
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        if job is None:
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        print(f"[{worker_id}] Running job {job['id']} ({job['kind']}), attempt {job['attempts']}")
+
+        if job['attempts'] > job['max_attempts']:
+            # Its claim lapsed on the final attempt (worker died or hung)
+            _fail(job, worker_id, "Visibility timeout on final attempt")
+            continue
+
+        stop = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job['id'], worker_id, stop), daemon=True).start()
+
+        try:
+            handler = handlers[job['kind']]
+            result = handler(job['payload'])
+        except Exception as e:
+            _fail(job, worker_id, e)
+            continue
+        finally:
+            stop.set()
+
+        try:
+            job_queue.complete(job['id'], worker_id, result)
+            print(f"[{worker_id}] Job {job['id']} done")
+        except Exception as e:
+            # Its claim lapses and the job runs again, the handlers are idempotent
+            print(f"[{worker_id}] Couldn't mark job {job['id']} done: {e}")
+            time.sleep(POLL_INTERVAL)
+
+
+def _fail(job, worker_id, error):
+    try:
+        status = job_queue.fail(job['id'], worker_id, job['attempts'], error)
+        print(f"[{worker_id}] Job {job['id']} failed ({status}): {error}")
+    except Exception as e:
+        # Left to its claim lapsing, then it's retried like a crashed worker's job
+        print(f"[{worker_id}] Job {job['id']} failed: {error}, and couldn't record it: {e}")
+        time.sleep(POLL_INTERVAL)
+
+
+def _stats():
+    from twilio_controller import emotion_batcher, llm_gateway, db_pool
+
+    return {
+        '/internal/emotion-batcher-stats': emotion_batcher.stats,
+        '/internal/llm-stats': llm_gateway.stats,
+        '/internal/db-pool-stats': db_pool.pool_stats,
+    }
+
+
+class _StatsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stats = _stats().get(self.path)
+        if stats is None:
+            self.send_error(404)
+            return
+
+        body = json.dumps(stats(), default=str).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_stats_server(port):
+    server = ThreadingHTTPServer(('0.0.0.0', port), _StatsHandler)
+    threading.Thread(target=server.serve_forever, name='stats', daemon=True).start()
+    print(f"Serving worker stats on port {port}")
+
+
+def serve(host, once=False, concurrency=1, stats_port=None):
+    # Several jobs per process overlap their LLM and database waits, and their
+    # sentence classification shares batches (emotion_batcher.py)
+    if stats_port:
+        _start_stats_server(stats_port)
+
+    if concurrency == 1:
+        work(host, once)
+        return
+
+    threads = [threading.Thread(target=work, args=(host, once, slot)) for slot in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-call ingestion worker")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1, help="Jobs run at once in each process")
+    parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+    parser.add_argument('--stats-port', type=int, help="Serve /internal/* stats, process i on this port + i")
+    args = parser.parse_args()
+
+    host = socket.gethostname()
+
+    if args.processes == 1:
+        if not args.once:
+            _start_scheduler()
+        serve(host, args.once, args.concurrency, args.stats_port)
+        return
+
+    # Forked workers share the parent's copy of the emotion model, unless the
+    # batcher classifies in its own processes (see preload)
+    from twilio_controller.stim_emotion_connector import preload
+    preload()
+
+    processes = [
+        Process(target=serve, args=(host, args.once, args.concurrency, args.stats_port and args.stats_port + i))
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    # Started after forking so the workers don't inherit the thread
+    if not args.once:
+        _start_scheduler()
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
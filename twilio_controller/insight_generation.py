@@ -1,12 +1,11 @@
 from load_dotenv import load_dotenv
-from openai import OpenAI
-import psycopg
+from twilio_controller.db_pool import connection
+from twilio_controller.llm_gateway import chat
 from datetime import date
 import os
 
 load_dotenv()
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 today = date.today().isoformat()
 
 SYSTEM_PROMPT = f"""
@@ -27,81 +26,121 @@ Give your answer in a concise format, in 1 paragraph. Speak in first person, ref
 """
 
 
-def find_similar_stims(recognized_objects):
-    query = '''
-    SELECT id FROM "Stimuli"
-    WHERE similarity(name, %s) > 0.4
-    '''
+STIM_MATCH_THRESHOLD = float(os.getenv('STIM_MATCH_THRESHOLD', 0.4))
+STIM_MATCH_TOP_K = int(os.getenv('STIM_MATCH_TOP_K', 3))
+
+# Every object in one round trip. The % operator (with the threshold set for
+# this transaction) is answered from the gin_trgm_ops index on Stimuli.name.
+SIMILAR_STIMS_QUERY = '''
+SELECT o.object, m.id, m.name, m.score
+FROM unnest(%s::text[]) WITH ORDINALITY AS o(object, ord)
+CROSS JOIN LATERAL (
+    -- One row per name, the oldest, so repeat mentions keep linking to the same stimulus
+    SELECT d.id, d.name, d.score
+    FROM (
+        SELECT DISTINCT ON (s.name) s.id, s.name, similarity(s.name, o.object) AS score
+        FROM "Stimuli" s
+        WHERE s.name %% o.object
+        ORDER BY s.name, s.id
+    ) d
+    ORDER BY d.score DESC, d.id
+    LIMIT %s
+) m
+ORDER BY o.ord, m.score DESC, m.id
+'''
+
+def find_similar_stims_ranked(recognized_objects, top_k=STIM_MATCH_TOP_K, threshold=STIM_MATCH_THRESHOLD):
+    """Maps each recognized object to its top_k similar stimuli as (id, name, score), best first."""
+    ranked = {}
+
+    if not recognized_objects:
+        return ranked
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", (str(threshold),))
+            cur.execute(SIMILAR_STIMS_QUERY, (list(recognized_objects), top_k))
+
+            for object, stim_id, name, score in cur.fetchall():
+                ranked.setdefault(object, []).append((stim_id, name, float(score)))
+
+    return ranked
+
+def find_similar_stims_by_object(recognized_objects):
+    """Maps each recognized object to its most similar existing stimulus id, objects with no match are left out."""
+    ranked = find_similar_stims_ranked(recognized_objects, top_k=1)
+
+    return {object: matches[0][0] for object, matches in ranked.items()}
 
+def find_similar_stims(recognized_objects):
     try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        stim_ids= []
-
-        for object in recognized_objects:
-            cur.execute(query, (object,))
-            res = cur.fetchone()
-
-            if res:
-                stim_ids.append(res[0])
-
+        similar = find_similar_stims_by_object(recognized_objects)
 
     except Exception as e:
         print(f"Error connecting or querying db: {e}")
         return e
 
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn'in locals() and conn:
-            conn.close()
-
-    return stim_ids
-
-def grab_previous_insights(stim_ids):
-    query = '''
-    SELECT insight, created_at
-    FROM "Call_Insights"
-    WHERE id IN (SELECT insight_id FROM "Stim_Insight" WHERE stim_id = %s)
-    '''
-
-    try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        insights = []
-
-        for stim_id in stim_ids:
-            cur.execute(query, (stim_id,))
+    return [similar[object] for object in recognized_objects if object in similar]
+
+PREVIOUS_INSIGHTS_PER_STIM = int(os.getenv('PREVIOUS_INSIGHTS_PER_STIM', 5))
+PREVIOUS_INSIGHTS_MAX = int(os.getenv('PREVIOUS_INSIGHTS_MAX', 20))
+PREVIOUS_INSIGHTS_TOKEN_BUDGET = int(os.getenv('PREVIOUS_INSIGHTS_TOKEN_BUDGET', 1500))
+
+# Newest insights for all stimuli at once, at most per_stim for each one. An
+# insight linked to several of the stimuli comes back once.
+PREVIOUS_INSIGHTS_QUERY = '''
+SELECT DISTINCT id, insight, created_at
+FROM (
+    SELECT ci.id, ci.insight, ci.created_at,
+        ROW_NUMBER() OVER (PARTITION BY si.stim_id ORDER BY ci.created_at DESC, ci.id DESC) AS rn
+    FROM "Stim_Insight" si
+    JOIN "Call_Insights" ci ON ci.id = si.insight_id
+    WHERE si.stim_id = ANY(%s)
+    AND (%s::timestamptz IS NULL OR ci.created_at >= %s::timestamptz)
+) ranked
+WHERE rn <= %s
+ORDER BY created_at DESC, id DESC
+LIMIT %s
+'''
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English text
+    return len(text) // 4 + 1
+
+def grab_previous_insights(stim_ids, per_stim=PREVIOUS_INSIGHTS_PER_STIM, max_insights=PREVIOUS_INSIGHTS_MAX,
+                           token_budget=PREVIOUS_INSIGHTS_TOKEN_BUDGET, since=None):
+    """
+    Returns [(date, insight)] for the given stimuli, oldest first, keeping the newest
+    insights that fit in token_budget. since limits it to insights from that date on.
+    Database errors propagate, so the job running the pipeline is retried.
+    """
+    if not stim_ids:
+        return []
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(PREVIOUS_INSIGHTS_QUERY, (list(stim_ids), since, since, per_stim, max_insights))
             rows = cur.fetchall()
 
-            for row in rows:
-                insights.append((row[1].strftime("%Y-%m-%d"), row[0]))
+    insights = []
+    tokens = 0
 
-    except Exception as e:
-        print(f"Error connecting or querying db: {e}")
-        return e
-
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn'in locals() and conn:
-            conn.close()
+    for id, insight, created_at in rows:
+        entry = (created_at.strftime("%Y-%m-%d"), insight)
+        cost = estimate_tokens(entry[0] + entry[1])
+        if tokens + cost > token_budget:
+            break
+        insights.append(entry)
+        tokens += cost
 
+    insights.reverse()
 
     return insights
 
 
 def generate_insights(insights, cleaned_transcript):
-
-    output = openai_client.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=[
+    return chat('insight', [
         {"role": "developer", "content": SYSTEM_PROMPT},
         {"role": "user", "content": f"Transcript: {cleaned_transcript}"},
         {"role": "user", "content": f"Previous insights: {insights}"}
-    ]
-    )
-
-    return output.choices[0].message.content
\ No newline at end of file
+    ])
\ No newline at end of file
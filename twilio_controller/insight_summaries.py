@@ -0,0 +1,249 @@
+from load_dotenv import load_dotenv
+from twilio_controller.db_pool import connection
+from twilio_controller.llm_gateway import chat
+from twilio_controller.insight_generation import grab_previous_insights, estimate_tokens
+from datetime import date, timedelta
+import sys
+import os
+
+load_dotenv()
+
+# Keeps the insight step's context a fixed size however long someone has used
+# the app: insights from the last RECENT_DAYS go in verbatim, older ones as one
+# summary per week, and once older than MONTHLY_AFTER_DAYS as one per month.
+RECENT_DAYS = int(os.getenv('INSIGHT_RECENT_DAYS', 14))
+MONTHLY_AFTER_DAYS = int(os.getenv('INSIGHT_MONTHLY_AFTER_DAYS', 60))
+# Weekly summaries span from the verbatim cutoff back to the monthly one: up to
+# MONTHLY_AFTER_DAYS - RECENT_DAYS days, plus the partial month and week at the ends
+WEEKS_IN_CONTEXT = (MONTHLY_AFTER_DAYS + 31 - RECENT_DAYS) // 7 + 2  # per stimulus
+MONTHS_IN_CONTEXT = int(os.getenv('INSIGHT_MONTHS_IN_CONTEXT', 6))    # per stimulus
+SUMMARY_TOKEN_BUDGET = int(os.getenv('INSIGHT_SUMMARY_TOKEN_BUDGET', 1000))
+# How often ingestion workers queue refresh_all, so insights that age out of the
+# verbatim window are summarized even for stimuli that aren't mentioned again
+SUMMARY_REFRESH_INTERVAL = float(os.getenv('INSIGHT_SUMMARY_REFRESH_INTERVAL', 6 * 60 * 60))
+
+SUMMARY_PROMPT = """
+You will receive dated notes about how a user felt about "{name}" over {period}.
+Summarize them in 2-3 sentences: how the user felt about it, and how that changed
+over the period. Keep concrete details, drop repetition. Speak in first person,
+refer to the user as 'You'.
+"""
+
+PERIOD_INSIGHTS = '''
+SELECT date_trunc(%s, ci.created_at)::date AS period, COUNT(*),
+    array_agg(to_char(ci.created_at, 'YYYY-MM-DD') || ': ' || ci.insight ORDER BY ci.created_at)
+FROM "Stim_Insight" si
+JOIN "Call_Insights" ci ON ci.id = si.insight_id
+WHERE si.stim_id = %s
+AND ci.created_at < %s
+GROUP BY 1
+ORDER BY 1
+'''
+
+STIM_SUMMARIES = '''
+SELECT level, period_start, summary, insight_count
+FROM "Stim_Insight_Summary"
+WHERE stim_id = %s
+'''
+
+UPSERT_SUMMARY = '''
+INSERT INTO "Stim_Insight_Summary" (stim_id, level, period_start, summary, insight_count)
+VALUES (%s, %s, %s, %s, %s)
+ON CONFLICT (stim_id, level, period_start) DO UPDATE SET
+    summary = EXCLUDED.summary,
+    insight_count = EXCLUDED.insight_count,
+    updated_at = NOW()
+'''
+
+DELETE_WEEKS_OF_MONTH = '''
+DELETE FROM "Stim_Insight_Summary"
+WHERE stim_id = %s AND level = 'week'
+AND period_start >= %s AND period_start < (%s::date + INTERVAL '1 month')
+'''
+
+STIM_NAME = 'SELECT name FROM "Stimuli" WHERE id = %s'
+
+# Newest summaries of each level for every stimulus, returned oldest first
+SUMMARY_CONTEXT = '''
+SELECT name, level, period_start, summary
+FROM (
+    SELECT s.name, sis.level, sis.period_start, sis.summary,
+        ROW_NUMBER() OVER (PARTITION BY sis.stim_id, sis.level ORDER BY sis.period_start DESC) AS rn
+    FROM "Stim_Insight_Summary" sis
+    JOIN "Stimuli" s ON s.id = sis.stim_id
+    WHERE sis.stim_id = ANY(%s)
+) ranked
+WHERE (level = 'week' AND rn <= %s) OR (level = 'month' AND rn <= %s)
+ORDER BY period_start DESC
+'''
+
+ALL_SUMMARIZED_STIMS = '''
+SELECT DISTINCT si.stim_id
+FROM "Stim_Insight" si
+JOIN "Call_Insights" ci ON ci.id = si.insight_id
+WHERE ci.created_at < %s
+'''
+
+
+def recent_cutoff(today=None):
+    """Start of the week holding the oldest verbatim day, so weeks are never split."""
+    day = (today or date.today()) - timedelta(days=RECENT_DAYS)
+    return day - timedelta(days=day.weekday())
+
+
+def monthly_cutoff(today=None):
+    return ((today or date.today()) - timedelta(days=MONTHLY_AFTER_DAYS)).replace(day=1)
+
+
+def _summarize(name, period, notes):
+    return chat('insight_summary', [
+        {"role": "developer", "content": SUMMARY_PROMPT.format(name=name, period=period)},
+        {"role": "user", "content": "\n".join(notes)}
+    ])
+
+
+def refresh_stim(stim_id, today=None):
+    """
+    Brings one stimulus' weekly and monthly summaries up to date. Periods whose
+    insight count hasn't changed are left alone, so this is cheap to call often.
+    """
+    week_cutoff = recent_cutoff(today)
+    month_cutoff = monthly_cutoff(today)
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(STIM_NAME, (stim_id,))
+            row = cur.fetchone()
+            if row is None:
+                return {'weeks': 0, 'months': 0}
+            name = row[0]
+
+            cur.execute(STIM_SUMMARIES, (stim_id,))
+            existing = {(level, period): (summary, count) for level, period, summary, count in cur.fetchall()}
+
+            cur.execute(PERIOD_INSIGHTS, ('week', stim_id, week_cutoff))
+            weeks = cur.fetchall()
+            cur.execute(PERIOD_INSIGHTS, ('month', stim_id, month_cutoff))
+            months = {period: count for period, count, _ in cur.fetchall()}
+
+    # Summaries are written one at a time outside any transaction, the LLM calls are slow
+    refreshed = {'weeks': 0, 'months': 0}
+
+    for period, count, notes in weeks:
+        month = period.replace(day=1)
+        if month in months and existing.get(('month', month), (None, None))[1] == months[month]:
+            continue
+        if existing.get(('week', period), (None, None))[1] == count:
+            continue
+
+        summary = _summarize(name, f"the week of {period.isoformat()}", notes)
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(UPSERT_SUMMARY, (stim_id, 'week', period, summary, count))
+            conn.commit()
+        existing[('week', period)] = (summary, count)
+        refreshed['weeks'] += 1
+
+    for month, count in months.items():
+        if existing.get(('month', month), (None, None))[1] == count:
+            continue
+
+        # Compact the month's weekly summaries into one, then drop them
+        week_notes = [
+            f"Week of {period.isoformat()}: {summary}"
+            for (level, period), (summary, _) in sorted(existing.items(), key=lambda item: item[0][1])
+            if level == 'week' and period.replace(day=1) == month
+        ]
+        if not week_notes:
+            continue
+
+        summary = _summarize(name, month.strftime("%B %Y"), week_notes)
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(UPSERT_SUMMARY, (stim_id, 'month', month, summary, count))
+                cur.execute(DELETE_WEEKS_OF_MONTH, (stim_id, month, month))
+            conn.commit()
+        refreshed['months'] += 1
+
+    return refreshed
+
+
+def refresh(stim_ids, today=None):
+    return {str(stim_id): refresh_stim(stim_id, today) for stim_id in dict.fromkeys(stim_ids)}
+
+
+def refresh_all(today=None):
+    """Refreshes every stimulus with insights older than the verbatim window."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ALL_SUMMARIZED_STIMS, (recent_cutoff(today),))
+            stim_ids = [row[0] for row in cur.fetchall()]
+
+    return refresh(stim_ids, today)
+
+
+def summary_context(stim_ids, token_budget=SUMMARY_TOKEN_BUDGET):
+    """Returns [(label, summary)] for the stimuli, oldest first, newest kept within token_budget."""
+    if not stim_ids:
+        return []
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SUMMARY_CONTEXT, (list(stim_ids), WEEKS_IN_CONTEXT, MONTHS_IN_CONTEXT))
+            rows = cur.fetchall()
+
+    entries = []
+    tokens = 0
+
+    for name, level, period, summary in rows:
+        if level == 'week':
+            label = f"{name}, week of {period.isoformat()}"
+        else:
+            label = f"{name}, {period.strftime('%B %Y')}"
+
+        cost = estimate_tokens(label + summary)
+        if tokens + cost > token_budget:
+            break
+        entries.append((label, summary))
+        tokens += cost
+
+    entries.reverse()
+
+    return entries
+
+
+def insight_context(stim_ids, today=None, refresh_first=False):
+    """
+    Previous insights for the insight prompt: compacted summaries followed by the
+    recent insights verbatim. Bounded by the two token budgets, not by history length.
+    With refresh_first, insights that have aged out of the verbatim window are
+    summarized before the context is read, so they aren't dropped from it.
+    """
+    if refresh_first and stim_ids:
+        try:
+            refresh(stim_ids, today)
+        except Exception as e:
+            print(f"Error refreshing insight summaries: {e}")
+
+    recent = grab_previous_insights(stim_ids, since=recent_cutoff(today))
+
+    try:
+        summaries = summary_context(stim_ids)
+    except Exception as e:
+        # Summaries are an optimisation, the recent insights still make a usable prompt
+        print(f"Error loading insight summaries: {e}")
+        summaries = []
+
+    return summaries + recent
+
+
+if __name__ == "__main__":
+    # python -m twilio_controller.insight_summaries refresh [stim_id ...]
+    if len(sys.argv) < 2 or sys.argv[1] != 'refresh':
+        print("Usage: python -m twilio_controller.insight_summaries refresh [stim_id ...]")
+        sys.exit(1)
+
+    if len(sys.argv) > 2:
+        print(refresh([int(stim_id) for stim_id in sys.argv[2:]]))
+    else:
+        print(refresh_all())
@@ -0,0 +1,161 @@
+from load_dotenv import load_dotenv
+from psycopg.types.json import Jsonb
+from twilio_controller.db_pool import connection
+import random
+import os
+
+load_dotenv()
+
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', 300))  # seconds a claim is held before another worker may take it
+JOB_BACKOFF_BASE = float(os.getenv('JOB_BACKOFF_BASE', 10))             # seconds, doubled on every attempt
+JOB_BACKOFF_MAX = float(os.getenv('JOB_BACKOFF_MAX', 3600))
+
+ENQUEUE = '''
+INSERT INTO "Ingestion_Job" (kind, payload, max_attempts)
+VALUES (%s, %s, %s)
+RETURNING id
+'''
+
+# For periodic jobs: skipped while one of the same kind is still waiting or running
+ENQUEUE_UNLESS_PENDING = '''
+INSERT INTO "Ingestion_Job" (kind, payload, max_attempts)
+SELECT %s, %s, %s
+WHERE NOT EXISTS (
+    SELECT 1 FROM "Ingestion_Job" WHERE kind = %s AND status IN ('queued', 'running')
+)
+RETURNING id
+'''
+
+# Takes the oldest runnable job, or one whose worker died and let its claim
+# lapse. SKIP LOCKED lets any number of workers poll without blocking each other.
+CLAIM = '''
+UPDATE "Ingestion_Job"
+SET status = 'running', attempts = attempts + 1, locked_by = %s,
+    locked_until = NOW() + make_interval(secs => %s), updated_at = NOW()
+WHERE id = (
+    SELECT id FROM "Ingestion_Job"
+    WHERE (status = 'queued' AND run_after <= NOW())
+    OR (status = 'running' AND locked_until < NOW())
+    ORDER BY run_after, id
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING id, kind, payload, attempts, max_attempts
+'''
+
+COMPLETE = '''
+UPDATE "Ingestion_Job"
+SET status = 'done', result = %s, locked_until = NULL, last_error = NULL, updated_at = NOW()
+WHERE id = %s AND locked_by = %s
+'''
+
+FAIL = '''
+UPDATE "Ingestion_Job"
+SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+    run_after = NOW() + make_interval(secs => %s),
+    locked_until = NULL, last_error = %s, updated_at = NOW()
+WHERE id = %s AND locked_by = %s
+RETURNING status
+'''
+
+EXTEND = '''
+UPDATE "Ingestion_Job"
+SET locked_until = NOW() + make_interval(secs => %s), updated_at = NOW()
+WHERE id = %s AND locked_by = %s AND status = 'running'
+'''
+
+STATUS = '''
+SELECT id, kind, status, attempts, max_attempts, run_after, last_error, result, created_at, updated_at
+FROM "Ingestion_Job"
+WHERE id = %s
+'''
+
+
+def enqueue(kind, payload, max_attempts=JOB_MAX_ATTEMPTS):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ENQUEUE, (kind, Jsonb(payload), max_attempts))
+            job_id = cur.fetchone()[0]
+        conn.commit()
+
+    return job_id
+
+
+def enqueue_unless_pending(kind, payload, max_attempts=JOB_MAX_ATTEMPTS):
+    """enqueue() unless a job of this kind is already queued or running. Returns the new id or None."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ENQUEUE_UNLESS_PENDING, (kind, Jsonb(payload), max_attempts, kind))
+            row = cur.fetchone()
+        conn.commit()
+
+    return row[0] if row else None
+
+
+def claim(worker_id, visibility_timeout=JOB_VISIBILITY_TIMEOUT):
+    """Returns the claimed job as a dict, or None if nothing is runnable."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CLAIM, (worker_id, visibility_timeout))
+            row = cur.fetchone()
+        conn.commit()
+
+    if not row:
+        return None
+
+    return {'id': row[0], 'kind': row[1], 'payload': row[2], 'attempts': row[3], 'max_attempts': row[4]}
+
+
+def extend(job_id, worker_id, visibility_timeout=JOB_VISIBILITY_TIMEOUT):
+    """Pushes out a long running job's claim so it isn't handed to another worker."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(EXTEND, (visibility_timeout, job_id, worker_id))
+        conn.commit()
+
+
+def complete(job_id, worker_id, result=None):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(COMPLETE, (Jsonb(result), job_id, worker_id))
+        conn.commit()
+
+
+def backoff(attempts):
+    # Exponential with full jitter, capped
+    return random.uniform(0, min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** attempts))
+
+
+def fail(job_id, worker_id, attempts, error):
+    """Requeues the job with backoff, or moves it to 'dead' once it's out of attempts. Returns the new status."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(FAIL, (backoff(attempts), str(error), job_id, worker_id))
+            row = cur.fetchone()
+        conn.commit()
+
+    return row[0] if row else None
+
+
+def get_job(job_id):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(STATUS, (job_id,))
+            row = cur.fetchone()
+
+    if not row:
+        return None
+
+    return {
+        'id': row[0],
+        'kind': row[1],
+        'status': row[2],
+        'attempts': row[3],
+        'max_attempts': row[4],
+        'run_after': row[5].isoformat() if row[5] else None,
+        'last_error': row[6],
+        'result': row[7],
+        'created_at': row[8].isoformat() if row[8] else None,
+        'updated_at': row[9].isoformat() if row[9] else None,
+    }
@@ -0,0 +1,275 @@
+from load_dotenv import load_dotenv
+import threading
+import asyncio
+import sqlite3
+import hashlib
+import json
+import time
+import os
+
+load_dotenv()
+
+# Completions keyed by a hash of everything that determines them (model, system
+# prompt, messages, parameters), so reprocessing a call or re-rendering a digest
+# doesn't pay for the same completion twice. Call sites opt in by name:
+#   LLM_CACHE_SITES=cleaner,objects,insight   ('*' for every site)
+# The default only covers the sites whose output should be the same for the same
+# input (object extraction at temperature 0, transcript cleanup); insights and
+# digests are worded afresh each time unless a site is added here.
+#
+# LLM_CACHE_MODE:
+#   on      read and write the cache (default)
+#   off     always call the model
+#   record  always call the model and write every response
+#   replay  only read the cache, a miss raises CacheMiss, so benchmarks and
+#           tests can run the pipeline offline from a recorded cache file
+# record and replay cover every site whatever LLM_CACHE_SITES says, so a
+# recording holds everything a replay of the same run will look up.
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(os.getcwd(), 'twilio_controller', 'llm_cache.sqlite3'))
+LLM_CACHE_MODE = os.getenv('LLM_CACHE_MODE', 'on')
+LLM_CACHE_SITES = os.getenv('LLM_CACHE_SITES', 'objects,cleaner')
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 30 * 24 * 60 * 60))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+MODES = ('on', 'off', 'record', 'replay')
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+_counters_lock = threading.Lock()
+_counters = {}
+
+
+def _open():
+    global _schema_ready
+
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=5)
+
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        key TEXT PRIMARY KEY,
+                        site TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_access REAL NOT NULL
+                    )
+                """)
+                conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)')
+                conn.commit()
+                _schema_ready = True
+
+    return conn
+
+
+def _count(site, outcome):
+    with _counters_lock:
+        counts = _counters.setdefault(site, {'hits': 0, 'misses': 0, 'stores': 0})
+        counts[outcome] += 1
+
+
+def site_enabled(site):
+    if LLM_CACHE_MODE == 'off':
+        return False
+    if LLM_CACHE_MODE in ('record', 'replay') or LLM_CACHE_SITES.strip() == '*':
+        return True
+    return site in {s.strip() for s in LLM_CACHE_SITES.split(',') if s.strip()}
+
+
+def request_key(request):
+    """Content address of a request: any JSON-able description of everything the response depends on."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def chat_request(model, messages, **params):
+    return {'model': model, 'messages': messages, 'params': params}
+
+
+def lookup(key):
+    """Returns (True, value) for a live entry, else (False, None)."""
+    now = time.time()
+
+    conn = _open()
+    try:
+        row = conn.execute('SELECT value, created_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+
+        # Replays read whatever was recorded, however old
+        if row and (LLM_CACHE_MODE == 'replay' or row[1] >= now - LLM_CACHE_TTL):
+            conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (now, key))
+            conn.commit()
+            return True, json.loads(row[0])
+    finally:
+        conn.close()
+
+    return False, None
+
+
+def _evict(conn, now):
+    conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - LLM_CACHE_TTL,))
+
+    # Least recently used entries go first once the cache is over its size
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+    if total <= LLM_CACHE_MAX_BYTES:
+        return
+
+    excess = total - LLM_CACHE_MAX_BYTES
+    freed = 0
+    stale = []
+    for key, size in conn.execute('SELECT key, size FROM llm_cache ORDER BY last_access'):
+        stale.append((key,))
+        freed += size
+        if freed >= excess:
+            break
+    conn.executemany('DELETE FROM llm_cache WHERE key = ?', stale)
+
+
+def store(key, site, value):
+    now = time.time()
+    text = json.dumps(value)
+
+    conn = _open()
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)',
+            (key, site, text, len(text), now, now)
+        )
+        # A recording keeps everything it captured
+        if LLM_CACHE_MODE != 'record':
+            _evict(conn, now)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def cached(site, request, compute):
+    """
+    Returns compute()'s result for this request, from the cache when the site
+    has opted in and a live entry exists. compute must return something JSON-able.
+    """
+    if not site_enabled(site):
+        return compute()
+
+    key = request_key(request)
+
+    if LLM_CACHE_MODE != 'record':
+        hit, value = lookup(key)
+        if hit:
+            _count(site, 'hits')
+            return value
+
+    _count(site, 'misses')
+    if LLM_CACHE_MODE == 'replay':
+        raise CacheMiss(f"No recorded response for {site} request {key[:12]}")
+
+    value = compute()
+    store(key, site, value)
+    _count(site, 'stores')
+
+    return value
+
+
+async def cached_async(site, request, compute):
+    """cached() for coroutines, the SQLite work runs off the event loop."""
+    if not site_enabled(site):
+        return await compute()
+
+    key = request_key(request)
+
+    if LLM_CACHE_MODE != 'record':
+        hit, value = await asyncio.to_thread(lookup, key)
+        if hit:
+            _count(site, 'hits')
+            return value
+
+    _count(site, 'misses')
+    if LLM_CACHE_MODE == 'replay':
+        raise CacheMiss(f"No recorded response for {site} request {key[:12]}")
+
+    value = await compute()
+    await asyncio.to_thread(store, key, site, value)
+    _count(site, 'stores')
+
+    return value
+
+
+def cached_stream(site, request, open_stream):
+    """
+    Streaming cached(): yields the response in pieces as open_stream() produces them
+    and stores the joined text once it completes. A hit comes back as one piece.
+    """
+    if not site_enabled(site):
+        yield from open_stream()
+        return
+
+    key = request_key(request)
+
+    if LLM_CACHE_MODE != 'record':
+        hit, value = lookup(key)
+        if hit:
+            _count(site, 'hits')
+            yield value
+            return
+
+    _count(site, 'misses')
+    if LLM_CACHE_MODE == 'replay':
+        raise CacheMiss(f"No recorded response for {site} request {key[:12]}")
+
+    parts = []
+    for piece in open_stream():
+        parts.append(piece)
+        yield piece
+
+    store(key, site, "".join(parts))
+    _count(site, 'stores')
+
+
+async def cached_stream_async(site, request, open_stream):
+    """cached_stream() for async generators."""
+    if not site_enabled(site):
+        async for piece in open_stream():
+            yield piece
+        return
+
+    key = request_key(request)
+
+    if LLM_CACHE_MODE != 'record':
+        hit, value = await asyncio.to_thread(lookup, key)
+        if hit:
+            _count(site, 'hits')
+            yield value
+            return
+
+    _count(site, 'misses')
+    if LLM_CACHE_MODE == 'replay':
+        raise CacheMiss(f"No recorded response for {site} request {key[:12]}")
+
+    parts = []
+    async for piece in open_stream():
+        parts.append(piece)
+        yield piece
+
+    await asyncio.to_thread(store, key, site, "".join(parts))
+    _count(site, 'stores')
+
+
+def stats():
+    """Per site hit/miss counters for this process, plus the cache's size on disk."""
+    with _counters_lock:
+        sites = {site: dict(counts) for site, counts in _counters.items()}
+
+    conn = _open()
+    try:
+        entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+    finally:
+        conn.close()
+
+    return {'mode': LLM_CACHE_MODE, 'entries': entries, 'bytes': size, 'sites': sites}
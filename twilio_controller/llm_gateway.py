@@ -0,0 +1,402 @@
+from load_dotenv import load_dotenv
+from twilio_controller.llm_cache import cached, cached_async, cached_stream, cached_stream_async, chat_request
+from collections import deque
+import threading
+import asyncio
+import hashlib
+import random
+import time
+import json
+import os
+
+load_dotenv()
+
+# Every LLM call in the backend goes through here: one shared client per process
+# (so HTTP connections are reused), a timeout per call site, retries with jittered
+# backoff, a process wide cap on calls in flight, latency metrics and the response
+# cache (llm_cache.py).
+#
+# LLM_BACKEND=stub swaps OpenAI for a deterministic local backend, so the whole
+# system can be load tested with no network or API key.
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4o-mini')
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))                   # seconds, per attempt
+LLM_SITE_TIMEOUTS = os.getenv('LLM_SITE_TIMEOUTS', '')              # e.g. "objects=20,transcription=120"
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_RETRY_BASE = float(os.getenv('LLM_RETRY_BASE', 0.5))            # seconds, doubled on every attempt
+LLM_RETRY_MAX = float(os.getenv('LLM_RETRY_MAX', 10))
+LLM_GLOBAL_CONCURRENCY = int(os.getenv('LLM_GLOBAL_CONCURRENCY', 8))
+LLM_STUB_LATENCY = float(os.getenv('LLM_STUB_LATENCY', 0))          # seconds the stub takes to answer
+
+LATENCY_SAMPLES = 1000
+
+
+def _site_timeouts():
+    timeouts = {}
+    for entry in LLM_SITE_TIMEOUTS.split(','):
+        if '=' in entry:
+            site, seconds = entry.split('=', 1)
+            timeouts[site.strip()] = float(seconds)
+    return timeouts
+
+
+SITE_TIMEOUTS = _site_timeouts()
+
+
+def timeout_for(site):
+    return SITE_TIMEOUTS.get(site, LLM_TIMEOUT)
+
+
+def _percentile_ms(ordered, q):
+    if not ordered:
+        return None
+    return round(ordered[max(int(len(ordered) * q) - 1, 0)] * 1000, 1)
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sites = {}
+
+    def _entry(self, site):
+        return self._sites.setdefault(site, {
+            'calls': 0, 'errors': 0, 'retries': 0,
+            'latencies': deque(maxlen=LATENCY_SAMPLES), 'first_token': deque(maxlen=LATENCY_SAMPLES)
+        })
+
+    def record_first_token(self, site, seconds):
+        with self._lock:
+            self._entry(site)['first_token'].append(seconds)
+
+    def record(self, site, seconds, retries, error=None):
+        with self._lock:
+            entry = self._entry(site)
+            entry['calls'] += 1
+            entry['retries'] += retries
+            if error is not None:
+                entry['errors'] += 1
+            entry['latencies'].append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            sites = {}
+            for site, entry in self._sites.items():
+                latencies = sorted(entry['latencies'])
+                first_token = sorted(entry['first_token'])
+                sites[site] = {
+                    'calls': entry['calls'],
+                    'errors': entry['errors'],
+                    'retries': entry['retries'],
+                    'p50_ms': _percentile_ms(latencies, 0.5),
+                    'p95_ms': _percentile_ms(latencies, 0.95),
+                    'max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+                }
+                if first_token:
+                    sites[site]['first_token_p50_ms'] = _percentile_ms(first_token, 0.5)
+                    sites[site]['first_token_p95_ms'] = _percentile_ms(first_token, 0.95)
+            return sites
+
+
+metrics = _Metrics()
+
+_slots = threading.BoundedSemaphore(LLM_GLOBAL_CONCURRENCY)
+_async_slots = None
+
+_client_lock = threading.Lock()
+_client = None
+_async_client = None
+
+
+def _openai_client():
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                # Retries are done here, with jitter and metrics, not inside the SDK
+                _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _client
+
+
+def _async_openai_client():
+    global _async_client
+
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _async_client
+
+
+def _retryable(e):
+    import openai
+
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(e, (TimeoutError, ConnectionError))
+
+
+def backoff(attempt):
+    """Full jitter: uniform in [0, base * 2^attempt], capped."""
+    return random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * 2 ** attempt))
+
+
+# Deterministic stub answers, shaped like what each call site parses
+
+def _stub_seed(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def stub_chat(site, messages):
+    seed = _stub_seed(messages)
+    text = messages[-1]['content'] if messages else ''
+    words = [w.strip('.,!?;:"\'()') for w in text.split()]
+    words = [w for w in words if len(w) > 3]
+
+    if site == 'objects':
+        # Only the journal text, not the extraction instructions around it
+        text = text.rsplit('Text:', 1)[-1].split('Output:', 1)[0]
+        words = [w.strip('.,!?;:"\'()') for w in text.split()]
+        picked = list(dict.fromkeys(w.lower() for w in words if w[:1].isupper()))[:5] or words[:3]
+        return json.dumps(picked)
+    if site == 'advice':
+        return "\n".join(f"- Step {i + 1}: Stub advice {seed[i * 4:i * 4 + 4]}" for i in range(3))
+    if site == 'reminders':
+        return "\n".join(f"- Stub reminder {seed[i * 4:i * 4 + 4]}" for i in range(2))
+    if site == 'cleaner':
+        return text.replace("Transcript: ", "", 1)
+
+    return f"Stub {site} response {seed[:12]}: " + " ".join(words[:30])
+
+
+def stub_transcription(audio_hash):
+    return f"Stub transcript {audio_hash[:12]}. Today I talked to Alex about work and felt hopeful about the weekend."
+
+
+def _call(site, fn):
+    """Runs fn(timeout) under the global cap, retrying transient failures."""
+    start = time.perf_counter()
+    retries = 0
+
+    with _slots:
+        while True:
+            try:
+                result = fn(timeout_for(site))
+                metrics.record(site, time.perf_counter() - start, retries)
+                return result
+            except Exception as e:
+                if retries >= LLM_MAX_RETRIES or not _retryable(e):
+                    metrics.record(site, time.perf_counter() - start, retries, e)
+                    raise
+                time.sleep(backoff(retries))
+                retries += 1
+
+
+async def _call_async(site, fn):
+    global _async_slots
+
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(LLM_GLOBAL_CONCURRENCY)
+
+    start = time.perf_counter()
+    retries = 0
+
+    async with _async_slots:
+        while True:
+            try:
+                result = await fn(timeout_for(site))
+                metrics.record(site, time.perf_counter() - start, retries)
+                return result
+            except Exception as e:
+                if retries >= LLM_MAX_RETRIES or not _retryable(e):
+                    metrics.record(site, time.perf_counter() - start, retries, e)
+                    raise
+                await asyncio.sleep(backoff(retries))
+                retries += 1
+
+
+def stub_pieces(text):
+    words = text.split(' ')
+    return [word if i == len(words) - 1 else word + ' ' for i, word in enumerate(words)]
+
+
+def _open_with_retries(site, open_stream, start):
+    retries = 0
+    while True:
+        try:
+            return open_stream(timeout_for(site)), retries
+        except Exception as e:
+            if retries >= LLM_MAX_RETRIES or not _retryable(e):
+                metrics.record(site, time.perf_counter() - start, retries, e)
+                raise
+            time.sleep(backoff(retries))
+            retries += 1
+
+
+def _stream(site, open_stream):
+    """
+    Yields from the stream open_stream(timeout) returns, under the global cap.
+    Only opening the stream is retried, once text has been sent it can't be taken back.
+    """
+    start = time.perf_counter()
+
+    with _slots:
+        stream, retries = _open_with_retries(site, open_stream, start)
+        first = True
+        try:
+            for piece in stream:
+                if first:
+                    metrics.record_first_token(site, time.perf_counter() - start)
+                    first = False
+                yield piece
+        except Exception as e:
+            metrics.record(site, time.perf_counter() - start, retries, e)
+            raise
+
+    metrics.record(site, time.perf_counter() - start, retries)
+
+
+async def _stream_async(site, open_stream):
+    global _async_slots
+
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(LLM_GLOBAL_CONCURRENCY)
+
+    start = time.perf_counter()
+    retries = 0
+
+    async with _async_slots:
+        while True:
+            try:
+                stream = await open_stream(timeout_for(site))
+                break
+            except Exception as e:
+                if retries >= LLM_MAX_RETRIES or not _retryable(e):
+                    metrics.record(site, time.perf_counter() - start, retries, e)
+                    raise
+                await asyncio.sleep(backoff(retries))
+                retries += 1
+
+        first = True
+        try:
+            async for piece in stream:
+                if first:
+                    metrics.record_first_token(site, time.perf_counter() - start)
+                    first = False
+                yield piece
+        except Exception as e:
+            metrics.record(site, time.perf_counter() - start, retries, e)
+            raise
+
+    metrics.record(site, time.perf_counter() - start, retries)
+
+
+def _cache_request(request):
+    # Stub answers mustn't be served later as real completions
+    if LLM_BACKEND == 'stub':
+        request = dict(request, backend='stub')
+    return request
+
+
+def chat(site, messages, model=LLM_MODEL, **params):
+    """Returns the completion text for messages. site names the caller for timeouts, caching and metrics."""
+
+    def create(timeout):
+        if LLM_BACKEND == 'stub':
+            time.sleep(LLM_STUB_LATENCY)
+            return stub_chat(site, messages)
+
+        output = _openai_client().chat.completions.create(model=model, messages=messages, timeout=timeout, **params)
+        return output.choices[0].message.content
+
+    return cached(site, _cache_request(chat_request(model, messages, **params)), lambda: _call(site, create))
+
+
+async def chat_async(site, messages, model=LLM_MODEL, **params):
+    """chat() for the async app, same cache keys and metrics."""
+
+    async def create(timeout):
+        if LLM_BACKEND == 'stub':
+            await asyncio.sleep(LLM_STUB_LATENCY)
+            return stub_chat(site, messages)
+
+        output = await _async_openai_client().chat.completions.create(model=model, messages=messages, timeout=timeout, **params)
+        return output.choices[0].message.content
+
+    async def compute():
+        return await _call_async(site, create)
+
+    return await cached_async(site, _cache_request(chat_request(model, messages, **params)), compute)
+
+
+def chat_stream(site, messages, model=LLM_MODEL, **params):
+    """Yields the completion text in pieces as the model produces them. Shares chat()'s cache entries."""
+
+    def open_stream(timeout):
+        if LLM_BACKEND == 'stub':
+            pieces = stub_pieces(stub_chat(site, messages))
+
+            def stub_stream():
+                for piece in pieces:
+                    time.sleep(LLM_STUB_LATENCY / len(pieces))
+                    yield piece
+            return stub_stream()
+
+        stream = _openai_client().chat.completions.create(
+            model=model, messages=messages, timeout=timeout, stream=True, **params
+        )
+        return (chunk.choices[0].delta.content for chunk in stream if chunk.choices and chunk.choices[0].delta.content)
+
+    request = _cache_request(chat_request(model, messages, **params))
+    return cached_stream(site, request, lambda: _stream(site, open_stream))
+
+
+def chat_stream_async(site, messages, model=LLM_MODEL, **params):
+    """chat_stream() for the async app, an async generator of text pieces."""
+
+    async def open_stream(timeout):
+        if LLM_BACKEND == 'stub':
+            pieces = stub_pieces(stub_chat(site, messages))
+
+            async def stub_stream():
+                for piece in pieces:
+                    await asyncio.sleep(LLM_STUB_LATENCY / len(pieces))
+                    yield piece
+            return stub_stream()
+
+        stream = await _async_openai_client().chat.completions.create(
+            model=model, messages=messages, timeout=timeout, stream=True, **params
+        )
+
+        async def deltas():
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        return deltas()
+
+    request = _cache_request(chat_request(model, messages, **params))
+    return cached_stream_async(site, request, lambda: _stream_async(site, open_stream))
+
+
+def transcribe(path, model="whisper-1", site='transcription'):
+    """Transcribes the audio file at path, cached on a hash of the audio."""
+    with open(path, "rb") as f:
+        audio_hash = hashlib.sha256(f.read()).hexdigest()
+
+    def create(timeout):
+        if LLM_BACKEND == 'stub':
+            time.sleep(LLM_STUB_LATENCY)
+            return stub_transcription(audio_hash)
+
+        with open(path, "rb") as audio_file:
+            return _openai_client().audio.transcriptions.create(model=model, file=audio_file, timeout=timeout).text
+
+    return cached(site, _cache_request({'model': model, 'audio': audio_hash}), lambda: _call(site, create))
+
+
+def stats():
+    return {
+        'backend': LLM_BACKEND,
+        'max_concurrent': LLM_GLOBAL_CONCURRENCY,
+        'sites': metrics.snapshot(),
+    }
@@ -0,0 +1,339 @@
+from load_dotenv import load_dotenv
+from twilio_controller.db_pool import connection
+from twilio_controller.object_matcher import ObjectMatcher, normalize
+from twilio_controller.object_recognition import recognize_objects
+from typing import NamedTuple
+import threading
+import statistics
+import time
+import sys
+import os
+import re
+
+load_dotenv()
+
+# Pluggable object extraction for the ingestion pipeline. The local engine answers
+# in milliseconds from a lightweight tagger plus the names of stimuli the user has
+# already talked about, and in hybrid mode the LLM (object_recognition.recognize_objects)
+# is only asked when the local answer looks unreliable.
+#   OBJECT_EXTRACTOR=llm      always call the LLM, as before (default)
+#   OBJECT_EXTRACTOR=hybrid   local first, LLM below OBJECT_LOCAL_MIN_CONFIDENCE
+#   OBJECT_EXTRACTOR=local    never call the LLM
+# Stays on llm until the local engine has been compared against it on real transcripts:
+#   python -m twilio_controller.object_extraction bench [transcripts.txt]
+OBJECT_EXTRACTOR = os.getenv('OBJECT_EXTRACTOR', 'llm')
+OBJECT_LOCAL_MIN_CONFIDENCE = float(os.getenv('OBJECT_LOCAL_MIN_CONFIDENCE', 0.6))
+STIM_VOCABULARY_TTL = float(os.getenv('STIM_VOCABULARY_TTL', 300))
+STIM_VOCABULARY_SIZE = int(os.getenv('STIM_VOCABULARY_SIZE', 5000))
+
+# Only the calling user's own stimuli, other users' names mustn't leak into their extraction
+STIM_VOCABULARY = '''
+SELECT s.name
+FROM "Stimuli" s
+JOIN "User_Call" uc ON uc.id = s.user_call_id
+WHERE uc.user_id = %s
+AND s.name IS NOT NULL AND s.name <> ''
+GROUP BY s.name
+ORDER BY COUNT(*) DESC
+LIMIT %s
+'''
+
+RECENT_TRANSCRIPTS = '''
+SELECT cleaned_text, user_id
+FROM "User_Call"
+WHERE cleaned_text IS NOT NULL
+ORDER BY created_at DESC
+LIMIT %s
+'''
+
+# Words at the edges of a capitalized run or "my" phrase that aren't things themselves
+STOP_WORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have he her hers him his how i i'm
+if in into is it its just me my myself no not now of on or our ours out really she so some than that the their
+them then there these they this those to today tomorrow tonight too up us very was we were what when where
+which while who why will with would yesterday you your right also still again back going getting feeling feel
+felt got get gonna want wanted think thought know bit lot little much many more most other another own same
+monday tuesday wednesday thursday friday saturday sunday morning evening night afternoon day week
+hi hello hey okay ok yeah yes um uh well oh anyway
+i've i'll i'd you're you've you'll you'd he's he'll he'd she's she'll she'd it's it'll we're we've we'll we'd
+they're they've they'll they'd that's there's here's what's let's don't didn't doesn't can't won't isn't wasn't
+""".split())
+
+# Where a possessive phrase ends: "my manager yelled" -> "manager", "my sister about" -> "sister"
+PHRASE_BREAKS = frozenset("""
+about above after against along among around at before behind below beside between beyond during except from
+in inside into like near off on onto over past since through toward towards under until upon with within without
+is was are were be been has had have does did do says said tells told asks asked makes made goes went comes came
+gets got keeps kept wants wanted needs needed loves loved hates hated seems seemed looks looked calls called
+""".split())
+
+SENTENCE = re.compile(r'(?<=[.!?])\s+')
+FIRST_WORD = re.compile(r'\w')
+CAPITALIZED_RUN = re.compile(r"\b[A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*")
+POSSESSIVE_PHRASE = re.compile(r"\b(?:my|our|his|her|their)\s+([a-z][\w-]*)(?:\s+([a-z][\w-]*))?", re.IGNORECASE)
+
+SPACY_ENTITIES = {'PERSON', 'ORG', 'GPE', 'LOC', 'EVENT', 'FAC', 'PRODUCT', 'WORK_OF_ART', 'NORP'}
+
+# How likely a candidate from each source is a real stimulus. Confidence is the
+# mean over what was extracted (precision) times the share of sentences that
+# mention any of it (coverage), so a single known name in a long call that the
+# tagger got nothing else out of doesn't count as a confident answer.
+EVIDENCE = {
+    'vocabulary': 1.0,   # a stimulus name the user has used before
+    'entity': 0.9,       # spaCy named entity
+    'proper': 0.8,       # proper noun: tagged PROPN, or capitalized mid-sentence
+    'possessive': 0.7,   # "my sister", "our trip"
+    'noun_phrase': 0.4,  # any other noun chunk
+}
+
+
+class Extraction(NamedTuple):
+    objects: list
+    confidence: float
+    engine: str
+
+
+def _spacy():
+    # Optional: a better tagger when spaCy and its small English model are installed
+    try:
+        import spacy
+        return spacy.load('en_core_web_sm', disable=['lemmatizer'])
+    except Exception:
+        return None
+
+
+def _stop_word(word):
+    return word.lower().replace('\u2019', "'") in STOP_WORDS
+
+
+def _trim(words):
+    # Stop words only at the edges, so "Lord Of The Rings" keeps its middle
+    while words and _stop_word(words[0]):
+        words = words[1:]
+    while words and _stop_word(words[-1]):
+        words = words[:-1]
+    return " ".join(words)
+
+
+def _head(first, second):
+    # A second word only when it reads like the noun of "my best friend", not a verb or preposition after it
+    if not second or second.lower() in PHRASE_BREAKS or second.lower().endswith(('ed', 'ing')):
+        return [first]
+    return [first, second]
+
+
+class LocalExtractor:
+    """Noun phrases and entities from a lightweight tagger, plus the user's known stimulus names."""
+
+    name = 'local'
+
+    def __init__(self, vocabulary=None):
+        self._fixed_vocabulary = ObjectMatcher(vocabulary) if vocabulary is not None else None
+        self._vocabularies = {}  # user_id -> (matcher, loaded_at)
+        self._lock = threading.Lock()
+        self._nlp = _spacy()
+
+    def _vocabulary_matcher(self, user_id):
+        if self._fixed_vocabulary is not None:
+            return self._fixed_vocabulary
+        if user_id is None:
+            return ObjectMatcher([])
+
+        cached = self._vocabularies.get(user_id)
+        if cached is None or time.monotonic() - cached[1] > STIM_VOCABULARY_TTL:
+            with self._lock:
+                cached = self._vocabularies.get(user_id)
+                if cached is None or time.monotonic() - cached[1] > STIM_VOCABULARY_TTL:
+                    try:
+                        with connection() as conn:
+                            with conn.cursor() as cur:
+                                cur.execute(STIM_VOCABULARY, (user_id, STIM_VOCABULARY_SIZE))
+                                names = [row[0] for row in cur.fetchall()]
+                        matcher = ObjectMatcher(names)
+                    except Exception as e:
+                        # Tagger only until the database is back
+                        print(f"Error loading stimulus vocabulary: {e}")
+                        matcher = cached[0] if cached else ObjectMatcher([])
+                    cached = (matcher, time.monotonic())
+                    self._vocabularies[user_id] = cached
+        return cached[0]
+
+    def _tagged(self, text, sentences):
+        """Yields (phrase, source) candidates."""
+        if self._nlp is not None:
+            doc = self._nlp(text)
+            for ent in doc.ents:
+                if ent.label_ in SPACY_ENTITIES:
+                    yield ent.text, 'entity'
+            for chunk in doc.noun_chunks:
+                tokens = [t for t in chunk if t.pos_ not in ('DET', 'PRON')]
+                phrase = _trim([t.text for t in tokens])
+                if phrase:
+                    yield phrase, 'proper' if all(t.pos_ == 'PROPN' for t in tokens) else 'noun_phrase'
+            return
+
+        for sentence in sentences:
+            first = FIRST_WORD.search(sentence)
+            for match in CAPITALIZED_RUN.finditer(sentence):
+                words = match.group().split()
+                # Every sentence starts with a capital, so that one says nothing
+                if first and match.start() == first.start():
+                    words = words[1:]
+                phrase = _trim(words)
+                if phrase:
+                    yield phrase, 'proper'
+
+        for first, second in POSSESSIVE_PHRASE.findall(text):
+            # "my best friend" -> "best friend", "my friends tonight" -> "friends"
+            phrase = _trim(_head(first, second))
+            if phrase:
+                yield phrase, 'possessive'
+
+    def extract(self, text, user_id=None):
+        sentences = [s for s in SENTENCE.split(text) if s.strip()]
+        if not sentences:
+            return Extraction([], 0.0, self.name)
+
+        # Known stimulus spellings win, so the calls link to the same stimuli
+        objects = {}  # normalized -> (spelling, evidence)
+        for name in self._vocabulary_matcher(user_id).mentions(sentences):
+            objects[tuple(normalize(name))] = (name, EVIDENCE['vocabulary'])
+        for phrase, source in self._tagged(text, sentences):
+            key = tuple(normalize(phrase))
+            if not key:
+                continue
+            spelling, evidence = objects.get(key, (phrase, 0.0))
+            objects[key] = (spelling, max(evidence, EVIDENCE[source]))
+
+        if not objects:
+            return Extraction([], 0.0, self.name)
+
+        precision = sum(evidence for _, evidence in objects.values()) / len(objects)
+        mentioned = ObjectMatcher([spelling for spelling, _ in objects.values()]).mentions(sentences)
+        coverage = len(set().union(*mentioned.values())) / len(sentences)
+        confidence = precision * coverage
+        return Extraction([spelling for spelling, _ in objects.values()], confidence, self.name)
+
+
+class LLMExtractor:
+    name = 'llm'
+
+    def extract(self, text, user_id=None):
+        return Extraction([obj for obj in recognize_objects(text) if obj], 1.0, self.name)
+
+
+class HybridExtractor:
+    """The local engine, falling back to the LLM when its confidence is below min_confidence."""
+
+    name = 'hybrid'
+
+    def __init__(self, local=None, llm=None, min_confidence=OBJECT_LOCAL_MIN_CONFIDENCE):
+        self.local = local or LocalExtractor()
+        self.llm = llm or LLMExtractor()
+        self.min_confidence = min_confidence
+        self.counts = {'local': 0, 'llm': 0}
+        self._counts_lock = threading.Lock()
+
+    def _count(self, engine):
+        # extract() runs on every pipeline thread at once
+        with self._counts_lock:
+            self.counts[engine] += 1
+
+    def extract(self, text, user_id=None):
+        result = self.local.extract(text, user_id)
+        if result.confidence >= self.min_confidence:
+            self._count('local')
+            return result
+
+        self._count('llm')
+        return self.llm.extract(text, user_id)
+
+
+ENGINES = {'local': LocalExtractor, 'llm': LLMExtractor, 'hybrid': HybridExtractor}
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_extractor():
+    global _extractor
+
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = ENGINES[OBJECT_EXTRACTOR]()
+    return _extractor
+
+
+def extract_objects(text, user_id=None):
+    """Recognized objects in text, from whichever engine OBJECT_EXTRACTOR selects."""
+    return get_extractor().extract(text, user_id).objects
+
+
+def _overlap(local, llm):
+    local = {tuple(normalize(obj)) for obj in local} - {()}
+    llm = {tuple(normalize(obj)) for obj in llm} - {()}
+    union = local | llm
+    return (len(local & llm) / len(union) if union else 1.0,
+            len(local & llm) / len(llm) if llm else 1.0,
+            len(local & llm) / len(local) if local else 1.0)
+
+
+def bench(transcripts):
+    """
+    Latency of each engine, and how the local answer compares with the LLM's, for
+    (text, user_id) pairs. Precision is reported separately for the transcripts the
+    local engine was confident on, since those are the ones hybrid mode keeps.
+    """
+    local, llm = LocalExtractor(), LLMExtractor()
+    local.extract("Warm up.")
+
+    timings = {'local': [], 'llm': []}
+    jaccards, recalls, precisions, confident_precisions = [], [], [], []
+
+    for text, user_id in transcripts:
+        start = time.perf_counter()
+        local_result = local.extract(text, user_id)
+        timings['local'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        llm_result = llm.extract(text, user_id)
+        timings['llm'].append(time.perf_counter() - start)
+
+        jaccard, recall, precision = _overlap(local_result.objects, llm_result.objects)
+        jaccards.append(jaccard)
+        recalls.append(recall)
+        precisions.append(precision)
+        if local_result.confidence >= OBJECT_LOCAL_MIN_CONFIDENCE:
+            confident_precisions.append(precision)
+
+    for engine, samples in timings.items():
+        samples.sort()
+        print(f"{engine}: p50 {statistics.median(samples) * 1000:.1f}ms  "
+              f"p95 {samples[max(int(len(samples) * 0.95) - 1, 0)] * 1000:.1f}ms")
+    print(f"overlap with llm: mean jaccard {statistics.mean(jaccards):.2f}, "
+          f"mean recall {statistics.mean(recalls):.2f}, mean precision {statistics.mean(precisions):.2f}")
+    print(f"local confident enough on {len(confident_precisions)}/{len(transcripts)} transcripts"
+          + (f", mean precision there {statistics.mean(confident_precisions):.2f}" if confident_precisions else ""))
+
+
+if __name__ == "__main__":
+    # python -m twilio_controller.object_extraction bench [file with one transcript per line]
+    if len(sys.argv) < 2 or sys.argv[1] != 'bench':
+        print("Usage: python -m twilio_controller.object_extraction bench [transcripts.txt]")
+        sys.exit(1)
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            texts = [(line.strip(), None) for line in f if line.strip()]
+    else:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(RECENT_TRANSCRIPTS, (50,))
+                texts = [(row[0], row[1]) for row in cur.fetchall()]
+
+    if not texts:
+        print("No transcripts to benchmark")
+        sys.exit(1)
+
+    bench(texts)
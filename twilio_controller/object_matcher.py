@@ -0,0 +1,86 @@
+import unicodedata
+import re
+
+# Finds every mention of every recognized object in one pass over a transcript's
+# tokens. Objects and text are normalized the same way (case, accents,
+# punctuation, regular plurals) and matched on whole tokens, so "Ann" doesn't
+# match inside "Annual" and "my friends" still mentions "Friend". Objects are
+# stored as a trie of token sequences; each token advances the partial matches
+# in flight, so the cost is linear in transcript length (times the longest
+# object, in tokens).
+
+TOKEN = re.compile(r"[^\W_]+")
+
+# Words ending in s that aren't plurals of anything, beyond the -ss/-us/-is endings
+NOT_PLURAL = frozenset("""
+news series species lens gas means physics politics mathematics economics athletics diabetes measles thanks
+""".split())
+
+
+def _fold(token):
+    # Regular plural folding, applied to both sides so singular and plural meet
+    # in the middle: "story"/"stories" -> "storie", "box"/"boxes" -> "box"
+    if len(token) <= 3 or token in NOT_PLURAL:
+        return token
+    if token.endswith('ies'):
+        return token[:-1]
+    if token.endswith('y') and token[-2] not in 'aeiou':
+        return token[:-1] + 'ie'
+    if token.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+        return token[:-2]
+    if token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [_fold(token) for token in TOKEN.findall(text.lower())]
+
+
+class ObjectMatcher:
+    def __init__(self, objects):
+        self.objects = list(objects)
+        self.root = {}
+        self.max_length = 0
+
+        # Node: {token: (children, objects ending here)}
+        for index, obj in enumerate(self.objects):
+            tokens = normalize(obj)
+            if not tokens:
+                continue
+
+            node, ends = self.root, None
+            for token in tokens:
+                node, ends = node.setdefault(token, ({}, []))
+            ends.append(index)
+            self.max_length = max(self.max_length, len(tokens))
+
+    def scan(self, tokens):
+        """Yields the index of each object occurrence in tokens."""
+        partial = []
+        for token in tokens:
+            advanced = []
+            for node in partial + [self.root]:
+                entry = node.get(token)
+                if entry is None:
+                    continue
+                children, ends = entry
+                yield from ends
+                if children:
+                    advanced.append(children)
+            partial = advanced
+
+    def mentions(self, sentences):
+        """Returns {object: {sentence index: occurrences}} for every object mentioned at least once."""
+        found = {}
+        for position, sentence in enumerate(sentences):
+            for index in self.scan(normalize(sentence)):
+                counts = found.setdefault(self.objects[index], {})
+                counts[position] = counts.get(position, 0) + 1
+        return found
+
+
+def find_mentions(objects, sentences):
+    return ObjectMatcher(objects).mentions(sentences)
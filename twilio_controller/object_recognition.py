@@ -1,18 +1,8 @@
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from dotenv import load_dotenv
+from twilio_controller.llm_gateway import chat
 import json
 import ast
 
-load_dotenv()
-
-def recognize_objects(text):
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
-    extraction_prompt = PromptTemplate(
-        input_variables=["text"],
-        template="""
+EXTRACTION_PROMPT = """
     You are an information extraction agent.
     From the input text, identify and return a list of key objects, such as:
     - People
@@ -24,18 +14,28 @@ def recognize_objects(text):
     Text: {text}
     Output:
     """
-    )
 
-    object_extractor = LLMChain(llm=llm, prompt=extraction_prompt)
-    result = object_extractor.run(text=text)
-    result = result[1:-1]
-    result = result.split(',')
+def parse_objects(result):
+    """The list in the model's reply, read as JSON or a Python literal so names with commas or quotes survive."""
+    start, end = result.find('['), result.rfind(']')
+    if start != -1 and end > start:
+        literal = result[start:end + 1]
+        for parse in (json.loads, ast.literal_eval):
+            try:
+                objects = parse(literal)
+            except (ValueError, SyntaxError, TypeError):
+                continue
+            if isinstance(objects, list):
+                return [str(obj).strip() for obj in objects if str(obj).strip()]
+
+    # Not a well formed list, split it the old way
+    result = result.strip()[1:-1].split(',')
+    return [obj.strip().strip('"\'') for obj in result if obj.strip().strip('"\'')]
 
-    for i in range(len(result)):
-        result[i] = result[i].strip().replace('"', '')
-
-
-    return result
+def recognize_objects(text):
+    # Same prompt the LLMChain used to send, now through the shared gateway
+    result = chat('objects', [{"role": "user", "content": EXTRACTION_PROMPT.format(text=text)}], temperature=0)
+    return parse_objects(result)
 
 # if __name__ == "__main__":
 #     print(recognize_objects("Hi, I just woke up. I'm talking to my best friend right now, and I'm really sad that she's so far away from me. I wish she were right next to me, but I am also looking forward to today because I'm going out with my other friends in the evening."))
@@ -0,0 +1,104 @@
+from load_dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import NamedTuple
+import time
+import os
+
+load_dotenv()
+
+# Shared by every pipeline run in the process, stages are mostly waiting on
+# OpenAI, Twilio or Postgres so threads are enough
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', 8))
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
+
+
+class Stage(NamedTuple):
+    name: str
+    fn: object
+    deps: tuple
+
+
+class StageError(Exception):
+    """A stage raised, the original exception is chained as __cause__."""
+
+    def __init__(self, stage, error, timings):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.timings = timings
+
+
+class Pipeline:
+    """
+    A small DAG runner. Each stage is called with the results of the stages (or
+    inputs) it depends on as keyword arguments, and starts as soon as they are
+    all available, so independent stages overlap.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor or _executor
+        self.stages = {}
+
+    def add(self, name, fn, deps=()):
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined")
+        self.stages[name] = Stage(name, fn, tuple(deps))
+        return self
+
+    def _check(self, inputs):
+        known = set(inputs) | set(self.stages)
+        for stage in self.stages.values():
+            missing = [dep for dep in stage.deps if dep not in known]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown {missing}")
+
+        # Kahn's algorithm, anything left over is on a cycle
+        remaining = {name: set(stage.deps) - set(inputs) for name, stage in self.stages.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Stages {sorted(remaining)} form a cycle")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def run(self, **inputs):
+        """Returns (results, timings). timings maps stage name to start/end offsets and duration in seconds."""
+        self._check(inputs)
+
+        results = dict(inputs)
+        timings = {}
+        pending = dict(self.stages)
+        running = {}
+        started = time.perf_counter()
+
+        def call(stage):
+            start = time.perf_counter()
+            try:
+                return stage.fn(**{dep: results[dep] for dep in stage.deps})
+            finally:
+                end = time.perf_counter()
+                timings[stage.name] = {
+                    'start': round(start - started, 4),
+                    'end': round(end - started, 4),
+                    'duration': round(end - start, 4),
+                }
+
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.deps):
+                    running[self.executor.submit(call, stage)] = name
+                    del pending[name]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    # Let stages already running finish, but don't start any more
+                    wait(running)
+                    raise StageError(name, e, timings) from e
+
+        timings['total'] = round(time.perf_counter() - started, 4)
+        return results, timings
@@ -1,13 +1,12 @@
 from load_dotenv import load_dotenv
-from openai import OpenAI
-import psycopg
+from twilio_controller.weekly_context import weekly_snapshot
+from twilio_controller.weekly_prompt import build_prompt, render_with_date, messages_for
+from twilio_controller.single_flight import llm_flight
+from twilio_controller.llm_gateway import chat
 from datetime import date
-import os
-import psycopg
 
 load_dotenv()
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 today = date.today().isoformat()
 
 SYSTEM_PROMPT = f"""
@@ -33,68 +32,16 @@ DO NOT MENTION DATES IN THE OUTPUT. HIGHLIGHT ACTIVITES TO LOOK FORWARD TO. DO N
 Today is: {today}
 """
 
-def get_this_week_calls():
-    query = """
-    SELECT uc.cleaned_text, uc.created_at
-    FROM "User_Call" uc
-    WHERE uc.created_at >= NOW() - INTERVAL '7 days'
-    ORDER BY uc.created_at DESC
-    """
+def text_for_llm(user_id=None, snapshot=None):
+    # Summaries or truncated transcripts where the week's calls don't all fit in full
+    snapshot = snapshot or weekly_snapshot(user_id)
+    return build_prompt(snapshot.unique_calls(), render_with_date)
 
-    calls = {}
 
-    try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
+def _complete(prompt):
+    return chat('reminders', messages_for(SYSTEM_PROMPT, prompt))
 
-        values = []
-
-        cur.execute(query)
-        result = cur.fetchall()
-
-        for i in result:
-            values.append((i[1], i[0]))
-
-    except Exception as e:
-        print(f"Error connecting or querying db: {e}")
-        return e
-
-    finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn'in locals() and conn:
-            conn.close()
-
-
-    if not values:
-        return []
-
-    for i in range(len(values)):
-        calls[i + 1] = {'recorded_date': values[i][0], 'transcript': values[i][1]}
-
-    return calls
-
-def text_for_llm():
-    calls = get_this_week_calls()
-
-    final_string = ""
-
-    for index, call in enumerate(calls.items()):
-        final_string += f"Call {index + 1}: \n"
-        final_string += f"Date Recorded: {call[1].get('recorded_date')} \n"
-        final_string += f"Call Transcript: {call[1].get('transcript')} \n"
-        final_string += "\n"
-
-    return final_string
-
-
-def generate_reminders():
-    output = openai_client.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=[
-        {"role": "developer", "content": SYSTEM_PROMPT},
-        {"role": "user" , "content": text_for_llm()}
-    ]
-    )
-
-    return output.choices[0].message.content
\ No newline at end of file
+def generate_reminders(user_id=None):
+    # Identical concurrent prompts share one completion
+    prompt = text_for_llm(user_id)
+    return llm_flight.do(('reminders', prompt), _complete, prompt)
\ No newline at end of file
@@ -0,0 +1,353 @@
+from load_dotenv import load_dotenv
+import threading
+import asyncio
+import os
+
+load_dotenv()
+
+LLM_MAX_CONCURRENT = int(os.getenv('LLM_MAX_CONCURRENT', 4))     # completions running at once
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 16))               # completions allowed to wait for a slot
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 30))     # seconds to wait for a slot
+
+
+class Overloaded(Exception):
+    """Raised when the wait queue is full or a slot didn't free up in time."""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Stream:
+    """Pieces a leader has streamed so far, which followers replay from the start."""
+
+    def __init__(self, changed):
+        self.pieces = []
+        self.finished = False
+        self.error = None
+        self.changed = changed
+
+
+def _abandoned():
+    return RuntimeError("The shared stream was closed before it finished")
+
+
+class _LeaderStream:
+    """The leader's side of SingleFlight.stream, frees its slot once exhausted or closed, started or not."""
+
+    def __init__(self, flight, key, call, open_stream):
+        self._flight = flight
+        self._key = key
+        self._call = call
+        self._open_stream = open_stream
+        self._pieces = None
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+
+        try:
+            if self._pieces is None:
+                self._pieces = iter(self._open_stream())
+            piece = next(self._pieces)
+        except StopIteration:
+            self._end(None)
+            raise
+        except Exception as e:
+            self._end(e)
+            raise
+
+        with self._call.changed:
+            self._call.pieces.append(piece)
+            self._call.changed.notify_all()
+        return piece
+
+    def close(self):
+        if self._pieces is not None and hasattr(self._pieces, 'close'):
+            self._pieces.close()
+        self._end(_abandoned())
+
+    def _end(self, error):
+        if self._closed:
+            return
+        self._closed = True
+        self._flight._slots.release()
+        self._flight._end_stream(self._key, self._call, error)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one computation and caps how
+    many distinct computations run (and wait) at once.
+    """
+
+    def __init__(self, max_concurrent=LLM_MAX_CONCURRENT, max_queue=LLM_MAX_QUEUE, queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._streams = {}
+        self._waiting = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            self._admit()
+            try:
+                call.result = fn(*args, **kwargs)
+            finally:
+                self._slots.release()
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key, fn, *args, **kwargs):
+        """
+        do() for streamed completions: fn returns an iterator of pieces, and callers
+        with the same key share the leader's stream, each getting it from the start.
+        Admission happens here, so Overloaded is raised before anything is sent; the
+        leader's iterator holds its slot until it's exhausted or closed.
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            leader = call is None
+            if leader:
+                call = _Stream(threading.Condition())
+                self._streams[key] = call
+
+        if not leader:
+            return self._follow(call)
+
+        try:
+            self._admit()
+        except Exception as e:
+            self._end_stream(key, call, e)
+            raise
+
+        return _LeaderStream(self, key, call, lambda: fn(*args, **kwargs))
+
+    def _end_stream(self, key, call, error):
+        with self._lock:
+            if self._streams.get(key) is call:
+                del self._streams[key]
+        with call.changed:
+            call.error = error
+            call.finished = True
+            call.changed.notify_all()
+
+    def _follow(self, call):
+        seen = 0
+        while True:
+            with call.changed:
+                while seen == len(call.pieces) and not call.finished:
+                    call.changed.wait()
+                pieces = call.pieces[seen:]
+                finished, error = call.finished, call.error
+
+            yield from pieces
+            seen += len(pieces)
+
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+    def _admit(self):
+        if self._slots.acquire(blocking=False):
+            return
+
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise Overloaded("Too many requests waiting on the language model")
+            self._waiting += 1
+
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise Overloaded("Timed out waiting on the language model")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._in_flight), 'streams': len(self._streams), 'waiting': self._waiting}
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on one event loop."""
+
+    def __init__(self, max_concurrent=LLM_MAX_CONCURRENT, max_queue=LLM_MAX_QUEUE, queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = None
+        self._in_flight = {}
+        self._streams = {}
+        self._waiting = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        call = self._in_flight.get(key)
+        if call is not None:
+            return await asyncio.shield(call)
+
+        call = asyncio.ensure_future(self._run(fn, *args, **kwargs))
+        self._in_flight[key] = call
+        call.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        return await asyncio.shield(call)
+
+    async def _run(self, fn, *args, **kwargs):
+        await self._acquire()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+    async def stream(self, key, fn, *args, **kwargs):
+        """SingleFlight.stream for async generators, returns an async iterator of pieces."""
+        call = self._streams.get(key)
+        if call is not None:
+            return self._follow(call)
+
+        call = _Stream(asyncio.Event())
+        self._streams[key] = call
+
+        try:
+            await self._acquire()
+        except Exception as e:
+            self._end_stream(key, call, e)
+            raise
+
+        return _AsyncLeaderStream(self, key, call, lambda: fn(*args, **kwargs))
+
+    def _end_stream(self, key, call, error):
+        if self._streams.get(key) is call:
+            del self._streams[key]
+        call.error = error
+        call.finished = True
+        _notify(call)
+
+    async def _follow(self, call):
+        seen = 0
+        while True:
+            while seen == len(call.pieces) and not call.finished:
+                await call.changed.wait()
+
+            pieces = call.pieces[seen:]
+            for piece in pieces:
+                yield piece
+            seen += len(pieces)
+
+            if call.finished and seen == len(call.pieces):
+                if call.error is not None:
+                    raise call.error
+                return
+
+    async def _acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+
+        if self._slots.locked():
+            if self._waiting >= self.max_queue:
+                raise Overloaded("Too many requests waiting on the language model")
+
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise Overloaded("Timed out waiting on the language model")
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+
+    def stats(self):
+        return {'in_flight': len(self._in_flight), 'streams': len(self._streams), 'waiting': self._waiting}
+
+
+def _notify(call):
+    # Wakes every follower waiting on the current event, later waits use a fresh one
+    changed, call.changed = call.changed, asyncio.Event()
+    changed.set()
+
+
+class _AsyncLeaderStream:
+    """_LeaderStream for AsyncSingleFlight.stream."""
+
+    def __init__(self, flight, key, call, open_stream):
+        self._flight = flight
+        self._key = key
+        self._call = call
+        self._open_stream = open_stream
+        self._pieces = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+
+        try:
+            if self._pieces is None:
+                self._pieces = self._open_stream().__aiter__()
+            piece = await self._pieces.__anext__()
+        except StopAsyncIteration:
+            self._end(None)
+            raise
+        except BaseException as e:
+            # Cancellation included, so followers aren't left waiting
+            self._end(e if isinstance(e, Exception) else _abandoned())
+            raise
+
+        self._call.pieces.append(piece)
+        _notify(self._call)
+        return piece
+
+    async def aclose(self):
+        if self._pieces is not None and hasattr(self._pieces, 'aclose'):
+            await self._pieces.aclose()
+        self._end(_abandoned())
+
+    def _end(self, error):
+        if self._closed:
+            return
+        self._closed = True
+        self._flight._slots.release()
+        self._flight._end_stream(self._key, self._call, error)
+
+
+# Shared by every LLM backed digest so the cap applies process wide
+llm_flight = SingleFlight()
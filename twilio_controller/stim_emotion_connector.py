@@ -1,28 +1,126 @@
-import pickle
 import re
-from object_recognition import recognize_objects
-import os
+import threading
+from twilio_controller.object_extraction import extract_objects
+from twilio_controller.emotion_model import load_model
+from twilio_controller.emotion_batcher import EMOTION_BATCHING, EMOTION_BATCH_PROCESSES, get_batcher
+from twilio_controller.object_matcher import find_mentions
+import numpy as np
 
-model = pickle.load(open(os.path.join(os.getcwd(), 'twilio_controller\\rf_model.pkl'), 'rb'))
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    # Loaded on first use, once per process: the mmapped artifact if there's a
+    # current one (see emotion_model.py), else the pickle
+    global _model
+
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model()
+    return _model
+
+def preload():
+    """
+    Loads the model before worker processes fork so they inherit it, and warms the
+    artifact's pages. Call it from the parent, e.g. a gunicorn on_starting hook.
+    Does nothing when sentences are classified in the batcher's spawned processes,
+    which load their own copy; keep the mmapped artifact exported (emotion_model.py)
+    so that's a map of shared pages rather than a pickle load per process.
+    """
+    if EMOTION_BATCHING and EMOTION_BATCH_PROCESSES:
+        return None
+
+    model = get_model()
+    if hasattr(model, 'warm'):
+        model.warm()
+    return model
+
+def emotion_classes():
+    return get_model().classes_
+
+def predict_proba(sentences):
+    # Shared micro-batches with other pipelines in this process, unless batching is off
+    if EMOTION_BATCHING:
+        return get_batcher().classify(sentences)
+    return get_model().predict_proba(sentences)
+
+def split_sentences(text):
+    return re.split(r'(?<=[.!?]) +', text)
+
+def score_sentences(sentences, objects=None, mentions=None):
+    """
+    Probability scores for each sentence from one predict_proba call. Given the
+    recognized objects (or their mentions from find_mentions), sentences that
+    mention none of them aren't classified and score None.
+    """
+    sentences = list(sentences)
+
+    if mentions is None and objects is not None:
+        mentions = find_mentions(objects, sentences)
+
+    if mentions is None:
+        wanted = list(range(len(sentences)))
+    else:
+        wanted = sorted({i for counts in mentions.values() for i in counts})
+
+    scores = [None] * len(sentences)
+    if wanted:
+        probabilities = predict_proba([sentences[i] for i in wanted])
+        for i, row in zip(wanted, probabilities):
+            scores[i] = row
+
+    return scores
+
+def score_transcripts(sentence_lists):
+    """score_sentences for several transcripts at once, still a single predict_proba call."""
+    sentence_lists = [list(sentences) for sentences in sentence_lists]
+    flat = [sentence for sentences in sentence_lists for sentence in sentences]
+    if not flat:
+        return [[] for _ in sentence_lists]
+
+    probabilities = predict_proba(flat)
+
+    results = []
+    start = 0
+    for sentences in sentence_lists:
+        results.append(list(probabilities[start:start + len(sentences)]))
+        start += len(sentences)
+
+    return results
+
+def connect_objects(objects, sentences, sentence_scores, mentions=None):
+    """
+    Maps each mentioned object → {emotion: score}, averaging the scores of every
+    sentence that mentions it, weighted by how often it's mentioned there.
+    """
+    if mentions is None:
+        mentions = find_mentions(objects, sentences)
 
-def draw_connections(text):
     object_emotions = {}
-    objects = recognize_objects(text)   # assumes this returns a list of objects
-    sentences = re.split(r'(?<=[.!?]) +', text)
-
-    for sentence in sentences:
-        scores = model.predict_proba([sentence])[0]  # probability scores for this sentence
-        for obj in objects:
-            print(obj)
-            if obj in sentence:
-                # Map object → {emotion: score}
-                object_emotions[obj] = {
-                    emotion: float(score)
-                    for emotion, score in zip(model.classes_, scores)
-                }
+    classes = emotion_classes()
+
+    for obj, counts in mentions.items():
+        scored = [(sentence_scores[i], count) for i, count in counts.items() if sentence_scores[i] is not None]
+        if not scored:
+            continue
+
+        rows, weights = zip(*scored)
+        mean = np.average(np.asarray(rows, dtype=float), axis=0, weights=weights)
+        object_emotions[obj] = {
+            emotion: float(score)
+            for emotion, score in zip(classes, mean)
+        }
 
     return object_emotions
 
+def draw_connections(text):
+    objects = extract_objects(text)
+    sentences = split_sentences(text)
+    mentions = find_mentions(objects, sentences)
+
+    return connect_objects(objects, sentences, score_sentences(sentences, mentions=mentions), mentions)
+
 
 # if __name__=="__main__":
-#     print(draw_connections("Hi, I just woke up. I'm talking to my best friend right now, and I'm really sad that she's so far away from me. I wish she were right next to me, but I am also looking forward to today because I'm going out with my other friends in the evening."))
\ No newline at end of file
+#     print(draw_connections("Hi, I just woke up. I'm talking to my best friend right now, and I'm really sad that she's so far away from me. I wish she were right next to me, but I am also looking forward to today because I'm going out with my other friends in the evening."))
@@ -0,0 +1,112 @@
+from twilio_controller.db_pool import connection
+import sys
+
+# Sums one call's freshly inserted stimuli into the rollup, run in the same
+# transaction as the Stimuli insert so the two can't drift apart
+UPDATE_FOR_CALL = '''
+INSERT INTO "Stim_Daily_Rollup"
+    (user_id, name, day, mentions, anger_sum, fear_sum, joy_sum, love_sum, sadness_sum, surprise_sum)
+SELECT uc.user_id, s.name, s.created_at::date, COUNT(*),
+    SUM(COALESCE(s.anger, 0)), SUM(COALESCE(s.fear, 0)), SUM(COALESCE(s.joy, 0)),
+    SUM(COALESCE(s.love, 0)), SUM(COALESCE(s.sadness, 0)), SUM(COALESCE(s.surprise, 0))
+FROM "Stimuli" s
+JOIN "User_Call" uc ON uc.id = s.user_call_id
+WHERE s.user_call_id = %s
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, name, day) DO UPDATE SET
+    mentions = "Stim_Daily_Rollup".mentions + EXCLUDED.mentions,
+    anger_sum = "Stim_Daily_Rollup".anger_sum + EXCLUDED.anger_sum,
+    fear_sum = "Stim_Daily_Rollup".fear_sum + EXCLUDED.fear_sum,
+    joy_sum = "Stim_Daily_Rollup".joy_sum + EXCLUDED.joy_sum,
+    love_sum = "Stim_Daily_Rollup".love_sum + EXCLUDED.love_sum,
+    sadness_sum = "Stim_Daily_Rollup".sadness_sum + EXCLUDED.sadness_sum,
+    surprise_sum = "Stim_Daily_Rollup".surprise_sum + EXCLUDED.surprise_sum
+'''
+
+RAW_AGGREGATE = '''
+SELECT uc.user_id, s.name, s.created_at::date AS day, COUNT(*) AS mentions,
+    SUM(COALESCE(s.anger, 0)) AS anger_sum, SUM(COALESCE(s.fear, 0)) AS fear_sum,
+    SUM(COALESCE(s.joy, 0)) AS joy_sum, SUM(COALESCE(s.love, 0)) AS love_sum,
+    SUM(COALESCE(s.sadness, 0)) AS sadness_sum, SUM(COALESCE(s.surprise, 0)) AS surprise_sum
+FROM "Stimuli" s
+JOIN "User_Call" uc ON uc.id = s.user_call_id
+WHERE uc.user_id IS NOT NULL
+GROUP BY 1, 2, 3
+'''
+
+# Weekly top stimuli: at most 7 rollup rows per name instead of every raw mention
+TOP_OF_WEEK = '''
+SELECT name, SUM(mentions) AS mentions,
+    SUM(anger_sum) / SUM(mentions), SUM(fear_sum) / SUM(mentions),
+    SUM(joy_sum) / SUM(mentions), SUM(love_sum) / SUM(mentions),
+    SUM(sadness_sum) / SUM(mentions), SUM(surprise_sum) / SUM(mentions)
+FROM "Stim_Daily_Rollup"
+WHERE day > CURRENT_DATE - 7
+AND (%s::bigint IS NULL OR user_id = %s)
+GROUP BY name
+ORDER BY mentions DESC
+LIMIT %s
+'''
+
+CHECK = f'''
+SELECT COALESCE(r.user_id, raw.user_id), COALESCE(r.name, raw.name), COALESCE(r.day, raw.day),
+    r.mentions, raw.mentions
+FROM "Stim_Daily_Rollup" r
+FULL OUTER JOIN ({RAW_AGGREGATE}) raw
+    ON r.user_id = raw.user_id AND r.name = raw.name AND r.day = raw.day
+WHERE r.user_id IS NULL OR raw.user_id IS NULL
+    OR r.mentions <> raw.mentions
+    OR abs(r.anger_sum - raw.anger_sum) > 1e-6 OR abs(r.fear_sum - raw.fear_sum) > 1e-6
+    OR abs(r.joy_sum - raw.joy_sum) > 1e-6 OR abs(r.love_sum - raw.love_sum) > 1e-6
+    OR abs(r.sadness_sum - raw.sadness_sum) > 1e-6 OR abs(r.surprise_sum - raw.surprise_sum) > 1e-6
+'''
+
+
+def update_for_call(cur, call_id):
+    cur.execute(UPDATE_FOR_CALL, (call_id,))
+
+
+def top_of_week(cur, user_id=None, limit=3):
+    cur.execute(TOP_OF_WEEK, (user_id, user_id, limit))
+    return cur.fetchall()
+
+
+def rebuild():
+    """Recomputes the whole rollup from Stimuli in one transaction."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('LOCK TABLE "Stim_Daily_Rollup" IN EXCLUSIVE MODE')
+            cur.execute('DELETE FROM "Stim_Daily_Rollup"')
+            cur.execute(f'''
+                INSERT INTO "Stim_Daily_Rollup"
+                    (user_id, name, day, mentions, anger_sum, fear_sum, joy_sum, love_sum, sadness_sum, surprise_sum)
+                {RAW_AGGREGATE}
+            ''')
+            rows = cur.rowcount
+        conn.commit()
+
+    return rows
+
+
+def check():
+    """Returns (user_id, name, day, rollup_mentions, raw_mentions) for every row that disagrees with Stimuli."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CHECK)
+            return cur.fetchall()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == "rebuild":
+        print(f"Rebuilt Stim_Daily_Rollup with {rebuild()} rows")
+    elif command == "check":
+        mismatches = check()
+        for mismatch in mismatches:
+            print(f"Mismatch: {mismatch}")
+        print(f"{len(mismatches)} mismatched rows")
+        sys.exit(1 if mismatches else 0)
+    else:
+        print("Usage: python -m twilio_controller.stim_rollup rebuild|check")
+        sys.exit(2)
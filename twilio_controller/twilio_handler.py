@@ -1,13 +1,21 @@
 from twilio.rest import Client
-from openai import OpenAI
 from load_dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor
-from stim_emotion_connector import draw_connections
-from insight_generation import find_similar_stims, grab_previous_insights, generate_insights
-import psycopg
+from twilio_controller.object_extraction import extract_objects
+from twilio_controller.stim_emotion_connector import split_sentences, score_sentences, connect_objects
+from twilio_controller.object_matcher import find_mentions
+from twilio_controller.insight_generation import find_similar_stims_by_object, generate_insights
+from twilio_controller.insight_summaries import insight_context
+from twilio_controller.pipeline import Pipeline, StageError
+from twilio_controller.db_pool import connection
+from twilio_controller.stim_rollup import update_for_call as update_rollup_for_call
+from twilio_controller.digest_cache import invalidate_user
+from twilio_controller.weekly_context import WeeklyCall, append_call
+from twilio_controller.weekly_prompt import summarize_call
+from twilio_controller.llm_gateway import chat, transcribe
+from twilio_controller import job_queue
 import requests
 import os
-from flask import Flask
+from flask import Flask, request
 
 app = Flask(__name__)
 
@@ -25,7 +33,6 @@ account_sid = os.getenv('TWILIO_ACCOUNT_SID')
 auth_token = os.getenv('TWILIO_AUTH_TOKEN')
 twilio_url = os.getenv('TWILIO_XML_URL')
 client = Client(account_sid, auth_token)
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 def make_call():
     call = client.calls.create(
@@ -38,8 +45,14 @@ def make_call():
 
     print(f"Call SID: {call.sid}")
 
-def get_most_recent_recording():
-    recordings = client.recordings.list(limit=1)
+def get_most_recent_recording(recording_sid=None, call_sid=None):
+    # Prefer the exact recording Twilio told us about, so a retried job reprocesses the same call
+    if recording_sid:
+        recordings = [client.recordings(recording_sid).fetch()]
+    elif call_sid:
+        recordings = client.recordings.list(call_sid=call_sid, limit=1)
+    else:
+        recordings = client.recordings.list(limit=1)
     path = os.path.join(os.getcwd(), "twilio_controller\\raw_recordings\\")
 
     for rec in recordings:
@@ -50,159 +63,165 @@ def get_most_recent_recording():
             f.write(response.content)
 
         # Transcribe using Whisper
-        with open(f"{path}{rec.sid}.wav", "rb") as audio_file:
-            transcript = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
+        transcript = transcribe(f"{path}{rec.sid}.wav")
 
-        return {'recording_id': rec.sid, 'transcript': transcript.text}
+        return {'recording_id': rec.sid, 'transcript': transcript}
 
 def response_cleaner(response):
     transcript = response.get('transcript')
 
-    output = openai_client.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=[
+    return chat('cleaner', [
         {"role": "developer", "content": SYSTEM_PROMPT},
         {"role": "user", "content": f"Transcript: {transcript}"}
-    ]
-    )
-
-    return output.choices[0].message.content
+    ])
 
 @app.route('/post-call-action', methods=['GET'])
 def twilio_call_end_pipeline():
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        # Step 1: Get the recording from Twilio
-        future_recording = executor.submit(get_most_recent_recording)
-        recording_transcript = future_recording.result()  # waits until done
-
-        # Step 2: Clean the transcript
-        future_cleaned = executor.submit(response_cleaner, recording_transcript)
-        cleaned_transcript = future_cleaned.result()  # waits until done
-
-    # SQL stuff now
-    print('HERE 1')
+    # The pipeline takes tens of seconds, so the webhook only queues it and an
+    # ingestion_worker picks it up
     try:
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        #TODO: MAKE SURE TO CHANGE THE USER ID TO AN INPUT FROM SESSION
-        query = '''
-            INSERT INTO "User_Call" (raw_text, cleaned_text, user_id, recording_id)
-            VALUES (%s, %s, 3, %s)
-            RETURNING id
-        '''
-
-        cur.execute(query, (recording_transcript.get('transcript'), cleaned_transcript, recording_transcript.get('recording_id')))
-        result = cur.fetchone()
-        print(f"Current ID from Supabase: {result[0]}")
-
-        conn.commit()
-
+        job_id = job_queue.enqueue('post_call', {
+            'recording_sid': request.args.get('RecordingSid'),
+            'call_sid': request.args.get('CallSid'),
+        })
     except Exception as e:
         print(f"Error connecting or querying Supabase: {e}")
         return "Errorr", 400
 
-    finally:
-        # Close the cursor and connection
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+    return {"job_id": job_id, "status": "queued"}, 202
 
-    print('HERE 2')
-
-    # SQL Stuff for stims now
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job_status(job_id):
     try:
-        stim_data = draw_connections(cleaned_transcript)
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        #TODO: MAKE SURE TO CHANGE THE USER ID TO AN INPUT FROM SESSION
-        query = '''
-            INSERT INTO "Stimuli" (user_call_id, name, anger, fear, joy, love, sadness, surprise)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        '''
-
-        for obj, emotions in stim_data.items():
-            cur.execute(query, (
-                result[0],                  # user_call_id (hardcoded for now)
-                obj,                # name (the object text)
-                emotions.get("anger", 0),
-                emotions.get("fear", 0),
-                emotions.get("joy", 0),
-                emotions.get("love", 0),
-                emotions.get("sadness", 0),
-                emotions.get("surprise", 0),
-            ))
-            stim_id = cur.fetchone()[0]
-        # result = cur.fetchone()
-            print(f"Current ID from Supabase: {stim_id}")
-
-        conn.commit()
-
+        job = job_queue.get_job(job_id)
     except Exception as e:
         print(f"Error connecting or querying Supabase: {e}")
         return "Errorr", 400
 
-    finally:
-        # Close the cursor and connection
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
-
-    print('HERE 3')
+    if not job:
+        return {"message": "Job not found"}, 404
+    return job, 200
+
+# All of a call's rows are written in one transaction with a fixed number of
+# statements, however many stimuli it has
+INSERT_CALL = '''
+    INSERT INTO "User_Call" (raw_text, cleaned_text, user_id, recording_id, summary)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING id, created_at
+'''
+
+INSERT_STIMULI = '''
+    INSERT INTO "Stimuli" (user_call_id, name, anger, fear, joy, love, sadness, surprise)
+    SELECT %s, * FROM unnest(
+        %s::text[], %s::float8[], %s::float8[], %s::float8[], %s::float8[], %s::float8[], %s::float8[]
+    )
+    RETURNING id
+'''
+
+INSERT_INSIGHT = '''
+    INSERT INTO "Call_Insights" (insight, user_id, call_id)
+    VALUES (%s, %s, %s)
+    RETURNING id
+'''
+
+INSERT_STIM_INSIGHTS = '''
+    INSERT INTO "Stim_Insight" (stim_id, insight_id)
+    SELECT unnest(%s::bigint[]), %s
+'''
+
+EXISTING_CALL = '''
+    SELECT uc.id, ci.id
+    FROM "User_Call" uc
+    LEFT JOIN "Call_Insights" ci ON ci.call_id = uc.id
+    WHERE uc.recording_id = %s
+    LIMIT 1
+'''
+
+EMOTIONS = ["anger", "fear", "joy", "love", "sadness", "surprise"]
+
+def store_call(recording, cleaned, call_summary, stim_data, new_insights, similar_stim_ids, user_id=3):
+    """Writes the call, its stimuli, the rollup, its insight and the insight links atomically."""
+    #TODO: MAKE SURE TO CHANGE THE USER ID TO AN INPUT FROM SESSION
+    names = list(stim_data.keys())
+    emotion_columns = [[stim_data[name].get(emotion, 0) for name in names] for emotion in EMOTIONS]
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            # A retried job whose first attempt already committed mustn't store the call twice
+            cur.execute(EXISTING_CALL, (recording.get('recording_id'),))
+            existing = cur.fetchone()
+            if existing:
+                print(f"Recording {recording.get('recording_id')} already stored as call {existing[0]}")
+                return {'call_id': existing[0], 'insight_id': existing[1], 'stim_ids': []}
+
+            cur.execute(INSERT_CALL, (recording.get('transcript'), cleaned, user_id, recording.get('recording_id'), call_summary))
+            call_id, created_at = cur.fetchone()
+
+            cur.execute(INSERT_STIMULI, (call_id, names, *emotion_columns))
+            stim_ids = [row[0] for row in cur.fetchall()]
+
+            update_rollup_for_call(cur, call_id)
+
+            cur.execute(INSERT_INSIGHT, (new_insights, user_id, call_id))
+            insight_id = cur.fetchone()[0]
+
+            # The insight belongs to the stimuli just stored as well as the earlier
+            # ones they matched, so a first mention still has its insight
+            linked_stim_ids = list(dict.fromkeys(stim_ids + list(similar_stim_ids)))
+            cur.execute(INSERT_STIM_INSIGHTS, (linked_stim_ids, insight_id))
 
-    #SQL Stuff for insights!
-    try:
-        similar_stim_ids = find_similar_stims(list(stim_data.keys()))
-        previous_insights = grab_previous_insights(stim_ids=similar_stim_ids)
-        print('PREV_INSIGHTS', previous_insights)
-        new_insights = generate_insights(previous_insights, cleaned_transcript)
-        conn = psycopg.connect(os.getenv('SUPABASE_URL'), options="-c prepare_threshold=0")
-        cur = conn.cursor()
-
-        insight_table = '''
-        INSERT INTO "Call_Insights"
-        (insight, user_id, call_id) VALUES (%s, %s, %s)
-        RETURNING id
-        '''
-
-        insight_stim_table = '''
-        INSERT INTO "Stim_Insight" (stim_id, insight_id)
-        VALUES (%s, %s)
-        '''
-
-        cur.execute(insight_table, (new_insights, 3, result[0]))
-        insight_id = cur.fetchone()[0]
         conn.commit()
 
-        for stim_id in similar_stim_ids:
-            cur.execute(insight_stim_table, (stim_id, insight_id))
-            conn.commit()
-
-    except Exception as e:
-        print(f"Error connecting or querying Supabase: {e}")
-        return "Errorr", 400
-
-    finally:
-        # Close the cursor and connection
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+    print(f"Stored call {call_id} with {len(stim_ids)} stimuli and insight {insight_id}")
+
+    # The week's digests now have a new call to take into account
+    invalidate_user(user_id)
+    append_call(user_id, WeeklyCall(call_id, created_at, cleaned, insight_id, new_insights, call_summary))
+
+    return {'call_id': call_id, 'insight_id': insight_id, 'stim_ids': stim_ids}
+
+# Stage graph for one call. After cleaning, object recognition, the call summary
+# and sentence splitting run side by side; objects are matched to sentences in one
+# pass and only sentences mentioning one are scored, in one batch, overlapping
+# with the similar-stimulus lookup.
+# Everything is written in one transaction at the end.
+call_pipeline = (
+    Pipeline()
+    .add('recording', get_most_recent_recording, ['recording_sid', 'call_sid'])
+    .add('cleaned', lambda recording: response_cleaner(recording), ['recording'])
+    .add('objects', lambda cleaned, user_id: extract_objects(cleaned, user_id), ['cleaned', 'user_id'])
+    .add('call_summary', lambda cleaned: summarize_call(cleaned), ['cleaned'])
+    .add('sentences', lambda cleaned: split_sentences(cleaned), ['cleaned'])
+    .add('mentions', lambda objects, sentences: find_mentions(objects, sentences), ['objects', 'sentences'])
+    .add('sentence_scores', lambda sentences, mentions: score_sentences(sentences, mentions=mentions), ['sentences', 'mentions'])
+    .add('stim_data', lambda objects, sentences, sentence_scores, mentions: connect_objects(objects, sentences, sentence_scores, mentions),
+         ['objects', 'sentences', 'sentence_scores', 'mentions'])
+    .add('similar_by_object', lambda objects: find_similar_stims_by_object(objects), ['objects'])
+    .add('similar_stim_ids', lambda similar_by_object, stim_data: list(dict.fromkeys(similar_by_object[obj] for obj in stim_data if obj in similar_by_object)),
+         ['similar_by_object', 'stim_data'])
+    .add('previous_insights', lambda similar_stim_ids: insight_context(similar_stim_ids, refresh_first=True), ['similar_stim_ids'])
+    .add('new_insights', lambda previous_insights, cleaned: generate_insights(previous_insights, cleaned), ['previous_insights', 'cleaned'])
+    .add('stored', store_call, ['recording', 'cleaned', 'call_summary', 'stim_data', 'new_insights', 'similar_stim_ids', 'user_id'])
+)
+
+def run_call_pipeline(recording_sid=None, call_sid=None, user_id=3):
+    """Download, transcribe, analyse and store one call. Raises on failure so the job is retried."""
+    #TODO: MAKE SURE TO CHANGE THE USER ID TO AN INPUT FROM SESSION
+    try:
+        results, timings = call_pipeline.run(recording_sid=recording_sid, call_sid=call_sid, user_id=user_id)
+    except StageError as e:
+        print(f"Pipeline failed at {e.stage}: {e.__cause__}, timings: {e.timings}")
+        raise
 
-    print('HERE 4')
+    print(f"Pipeline timings: {timings}")
 
     return {
-        "recording_id": recording_transcript.get("recording_id"),
-        "raw_transcript": recording_transcript.get("transcript"),
-        "cleaned_transcript": cleaned_transcript
-    }, 200
+        "recording_id": results['recording'].get("recording_id"),
+        "raw_transcript": results['recording'].get("transcript"),
+        "cleaned_transcript": results['cleaned'],
+        "call_id": results['stored']['call_id'],
+        "stage_timings": timings
+    }
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
\ No newline at end of file
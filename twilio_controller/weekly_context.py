@@ -0,0 +1,205 @@
+from load_dotenv import load_dotenv
+from twilio_controller.db_pool import connection
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+import threading
+import asyncio
+import time
+import os
+
+load_dotenv()
+
+WEEKLY_CONTEXT_TTL = float(os.getenv('WEEKLY_CONTEXT_TTL', 60))  # seconds before checking the db for new calls
+# The incremental refresh only sees rows with ids above the snapshot's, so it misses
+# calls committed out of id order and later summary updates; reload in full this often
+WEEKLY_CONTEXT_FULL_RELOAD = float(os.getenv('WEEKLY_CONTEXT_FULL_RELOAD', 600))
+WINDOW = timedelta(days=7)
+
+# Calls (with their insight, if one exists yet) from the last 7 days. The
+# since_call/since_insight bounds let a refresh pull only what's new.
+WEEK_QUERY = """
+SELECT uc.id, uc.created_at, uc.cleaned_text, ci.id, ci.insight, uc.summary
+FROM "User_Call" uc
+LEFT JOIN "Call_Insights" ci ON uc.id = ci.call_id
+WHERE uc.created_at >= NOW() - INTERVAL '7 days'
+AND (%s::bigint IS NULL OR uc.user_id = %s)
+AND (uc.id > %s OR ci.id > %s)
+ORDER BY uc.created_at DESC
+"""
+
+
+class WeeklyCall(NamedTuple):
+    call_id: int
+    created_at: datetime
+    transcript: str
+    insight_id: int
+    insight: str
+    summary: str = None
+
+
+class WeeklySnapshot(NamedTuple):
+    """
+    Immutable view of one user's last 7 days of calls, newest first. fingerprint is
+    the digest_cache week fingerprint read before the last full load, if one was given.
+    """
+    user_id: int
+    calls: tuple
+    loaded_at: float
+    fingerprint: str = None
+    reloaded_at: float = 0
+
+    @property
+    def max_call_id(self):
+        return max((c.call_id for c in self.calls), default=0)
+
+    @property
+    def max_insight_id(self):
+        return max((c.insight_id or 0 for c in self.calls), default=0)
+
+    def with_calls(self, new_calls, now=None):
+        """Returns a new snapshot with new_calls merged in and anything older than 7 days dropped."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - WINDOW
+
+        # New rows win over the same (call, insight) row, and over an insight-less
+        # row for a call that has since got its insight
+        new_keys = {(c.call_id, c.insight_id) for c in new_calls}
+        new_call_ids = {c.call_id for c in new_calls}
+        kept = [
+            c for c in self.calls
+            if (c.call_id, c.insight_id) not in new_keys
+            and not (c.insight_id is None and c.call_id in new_call_ids)
+        ]
+
+        calls = [c for c in list(new_calls) + kept if c.created_at >= cutoff]
+        calls.sort(key=lambda c: c.created_at, reverse=True)
+
+        return self._replace(calls=tuple(calls), loaded_at=time.monotonic())
+
+    def with_insights(self):
+        """Calls that have an insight, as the advice and affirmation prompts expect."""
+        return [c for c in self.calls if c.insight is not None]
+
+    def unique_calls(self):
+        """One entry per call regardless of how many insights it has."""
+        seen = set()
+        calls = []
+        for c in self.calls:
+            if c.call_id not in seen:
+                seen.add(c.call_id)
+                calls.append(c)
+        return calls
+
+
+_snapshots = {}
+_locks = {}
+_locks_lock = threading.Lock()
+_async_locks = {}
+
+
+def _user_lock(user_id):
+    with _locks_lock:
+        return _locks.setdefault(user_id, threading.Lock())
+
+
+def _fetch(user_id, since_call, since_insight):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(WEEK_QUERY, (user_id, user_id, since_call, since_insight))
+            return [WeeklyCall(*row) for row in cur.fetchall()]
+
+
+def _fingerprint_changed(snapshot, fingerprint):
+    return fingerprint is not None and snapshot.fingerprint != fingerprint
+
+
+def _is_fresh(snapshot, fingerprint):
+    return (snapshot is not None
+            and not _fingerprint_changed(snapshot, fingerprint)
+            and time.monotonic() - snapshot.loaded_at < WEEKLY_CONTEXT_TTL)
+
+
+def _needs_full_load(snapshot, fingerprint):
+    return (snapshot is None
+            or _fingerprint_changed(snapshot, fingerprint)
+            or time.monotonic() - snapshot.reloaded_at >= WEEKLY_CONTEXT_FULL_RELOAD)
+
+
+def _loaded(user_id, rows, fingerprint):
+    now = time.monotonic()
+    return WeeklySnapshot(user_id, tuple(rows), now, fingerprint, now)
+
+
+def weekly_snapshot(user_id=None, fingerprint=None):
+    """
+    Returns the user's weekly snapshot. Concurrent callers share one load, and
+    once the TTL passes only calls/insights newer than the snapshot are fetched.
+    Given the current week fingerprint (digest_cache.week_fingerprint), a snapshot
+    loaded under a different one is reloaded straight away, so a digest cached
+    under that fingerprint is never built from older calls.
+    """
+    snapshot = _snapshots.get(user_id)
+    if _is_fresh(snapshot, fingerprint):
+        return snapshot
+
+    with _user_lock(user_id):
+        snapshot = _snapshots.get(user_id)
+        if _is_fresh(snapshot, fingerprint):
+            return snapshot
+
+        if _needs_full_load(snapshot, fingerprint):
+            snapshot = _loaded(user_id, _fetch(user_id, 0, 0), fingerprint or (snapshot and snapshot.fingerprint))
+        else:
+            new_calls = _fetch(user_id, snapshot.max_call_id, snapshot.max_insight_id)
+            snapshot = snapshot.with_calls(new_calls)
+
+        _snapshots[user_id] = snapshot
+        return snapshot
+
+
+async def weekly_snapshot_async(user_id=None, fingerprint=None):
+    """weekly_snapshot for the async app, same cache and refresh rules."""
+    from twilio_controller.async_db_pool import async_connection
+
+    snapshot = _snapshots.get(user_id)
+    if _is_fresh(snapshot, fingerprint):
+        return snapshot
+
+    async with _async_locks.setdefault(user_id, asyncio.Lock()):
+        snapshot = _snapshots.get(user_id)
+        if _is_fresh(snapshot, fingerprint):
+            return snapshot
+
+        full = _needs_full_load(snapshot, fingerprint)
+        since_call = 0 if full else snapshot.max_call_id
+        since_insight = 0 if full else snapshot.max_insight_id
+
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(WEEK_QUERY, (user_id, user_id, since_call, since_insight))
+                rows = [WeeklyCall(*row) for row in await cur.fetchall()]
+
+        if full:
+            snapshot = _loaded(user_id, rows, fingerprint or (snapshot and snapshot.fingerprint))
+        else:
+            snapshot = snapshot.with_calls(rows)
+
+        _snapshots[user_id] = snapshot
+        return snapshot
+
+
+def append_call(user_id, call):
+    """
+    Folds a freshly ingested call into any snapshot this process already holds.
+    Other processes (the backend, for calls ingested by a worker) pick it up
+    through the fingerprint check in weekly_snapshot.
+    """
+    for key in (user_id, None):
+        with _user_lock(key):
+            snapshot = _snapshots.get(key)
+            if snapshot is not None:
+                _snapshots[key] = snapshot.with_calls([call])
+
+
+def clear():
+    _snapshots.clear()
@@ -0,0 +1,147 @@
+from load_dotenv import load_dotenv
+from twilio_controller.db_pool import connection
+from twilio_controller.llm_gateway import chat
+from twilio_controller.insight_generation import estimate_tokens
+import sys
+import os
+
+load_dotenv()
+
+# The weekly digests (affirmation, reminders, advice) describe every call from
+# the last 7 days. Each call goes in as its compact summary (or a truncated
+# transcript if it has none), then calls are upgraded to their full transcript,
+# newest first, while the budget allows. If even the compact forms don't fit,
+# the oldest calls are left out.
+WEEKLY_PROMPT_TOKEN_BUDGET = int(os.getenv('WEEKLY_PROMPT_TOKEN_BUDGET', 6000))
+CALL_TRUNCATE_TOKENS = int(os.getenv('CALL_TRUNCATE_TOKENS', 200))
+CALL_SUMMARY_MIN_TOKENS = int(os.getenv('CALL_SUMMARY_MIN_TOKENS', 150))  # shorter calls aren't summarized
+
+SUMMARY_PROMPT = """
+Summarize this audio journal entry in at most 3 sentences. Keep the people, places,
+plans (with any dates or times mentioned) and how the speaker felt about them.
+Write in second person, refer to the speaker as 'You'.
+"""
+
+UNSUMMARIZED_CALLS = '''
+SELECT id, cleaned_text
+FROM "User_Call"
+WHERE summary IS NULL
+AND cleaned_text IS NOT NULL
+AND created_at >= NOW() - INTERVAL '7 days'
+'''
+
+SET_SUMMARY = 'UPDATE "User_Call" SET summary = %s WHERE id = %s'
+
+
+def summarize_call(cleaned_transcript):
+    """Compact summary stored with the call at ingestion, None if the call is short enough as is."""
+    if not cleaned_transcript or estimate_tokens(cleaned_transcript) <= CALL_SUMMARY_MIN_TOKENS:
+        return None
+
+    try:
+        return chat('call_summary', [
+            {"role": "developer", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": cleaned_transcript}
+        ])
+    except Exception as e:
+        # The prompt builder falls back to truncating, don't fail the call over it
+        print(f"Error summarizing call: {e}")
+        return None
+
+
+def truncate(text, max_tokens):
+    if text is None or estimate_tokens(text) <= max_tokens:
+        return text
+
+    cut = text[:max_tokens * 4].rsplit(' ', 1)[0]
+    return f"{cut} ..."
+
+
+def compact_text(call):
+    return call.summary or truncate(call.transcript, CALL_TRUNCATE_TOKENS)
+
+
+def render_with_insight(number, call, text):
+    return (f"Call {number}: \n"
+            f"Transcript: {text} \n"
+            f"Call Insight: {call.insight} \n"
+            "\n")
+
+
+def render_with_date(number, call, text):
+    return (f"Call {number}: \n"
+            f"Date Recorded: {call.created_at} \n"
+            f"Call Transcript: {text} \n"
+            "\n")
+
+
+def messages_for(system_prompt, prompt):
+    return [
+        {"role": "developer", "content": system_prompt},
+        {"role": "user" , "content": prompt}
+    ]
+
+
+def build_prompt(calls, render, token_budget=WEEKLY_PROMPT_TOKEN_BUDGET):
+    """
+    Returns the prompt for calls (newest first) within token_budget.
+    render(number, call, text) formats one call's block with text standing in for its transcript.
+    """
+    calls = list(calls)
+    texts = [compact_text(call) for call in calls]
+
+    def cost(kept, texts):
+        return sum(estimate_tokens(render(number, call, text))
+                   for number, (call, text) in enumerate(zip(kept, texts), start=1))
+
+    # Leave out the oldest calls until the compact forms fit
+    while len(calls) > 1 and cost(calls, texts) > token_budget:
+        calls.pop()
+        texts.pop()
+
+    if calls and cost(calls, texts) > token_budget:
+        texts[0] = truncate(texts[0], max(token_budget - cost(calls, [""]), 1))
+
+    # Spend what's left on full transcripts, newest first
+    used = cost(calls, texts)
+    for i, call in enumerate(calls):
+        if texts[i] == call.transcript:
+            continue
+
+        extra = estimate_tokens(render(i + 1, call, call.transcript)) - estimate_tokens(render(i + 1, call, texts[i]))
+        if used + extra <= token_budget:
+            texts[i] = call.transcript
+            used += extra
+
+    return "".join(render(number, call, text) for number, (call, text) in enumerate(zip(calls, texts), start=1))
+
+
+def backfill():
+    """Summarizes this week's calls that were ingested before summaries existed."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(UNSUMMARIZED_CALLS)
+            rows = cur.fetchall()
+
+    summarized = 0
+    for call_id, cleaned_text in rows:
+        summary = summarize_call(cleaned_text)
+        if summary is None:
+            continue
+
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SET_SUMMARY, (summary, call_id))
+            conn.commit()
+        summarized += 1
+
+    return summarized
+
+
+if __name__ == "__main__":
+    # python -m twilio_controller.weekly_prompt backfill
+    if len(sys.argv) != 2 or sys.argv[1] != 'backfill':
+        print("Usage: python -m twilio_controller.weekly_prompt backfill")
+        sys.exit(1)
+
+    print(f"Summarized {backfill()} calls")